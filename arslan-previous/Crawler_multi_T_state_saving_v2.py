@@ -1,16 +1,39 @@
-import csv
+import asyncio
+import multiprocessing
 import os
+import queue
+import signal
 import socket
 import ssl
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from pymongo.errors import ServerSelectionTimeoutError, DuplicateKeyError
 import subprocess
 import json
 import time
 from cryptography import x509
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from functools import partial
+from itertools import chain as chain_iters, islice, takewhile
+import zlib
+from threading import Lock, Thread
+
+from cert_cache import FingerprintCache, SummaryCache, der_fingerprint
+from cert_parser import parse_certificate_pem, summarize_certificate_der
+from crawl_metrics import CrawlMetrics, MetricsServer, SnapshotWriter
+from crawl_queue import CrawlQueue
+from crawl_stats import CrawlStats, certificate_facts
+from concurrency_control import AimdController, AsyncConnectionGate, ConnectionGate
+from dns_resolver import CachingResolver
+from domain_input import Deduper, InputStats, read_domains
+from log_writer import LogWriter
+from mongo_writer import BulkWriter
+from pipeline import Pipeline, Stage
+from result_sinks import SinkWriter, new_sink
+from resume_store import ResumeStore, SUCCESS, FAILED
+from retry_scheduler import NXDOMAIN, RetryPolicy, RetryScheduler, classify_error
+from tls_profiles import NO_VERIFY, ContextPool, describe_handshake, verifies
+from zcert_pool import ZCertificatePool
 
 # ---------------- MongoDB Setup ----------------
 URL = "mongodb://localhost:27017"
@@ -18,32 +41,186 @@ DB_NAME = "Cloudflare_top-100"
 client = MongoClient(URL, serverSelectionTimeoutMS=5000, connectTimeoutMS=5000)
 db = client[DB_NAME]
 collection = db["certificates"]
+certificates_by_fp = db["certificates_by_fp"]   # one parsed document per distinct certificate
+ca_certificates = db["ca_certificates"]         # intermediates and roots, interned by fingerprint
+crawl_queue_collection = db["crawl_queue"]      # shared work queue for NODE_ROLE = "worker"
+crawl_stats_collection = db["crawl_stats"]      # running counters per run and dataset (python crawl_stats.py)
 
 # ---------------- Config ----------------
-LOG_FILE = "Cloudflare_urls.log"
-FAILURE_FILE = "Cloudflare_urls_failures.txt"   # tracks domains that always fail
-MAX_WORKERS = 5
+LOG_FILE = "Cloudflare_urls.jsonl"   # one JSON record per finished domain
+FAILURE_FILE = "Cloudflare_urls_failures.txt"   # old flat failure list, imported into RESUME_DB once
+RESUME_DB = "Cloudflare_urls_resume.sqlite"     # local record of finished and failed domains for restarts
+RESUME_INDEX = True       # sorted domain hashes in RESUME_DB + ".index" answer new-domain lookups without SQLite
+INPUT_COLUMN = None       # domain column of the input; None = auto-detect ("Websites URL", "domain", Tranco rank,domain...)
+INPUT_STRIP_WWW = True    # crawl "www.example.com" and "example.com" once, as example.com
+INPUT_DEDUP_EXACT_LIMIT = 2_000_000  # exact dedup of input hosts up to this many, then a Bloom filter...
+INPUT_DEDUP_CAPACITY = 50_000_000    # ...sized for this many hosts...
+INPUT_DEDUP_ERROR_RATE = 1e-6        # ...with this chance of dropping a host that was not a duplicate
+ENGINE = "async"          # "async" (single-threaded event loop), "threads" or "pipeline" (staged thread pools)
+SHARDS = 1                # >1: hash-partition the input across this many worker processes
+CRAWL_MODE = "full"       # "full" (CSV domains not finished yet) or "incremental" (also refresh stored domains that are due)
+RECRAWL_MAX_AGE = 7 * 86400  # incremental: refresh domains last seen longer ago than this...
+RECRAWL_EXPIRY_WINDOW = 14 * 86400  # ...or whose certificate expires within this
+RECRAWL_PAGE_SIZE = 1000  # incremental: stored domains fetched per query, so no cursor stays open during the crawl
+NODE_ROLE = "local"       # "local" (crawl the CSV), "coordinator" (load it into crawl_queue) or "worker"
+NODE_ID = f"{socket.gethostname()}-{os.getpid()}"  # lease owner name in crawl_queue
+QUEUE_CLAIM_BATCH = 100   # domains leased per claim round
+QUEUE_LEASE_SECONDS = 300  # a lease not renewed for this long goes back to the queue
+QUEUE_HEARTBEAT_INTERVAL = 60  # seconds between lease renewals
+QUEUE_MAX_ATTEMPTS = 5    # leases per domain before it is given up as failed
+QUEUE_POLL_INTERVAL = 30  # worker wait while other nodes still hold leases
+MAX_WORKERS = 5           # thread pool size for ENGINE = "threads"
+ASYNC_CONCURRENCY = 1000  # upper bound on handshakes in flight for ENGINE = "async"
+ASYNC_BLOCKING_WORKERS = 16  # threads for zcertificate/MongoDB calls in async mode
+PIPELINE_RESOLVE_WORKERS = 32    # ENGINE = "pipeline": threads per stage (resolve -> handshake -> parse;
+PIPELINE_HANDSHAKE_WORKERS = 200  # the bulk writer is the persist stage), sized to where the run is bound
+PIPELINE_PARSE_WORKERS = 4
+PIPELINE_QUEUE_SIZE = 1000  # bounded queue in front of each stage; a full queue blocks the stage before it
+MAX_IN_FLIGHT = 5000      # domains submitted but not yet finished; bounds memory for any input size
+ADAPTIVE_CONCURRENCY = True  # AIMD-adjust the connection limit from observed timeout/error rates
+ADAPTIVE_INITIAL_CONCURRENCY = 100  # async engine starting limit (threads start at MAX_WORKERS)
+ADAPTIVE_MIN_CONCURRENCY = 5
+ADAPTIVE_WINDOW = 200     # attempts between limit adjustments
+ADAPTIVE_ERROR_THRESHOLD = 0.15  # congestion-error share above which the limit is cut
+ADAPTIVE_INCREASE = 20    # added to the limit after a clean window
+ADAPTIVE_DECREASE_FACTOR = 0.5
+CONGESTION_ERRORS = ("timeout", "other")  # error classes that count as congestion
+PER_IP_MAX_CONNECTIONS = 8   # simultaneous connections to one resolved IP
+PER_IP_RATE = 10.0        # new connections per second to one IP (token bucket)
+PER_IP_BURST = 10
 CONNECT_TIMEOUT = 3
-ZCERT_TIMEOUT = 5
+TLS_PROFILE = "verify"    # "verify", "no_verify", "tls1_2" or "tls1_3" (see tls_profiles.py)
+TLS_CAPTURE_INVALID = True  # on a verification failure, re-handshake without verification and keep the cert
+TLS_ALPN_PROTOCOLS = ("h2", "http/1.1")  # offered so the negotiated ALPN can be recorded
+DNS_CONCURRENCY = 64      # parallel DNS lookups, separate from the connect slots
+DNS_TIMEOUT = 3
+DNS_DEFAULT_TTL = 300     # cache lifetime when the resolver gives no TTL (getaddrinfo)
+DNS_NEGATIVE_TTL = 3600   # cache lifetime of NXDOMAIN / no-address answers
+DNS_CACHE_SIZE = 100000   # cached names (LRU); about 400 bytes each
+ZCERT_TIMEOUT = 5         # per-call timeout when ZCERT_POOL_SIZE = 0
+CERT_PARSER = "native"    # "native" (in-process cryptography.x509) or "zcertificate"
+ZCERT_POOL_SIZE = 4       # persistent zcertificate processes; 0 = one process per certificate
+ZCERT_BATCH_SIZE = 64     # PEMs written to one zcertificate process at a time
+ZCERT_FLUSH_INTERVAL = 0.05  # seconds to wait for a batch to fill before sending it
+ZCERT_BATCH_TIMEOUT = 10  # seconds for a whole batch before the process is restarted
 MAX_RETRIES = 2
 RETRY_BACKOFF_BASE = 1.2
+RETRY_JITTER = 0.2        # +/- fraction applied to every retry delay
+# Per error class: RetryPolicy(max retries, backoff base in seconds, max delay)
+RETRY_POLICIES = {
+    "timeout": RetryPolicy(MAX_RETRIES, RETRY_BACKOFF_BASE, 30),
+    "refused": RetryPolicy(1, 2.0, 30),
+    "ssl": RetryPolicy(0, RETRY_BACKOFF_BASE),  # handshake/verification failures repeat deterministically
+    "dns": RetryPolicy(MAX_RETRIES, 2.0, 30),   # only transient DNS errors; NXDOMAIN is never retried
+}
+DEFAULT_RETRY_POLICY = RetryPolicy(MAX_RETRIES, RETRY_BACKOFF_BASE, 30)
+# Seconds a failed domain is skipped by later runs before it is probed again, per error class
+FAILURE_TTLS = {
+    "nxdomain": 30 * 86400,
+    "dns": 86400,           # SERVFAIL / resolver timeouts
+    "timeout": 6 * 3600,
+    "refused": 86400,
+    "ssl": 7 * 86400,
+    "process": 7 * 86400,   # certificate could not be parsed or stored
+}
+DEFAULT_FAILURE_TTL = 86400  # "other" and failures imported from FAILURE_FILE
+CERT_STORAGE = "by_fingerprint"  # "by_fingerprint" (shared certificates_by_fp), "inline" (full parse per domain)
+                                 # or "lean" (raw DER + indexed summary fields per domain; see load_full_certificate)
+CERT_CACHE_SIZE = 100000  # fingerprints remembered in memory as already stored
+SUMMARY_CACHE_SIZE = 20000  # certificate summaries (lean fields, result files, crawl_stats) kept by fingerprint
+CAPTURE_CHAIN = True      # store every presented certificate; domains keep the ordered fingerprints
+CA_CACHE_SIZE = 10000     # interned CA fingerprints remembered in memory (a few hundred in practice)
+BULK_WRITES = True        # batch MongoDB upserts on a background writer thread
+BULK_MAX_DOCS = 500       # flush a bulk_write after this many operations...
+BULK_MAX_BYTES = 8 * 1024 * 1024  # ...or this many BSON bytes...
+BULK_FLUSH_INTERVAL = 1.0  # ...or this many seconds
+BULK_QUEUE_SIZE = 10000   # pending writes before workers are made to wait
+RESULT_SINKS = ("mongo",)  # any of "mongo", "parquet", "arrow", "jsonl_zst"; e.g. ("parquet",) for files only
+RESULT_DIR = "results"    # file sinks write certificates-<start time>-<pid>.<ext> here
+RESULT_ROW_GROUP_SIZE = 50000  # rows per Parquet row group / Arrow record batch
+RESULT_ZSTD_LEVEL = 3
+RESULT_CHUNK_BYTES = 8 * 1024 * 1024  # JSONL bytes buffered per write into the zstd stream
+RESULT_QUEUE_SIZE = 10000  # records waiting for the sink thread before workers are made to wait
+LOG_BATCH_SIZE = 1000     # log records per write call
+LOG_FLUSH_INTERVAL = 0.5  # seconds before a partial batch is written anyway
+LOG_FSYNC_INTERVAL = 5.0  # seconds between fsyncs of the log and failure files
+METRICS_PORT = None       # serve /metrics (Prometheus text) and /metrics.json on this port; None = off
+METRICS_HOST = "127.0.0.1"
+METRICS_SNAPSHOT_FILE = "Cloudflare_urls_metrics.json"  # JSON snapshot of stage latencies and progress; None = off
+METRICS_SNAPSHOT_INTERVAL = 10.0  # seconds between snapshot rewrites (and shard-to-parent metric updates)
+CRAWL_STATS = True        # keep issuer/key/validity/failure counters in crawl_stats while crawling
+CRAWL_STATS_FLUSH_INTERVAL = 5.0  # seconds between $inc updates of the run's crawl_stats document
+CRAWL_STATS_DATASET = None  # dataset name in crawl_stats; None = the input file name
+METRICS_COUNT_INPUT = False  # count the unique input hosts on a background thread so progress can show an ETA
+                             # (a second pass over the input, with its own dedup memory)
+
+resolver = CachingResolver(
+    concurrency=DNS_CONCURRENCY,
+    timeout=DNS_TIMEOUT,
+    default_ttl=DNS_DEFAULT_TTL,
+    negative_ttl=DNS_NEGATIVE_TTL,
+    max_entries=DNS_CACHE_SIZE,
+)
+
+tls_contexts = ContextPool(alpn_protocols=TLS_ALPN_PROTOCOLS)   # built once, shared by all workers
+
+fingerprint_cache = FingerprintCache(certificates_by_fp, max_entries=CERT_CACHE_SIZE)
+ca_fingerprint_cache = FingerprintCache(ca_certificates, max_entries=CA_CACHE_SIZE)
+summary_cache = SummaryCache(summarize_certificate_der, max_entries=SUMMARY_CACHE_SIZE)
+
+zcert_pool = None
+zcert_pool_lock = Lock()
+
+bulk_writer = None
+
+result_writer = None     # SinkWriter for the file sinks in RESULT_SINKS
+
+crawl_stats = None       # CrawlStats of this run (in the process that records results)
+
+event_log = None         # LogWriter for LOG_FILE
+
+resume_store = None
+
+connection_gate = None   # ConnectionGate / AsyncConnectionGate for the running engine
+
+crawl_queue = None       # CrawlQueue when NODE_ROLE = "worker"
+
+known_fingerprints = {}   # incremental mode: domain -> fingerprint stored by the last crawl
+unchanged_certificates = 0
+unchanged_lock = Lock()   # unchanged_certificates is counted from worker threads
+
+metrics = CrawlMetrics()  # per-stage latency histograms, outcome counters, rate and ETA
+metrics_reporters = []    # MetricsServer / SnapshotWriter while main() runs
+last_metrics_forward = 0.0
 
-# Locks for file thread safety
-log_lock = Lock()
-failure_lock = Lock()
+shard_results = None     # in a shard process: queue to the parent, which owns the log/failure/resume files
 
 # ============= Utility Functions =============
 
-def write_log(domain, log_messages):
-    """Write log messages for a single domain to a shared log file safely."""
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with log_lock:
-        with open(LOG_FILE, "a") as f:
-            f.write(f"Processing {domain}\n")
-            for message in log_messages:
-                f.write(f"[{timestamp}] {message}\n")
-            f.write("\n")
-            f.flush()
+def open_logs():
+    global event_log
+    event_log = LogWriter(LOG_FILE, LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL, LOG_FSYNC_INTERVAL)
+
+def close_logs():
+    global event_log
+    if event_log is not None:
+        event_log.close()
+    event_log = None
+
+def write_log(domain, log_messages, **fields):
+    """Queue one JSON log record for domain; the log writer thread does the file I/O."""
+    if shard_results is not None:
+        shard_results.put(("log", domain, log_messages, fields))
+        return
+    record = {"ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "domain": domain, **fields, "messages": log_messages}
+    event_log.log(record)
+
+def elapsed_ms(since):
+    return round((time.monotonic() - since) * 1000, 1)
+
+def uses_mongo():
+    """MongoDB is needed for the certificate store, or for the shared crawl queue."""
+    return "mongo" in RESULT_SINKS or NODE_ROLE != "local"
 
 def check_mongo_connection():
     try:
@@ -55,16 +232,26 @@ def check_mongo_connection():
 def init_mongo_indexes():
     """Ensure uniqueness by domain (idempotency and deduplication)."""
     collection.create_index("domain", unique=True)
+    collection.create_index("fingerprint_sha256")
+    collection.create_index("chain")   # multikey: which domains are served through a given CA
+    # incremental re-crawl scheduling: pages are read in (key, _id) order
+    collection.create_index([("not_after", 1), ("_id", 1)])
+    collection.create_index([("last_seen", 1), ("_id", 1)])
+    if CERT_STORAGE == "lean":
+        # "expiring within N days, by issuer" is an index-only scan of the first one
+        collection.create_index([("not_after", 1), ("issuer_o", 1), ("issuer_cn", 1)])
+        collection.create_index([("issuer_o", 1), ("not_after", 1)])
+        collection.create_index([("key_algorithm", 1), ("key_bits", 1)])
+        collection.create_index("san_dns")   # multikey: which domains' certificates name a host
+
+def iter_domains_from_csv(file_path, stats=None):
+    """Yield unique, normalised hosts one row at a time so the input never has to fit in memory.
 
-def load_domains_from_csv(file_path):
-    domain_list = []
-    with open(file_path, newline='') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            domain = row.get("Websites URL")
-            if domain:
-                domain_list.append(domain.strip())
-    return domain_list
+    file_path may be a list of (possibly gzip/zstd/zip-compressed) lists; hosts
+    repeated across them are crawled once. See domain_input.py.
+    """
+    deduper = Deduper(INPUT_DEDUP_EXACT_LIMIT, INPUT_DEDUP_CAPACITY, INPUT_DEDUP_ERROR_RATE)
+    return read_domains(file_path, column=INPUT_COLUMN, strip_www=INPUT_STRIP_WWW, dedup=deduper, stats=stats)
 
 def load_failed_domains(file_path):
     failed_set = set()
@@ -74,51 +261,218 @@ def load_failed_domains(file_path):
                 failed_set.add(line.strip())
     return failed_set
 
-def mark_domain_failed(domain, log_messages):
-    """Record a permanent failure (thread-safe append to failure.txt)."""
-    with failure_lock:
-        with open(FAILURE_FILE, "a") as f:
-            fail_log = f"{domain}"
-            # if log_messages:
-            #     fail_log += " | " + " ; ".join(log_messages)
-            f.write(fail_log + "\n")
-            f.flush()
-
 # ============= Network and Certificate =============
 
-def connect_to_domain(domain, timeout=CONNECT_TIMEOUT, log_messages=None):
-    sock = None
-    ssl_sock = None
+def resolve_domain(domain, log_messages=None):
+    """DNS stage: (addresses, None) from the caching resolver, or (None, error class)."""
     try:
-        sock = socket.create_connection((domain, 443), timeout=timeout)
-        sock.settimeout(timeout)
-        ssl_context = ssl.create_default_context()
-        ssl_sock = ssl_context.wrap_socket(sock, server_hostname=domain)
-        ssl_sock.settimeout(timeout)
-        cert_bin = ssl_sock.getpeercert(binary_form=True)
-        pem_data = ssl.DER_cert_to_PEM_cert(cert_bin)
-        return pem_data
-    except (socket.gaierror, socket.timeout, ConnectionRefusedError) as e:
+        return resolver.resolve(domain), None
+    except socket.gaierror as e:
         if log_messages is not None:
             log_messages.append(f"Cannot connect to {domain} due to: {e}")
-        return None
-    except ssl.SSLError as e:
-        if log_messages is not None:
-            log_messages.append(f"SSL handshake failed for {domain}: {e}")
-        return None
-    except Exception as e:
+        return None, classify_error(e)
+
+async def resolve_domain_async(domain, log_messages=None):
+    try:
+        return await resolver.resolve_async(domain), None
+    except socket.gaierror as e:
         if log_messages is not None:
-            log_messages.append(f"Unexpected error for {domain}: {e}")
+            log_messages.append(f"Cannot connect to {domain} due to: {e}")
+        return None, classify_error(e)
+
+def open_tcp_connection(addresses, timeout):
+    """Connect to the first reachable address on port 443."""
+    last_error = None
+    for address in addresses:
+        try:
+            return socket.create_connection((address, 443), timeout=timeout)
+        except OSError as e:
+            last_error = e
+    raise last_error
+
+def get_peer_chain(ssl_object):
+    """DER certificates of a finished handshake as (presented, verified), leaf first.
+
+    presented is what the server sent, in its order; verified is the path
+    OpenSSL built, ending at the trust-store root. Python < 3.13 only has
+    these on the internal _sslobj.
+    """
+    if not CAPTURE_CHAIN:
         return None
-    finally:
+    internal = getattr(ssl_object, "_sslobj", None)
+    chains = []
+    for name in ("get_unverified_chain", "get_verified_chain"):
+        getter = getattr(ssl_object, name, None) or getattr(internal, name, None)
+        try:
+            certs = getter() if getter is not None else None
+        except Exception:
+            certs = None
+        chains.append([
+            cert if isinstance(cert, bytes) else cert.public_bytes(ssl._ssl.ENCODING_DER)
+            for cert in certs or ()
+        ])
+    return tuple(chains)
+
+def probe_profiles():
+    """TLS profiles to try in order: TLS_PROFILE, then no_verify to capture certificates that fail verification."""
+    if TLS_CAPTURE_INVALID and verifies(TLS_PROFILE):
+        return (TLS_PROFILE, NO_VERIFY)
+    return (TLS_PROFILE,)
+
+def describe_connection(ssl_object, profile, started, connected, finished, verify_error):
+    """Everything learned from one handshake: {"chain": (presented, verified), "tls": {...}}."""
+    tls = describe_handshake(ssl_object)
+    tls["profile"] = profile
+    tls["connect_ms"] = round((connected - started) * 1000, 1)
+    tls["handshake_ms"] = round((finished - connected) * 1000, 1)
+    if verify_error is not None:
+        tls["verified"] = False
+        tls["verify_error"] = verify_error
+    elif verifies(profile):
+        tls["verified"] = True
+    return {"chain": get_peer_chain(ssl_object), "tls": tls}
+
+def connect_to_domain(domain, timeout=CONNECT_TIMEOUT, log_messages=None, addresses=None):
+    """Fetch the leaf certificate, chain and handshake facts.
+
+    Returns (pem_data, connection, None) or (None, None, error class), where
+    connection is the dict built by describe_connection.
+    """
+    profiles = probe_profiles()
+    verify_error = None
+    for profile in profiles:
+        sock = None
+        ssl_sock = None
         try:
-            if ssl_sock:
-                ssl_sock.close()
+            started = time.monotonic()
+            sock = open_tcp_connection(addresses or [domain], timeout)
+            sock.settimeout(timeout)
+            connected = time.monotonic()
+            ssl_sock = tls_contexts.get(profile).wrap_socket(sock, server_hostname=domain)
+            finished = time.monotonic()
+            ssl_sock.settimeout(timeout)
+            cert_bin = ssl_sock.getpeercert(binary_form=True)
+            pem_data = ssl.DER_cert_to_PEM_cert(cert_bin)
+            return pem_data, describe_connection(ssl_sock, profile, started, connected, finished, verify_error), None
+        except (socket.gaierror, socket.timeout, ConnectionRefusedError) as e:
+            if log_messages is not None:
+                log_messages.append(f"Cannot connect to {domain} due to: {e}")
+            return None, None, classify_error(e)
+        except ssl.SSLError as e:
+            if isinstance(e, ssl.SSLCertVerificationError) and profile != profiles[-1]:
+                verify_error = e.verify_message or str(e)
+                if log_messages is not None:
+                    log_messages.append(f"Certificate verification failed for {domain}: {verify_error}; capturing it unverified")
+                continue
+            if log_messages is not None:
+                log_messages.append(f"SSL handshake failed for {domain}: {e}")
+            return None, None, classify_error(e)
+        except Exception as e:
+            if log_messages is not None:
+                log_messages.append(f"Unexpected error for {domain}: {e}")
+            return None, None, classify_error(e)
         finally:
-            if sock:
+            try:
+                if ssl_sock:
+                    ssl_sock.close()
+            finally:
+                if sock:
+                    sock.close()
+
+async def open_tcp_connection_async(addresses, timeout):
+    """Async counterpart of open_tcp_connection; returns a connected non-blocking socket."""
+    loop = asyncio.get_running_loop()
+    last_error = None
+    for address in addresses:
+        sock = socket.socket(socket.AF_INET6 if ":" in address else socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, (address, 443)), timeout=timeout)
+            return sock
+        except (OSError, asyncio.TimeoutError) as e:
+            sock.close()
+            last_error = e
+    raise last_error
+
+async def connect_to_domain_async(domain, timeout=CONNECT_TIMEOUT, log_messages=None, addresses=None):
+    """Event-loop version of connect_to_domain: same result and log messages, no blocked thread."""
+    profiles = probe_profiles()
+    verify_error = None
+    for profile in profiles:
+        sock = None
+        writer = None
+        try:
+            started = time.monotonic()
+            sock = await open_tcp_connection_async(addresses or [domain], timeout)
+            connected = time.monotonic()
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(sock=sock, ssl=tls_contexts.get(profile), server_hostname=domain),
+                timeout=timeout
+            )
+            finished = time.monotonic()
+            ssl_object = writer.get_extra_info("ssl_object")
+            cert_bin = ssl_object.getpeercert(binary_form=True)
+            pem_data = ssl.DER_cert_to_PEM_cert(cert_bin)
+            return pem_data, describe_connection(ssl_object, profile, started, connected, finished, verify_error), None
+        except (socket.gaierror, socket.timeout, asyncio.TimeoutError, ConnectionRefusedError) as e:
+            if log_messages is not None:
+                log_messages.append(f"Cannot connect to {domain} due to: {str(e) or 'timed out'}")
+            return None, None, classify_error(e)
+        except ssl.SSLError as e:
+            if isinstance(e, ssl.SSLCertVerificationError) and profile != profiles[-1]:
+                verify_error = e.verify_message or str(e)
+                if log_messages is not None:
+                    log_messages.append(f"Certificate verification failed for {domain}: {verify_error}; capturing it unverified")
+                continue
+            if log_messages is not None:
+                log_messages.append(f"SSL handshake failed for {domain}: {e}")
+            return None, None, classify_error(e)
+        except Exception as e:
+            if log_messages is not None:
+                log_messages.append(f"Unexpected error for {domain}: {e}")
+            return None, None, classify_error(e)
+        finally:
+            if writer is not None:
+                writer.close()
+                try:
+                    await asyncio.wait_for(writer.wait_closed(), timeout=timeout)
+                except Exception:
+                    pass
+            elif sock is not None:
                 sock.close()
 
+def get_zcert_pool():
+    """Start the shared zcertificate pool on first use."""
+    global zcert_pool
+    with zcert_pool_lock:
+        if zcert_pool is None:
+            zcert_pool = ZCertificatePool(
+                size=ZCERT_POOL_SIZE,
+                batch_size=ZCERT_BATCH_SIZE,
+                flush_interval=ZCERT_FLUSH_INTERVAL,
+                batch_timeout=ZCERT_BATCH_TIMEOUT,
+            )
+        return zcert_pool
+
+def close_zcert_pool():
+    global zcert_pool
+    with zcert_pool_lock:
+        if zcert_pool is not None:
+            zcert_pool.close()
+            zcert_pool = None
+
+def run_zcertificate_pool_on_pem(pem_data, log_messages=None):
+    """Parse through a persistent zcertificate process instead of spawning one."""
+    try:
+        return get_zcert_pool().parse(pem_data)
+    except Exception as e:
+        if log_messages is not None:
+            log_messages.append(f"Error running zcertificate: {e}")
+        return None
+
 def run_zcertificate_on_pem(pem_data, log_messages=None):
+    if ZCERT_POOL_SIZE > 0:
+        return run_zcertificate_pool_on_pem(pem_data, log_messages=log_messages)
     try:
         result = subprocess.run(
             ["zcertificate.exe", "-format", "pem"],
@@ -155,16 +509,91 @@ def run_zcertificate_on_pem(pem_data, log_messages=None):
             log_messages.append(f"Error running zcertificate: {e}")
         return None
 
+def run_native_parser_on_pem(pem_data, log_messages=None):
+    """Parse the certificate in-process into the same document shape zcertificate emits."""
+    try:
+        return parse_certificate_pem(pem_data)
+    except Exception as e:
+        if log_messages is not None:
+            log_messages.append(f"Failed to parse certificate: {e}")
+        return None
+
+def parse_certificate(pem_data, log_messages=None):
+    """Dispatch to the parser backend selected by CERT_PARSER."""
+    started = time.monotonic()
+    if CERT_PARSER == "zcertificate":
+        parsed_json = run_zcertificate_on_pem(pem_data, log_messages=log_messages)
+    else:
+        parsed_json = run_native_parser_on_pem(pem_data, log_messages=log_messages)
+    metrics.observe("parse", elapsed_ms(started), "ok" if parsed_json is not None else "error")
+    return parsed_json
+
+def report_write_error(domain, message, code):
+    """Called by the bulk writer thread when a queued write for domain fails."""
+    if code == 11000:
+        return  # duplicate key on upsert: another write stored it first
+    if domain is None:
+        print(f"Error writing to MongoDB: {message}")   # not a domain's write (crawl_stats)
+        return
+    if crawl_queue is not None:
+        crawl_queue.requeue(domain)
+    if shard_results is not None:
+        shard_results.put(("write_error", domain, message))
+        return
+    write_log(domain, [f"Error inserting/upserting into MongoDB: {message}"], success=False, stage="store")
+    if resume_store is not None:
+        resume_store.forget(domain)  # not stored, so probe it again next run
+
+def start_bulk_writer():
+    global bulk_writer
+    if BULK_WRITES:
+        bulk_writer = BulkWriter(
+            max_docs=BULK_MAX_DOCS,
+            max_bytes=BULK_MAX_BYTES,
+            max_interval=BULK_FLUSH_INTERVAL,
+            queue_size=BULK_QUEUE_SIZE,
+            on_error=report_write_error,
+            on_flush=record_bulk_flush,
+            on_confirmed=confirm_stored,
+        )
+        metrics.set_gauge("bulk_write_queue", bulk_writer.queue.qsize)
+
+def record_bulk_flush(operations, seconds, errors):
+    """One store-stage observation per bulk_write batch."""
+    metrics.observe("store", seconds * 1000, "error" if errors else "ok")
+
+def stop_bulk_writer():
+    global bulk_writer
+    if bulk_writer is not None:
+        bulk_writer.close()
+        if uses_mongo():   # with file sinks only it just passed confirmations through
+            print(f"MongoDB bulk writer: {bulk_writer.written} written, {bulk_writer.errors} errors in {bulk_writer.flushes} batches")
+        bulk_writer = None
+
+def upsert_document(target, query, update, domain, on_stored=None):
+    """Upsert through the bulk writer when it is running, otherwise directly.
+
+    on_stored() runs once the write is acknowledged (later, on the writer thread, for bulk writes).
+    """
+    if bulk_writer is not None:
+        bulk_writer.submit(target, UpdateOne(query, update, upsert=True), domain, on_stored)
+        return
+    started = time.monotonic()
+    try:
+        target.update_one(query, update, upsert=True)
+    except Exception:
+        metrics.observe("store", elapsed_ms(started), "error")
+        raise
+    metrics.observe("store", elapsed_ms(started))
+    if on_stored is not None:
+        on_stored()
+
 def save_certificate_to_mongodb(parsed_data, domain, log_messages=None):
     if parsed_data is None:
         return
     try:
         parsed_data["domain"] = domain
-        collection.update_one(
-            {"domain": domain},
-            {"$set": parsed_data},
-            upsert=True
-        )
+        upsert_document(collection, {"domain": domain}, {"$set": parsed_data}, domain)
     except DuplicateKeyError:
         if log_messages is not None:
             log_messages.append("Duplicate domain on insert; already stored")
@@ -172,100 +601,993 @@ def save_certificate_to_mongodb(parsed_data, domain, log_messages=None):
         if log_messages is not None:
             log_messages.append(f"Error inserting/upserting into MongoDB: {e}")
 
-def domain_already_processed(domain):
-    """Check if domain already exists (success or attempted) in DB."""
+def intern_chain(chain, leaf_der, domain, log_messages=None):
+    """Store every CA certificate of the chain once in ca_certificates.
+
+    Returns the domain fields {"chain": [...], "verified_chain": [...]} with
+    the fingerprints in chain order (leaf first), or {} if nothing was captured.
+    """
+    if not chain:
+        return {}
+    presented, verified = chain
+    fields = {}
+    for name, certs in (("chain", presented), ("verified_chain", verified)):
+        if not certs:
+            continue
+        fingerprints = []
+        for der in certs:
+            fingerprint = der_fingerprint(der)
+            fingerprints.append(fingerprint)
+            if der == leaf_der:
+                continue  # the leaf is stored with the domain's certificate
+            try:
+                if ca_fingerprint_cache.contains(fingerprint):
+                    continue
+                parsed_json = parse_certificate(ssl.DER_cert_to_PEM_cert(der), log_messages=log_messages)
+                if parsed_json is None:
+                    continue
+                # Cached only once stored, so no later domain references a CA that never got written
+                upsert_document(ca_certificates, {"_id": fingerprint}, {"$setOnInsert": parsed_json}, domain,
+                                on_stored=partial(ca_fingerprint_cache.add, fingerprint))
+            except DuplicateKeyError:
+                ca_fingerprint_cache.add(fingerprint)
+            except Exception as e:
+                if log_messages is not None:
+                    log_messages.append(f"Error storing CA certificate {fingerprint}: {e}")
+        fields[name] = fingerprints
+    return fields
+
+def cert_not_after(der):
+    """notAfter of a DER certificate as an aware UTC datetime, without a full parse."""
     try:
-        return collection.count_documents({"domain": domain}, limit=1) > 0
+        return x509.load_der_x509_certificate(der).not_valid_after_utc
     except Exception:
+        return None
+
+def save_certificate_by_fingerprint(pem_data, domain, log_messages=None, extra_fields=None):
+    """Parse and store a certificate once per fingerprint; the domain record only references it."""
+    fingerprint = der_fingerprint(ssl.PEM_cert_to_DER_cert(pem_data))
+    try:
+        already_stored = fingerprint_cache.contains(fingerprint)
+    except Exception as e:
+        if log_messages is not None:
+            log_messages.append(f"Error looking up certificate fingerprint in MongoDB: {e}")
+        return False
+
+    if not already_stored:
+        parsed_json = parse_certificate(pem_data, log_messages=log_messages)
+        if parsed_json is None:
+            return False
+        try:
+            # Until the write is acknowledged other domains store the certificate again ($setOnInsert
+            # makes that harmless) rather than reference a document that may never be written
+            upsert_document(certificates_by_fp, {"_id": fingerprint}, {"$setOnInsert": parsed_json}, domain,
+                            on_stored=partial(fingerprint_cache.add, fingerprint))
+        except DuplicateKeyError:
+            fingerprint_cache.add(fingerprint)   # another worker stored the same certificate first
+        except Exception as e:
+            if log_messages is not None:
+                log_messages.append(f"Error inserting certificate into MongoDB: {e}")
+            return False
+
+    save_certificate_to_mongodb(
+        {"fingerprint_sha256": fingerprint, "last_seen": datetime.now(timezone.utc), **(extra_fields or {})},
+        domain,
+        log_messages=log_messages
+    )
+    return True
+
+def save_certificate_lean(leaf_der, fingerprint, domain, log_messages=None, extra_fields=None):
+    """Store the raw DER (BSON binary) and a few top-level summary fields on the domain record.
+
+    Nothing is fully parsed at crawl time; load_full_certificate re-derives
+    the full parse from "der" when it is wanted.
+    """
+    started = time.monotonic()
+    try:
+        fields = dict(summary_cache.get(fingerprint, leaf_der))
+    except Exception as e:
+        metrics.observe("parse", elapsed_ms(started), "error")
+        if log_messages is not None:
+            log_messages.append(f"Failed to summarise certificate: {e}")
         return False
+    metrics.observe("parse", elapsed_ms(started))
+    fields.update(extra_fields or {})
+    fields.update(fingerprint_sha256=fingerprint, der=leaf_der, last_seen=datetime.now(timezone.utc))
+    save_certificate_to_mongodb(fields, domain, log_messages=log_messages)
+    return True
+
+def load_full_certificate(domain, log_messages=None):
+    """Full parsed certificate of a stored domain, whatever CERT_STORAGE it was written with.
+
+    Lean records are re-parsed from their DER with the CERT_PARSER backend,
+    by-fingerprint records are looked up in certificates_by_fp, and inline
+    records are the parse already. None if the domain has no certificate.
+    """
+    doc = collection.find_one({"domain": domain})
+    if doc is None:
+        return None
+    if doc.get("der"):
+        return parse_certificate(ssl.DER_cert_to_PEM_cert(bytes(doc["der"])), log_messages=log_messages)
+    if "parsed" in doc or not doc.get("fingerprint_sha256"):
+        return doc
+    return certificates_by_fp.find_one({"_id": doc["fingerprint_sha256"]})
+
+def dataset_name(file_path):
+    paths = [file_path] if isinstance(file_path, str) else list(file_path)
+    return "+".join(os.path.basename(path.replace("\\", "/")).split(".")[0] for path in paths)
+
+def start_crawl_stats(file_path):
+    global crawl_stats
+    if CRAWL_STATS and "mongo" in RESULT_SINKS:
+        run = f"{datetime.now():%Y%m%d-%H%M%S}-{NODE_ID}"
+        crawl_stats = CrawlStats(run, CRAWL_STATS_DATASET or dataset_name(file_path), CRAWL_STATS_FLUSH_INTERVAL)
+        print(f"Crawl statistics go to crawl_stats {crawl_stats.id}")
+
+def flush_crawl_stats(force=False):
+    """Send the counters gathered since the last flush as one $inc (through the bulk writer when it runs)."""
+    if crawl_stats is None or not (force or crawl_stats.due()):
+        return
+    taken = crawl_stats.take_update()
+    if taken is None:
+        return
+    query, update = taken
+    try:
+        upsert_document(crawl_stats_collection, query, update, None)
+    except Exception as e:
+        print(f"Error updating crawl_stats: {e}")
+
+def stats_facts(pem_data, connection):
+    """Certificate facts for crawl_stats, carried in the trace (also from shards to the parent).
+
+    The summary comes from summary_cache, so a certificate the lean store or
+    the result files (or an earlier domain) already summarised is not parsed again.
+    """
+    try:
+        leaf_der = ssl.PEM_cert_to_DER_cert(pem_data)
+        summary = summary_cache.get(der_fingerprint(leaf_der), leaf_der)
+    except Exception:
+        return None
+    return certificate_facts(summary, (connection or {}).get("tls"))
+
+def start_result_sinks():
+    """Open the file sinks in RESULT_SINKS behind one writer thread."""
+    global result_writer
+    kinds = [kind for kind in RESULT_SINKS if kind != "mongo"]
+    if not kinds:
+        return
+    os.makedirs(RESULT_DIR, exist_ok=True)
+    prefix = os.path.join(RESULT_DIR, f"certificates-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}")
+    sinks = [
+        new_sink(kind, prefix, row_group_size=RESULT_ROW_GROUP_SIZE, zstd_level=RESULT_ZSTD_LEVEL, chunk_bytes=RESULT_CHUNK_BYTES)
+        for kind in kinds
+    ]
+    result_writer = SinkWriter(sinks, RESULT_QUEUE_SIZE)
+    metrics.set_gauge("result_sink_queue", result_writer.queue.qsize)
+    print("Writing results to " + ", ".join(sink.path for sink in sinks))
+
+def stop_result_sinks():
+    global result_writer
+    if result_writer is not None:
+        result_writer.close()
+        print(f"Result files: {result_writer.records} records, {result_writer.errors} errors"
+              + (f" (last: {result_writer.last_error})" if result_writer.last_error else ""))
+        result_writer = None
+
+def emit_result(domain, leaf_der, fingerprint, connection, chain_fields=None, log_messages=None):
+    """Hand one domain's result record to the file sinks."""
+    if result_writer is None:
+        return
+    record = {"domain": domain, "crawled_at": datetime.now(timezone.utc), "fingerprint_sha256": fingerprint}
+    try:
+        record.update(summary_cache.get(fingerprint, leaf_der))
+    except Exception as e:
+        if log_messages is not None:
+            log_messages.append(f"Failed to summarise certificate for the result files: {e}")
+    record["tls"] = connection.get("tls")
+    if chain_fields is None:
+        presented, verified = connection.get("chain") or ((), ())
+        chain_fields = {"chain": [der_fingerprint(der) for der in presented],
+                        "verified_chain": [der_fingerprint(der) for der in verified]}
+    record.update(chain_fields)
+    record["raw"] = leaf_der
+    result_writer.submit(record)
+
+def process_certificate(pem_data, domain, log_messages=None, connection=None):
+    """Parse and store a fetched certificate (and its CA chain) according to CERT_STORAGE. Returns success.
+
+    The file sinks get a record for every success (and only then); without
+    "mongo" in RESULT_SINKS nothing else is stored.
+    """
+    global unchanged_certificates
+    leaf_der = ssl.PEM_cert_to_DER_cert(pem_data)
+    fingerprint = der_fingerprint(leaf_der)
+    connection = connection or {}
+    if "mongo" not in RESULT_SINKS:
+        emit_result(domain, leaf_der, fingerprint, connection, log_messages=log_messages)
+        return True
+    if known_fingerprints.get(domain) == fingerprint:
+        # Same certificate as last crawl: nothing to parse, only record that it is still served
+        save_certificate_to_mongodb({"last_seen": datetime.now(timezone.utc)}, domain, log_messages=log_messages)
+        with unchanged_lock:
+            unchanged_certificates += 1
+        emit_result(domain, leaf_der, fingerprint, connection, log_messages=log_messages)
+        return True
+
+    domain_fields = intern_chain(connection.get("chain"), leaf_der, domain, log_messages=log_messages)
+    chain_fields = {k: domain_fields[k] for k in ("chain", "verified_chain") if k in domain_fields}
+    if connection.get("tls"):
+        domain_fields["tls"] = connection["tls"]
+    domain_fields["not_after"] = cert_not_after(leaf_der)
+    if CERT_STORAGE == "by_fingerprint":
+        stored = save_certificate_by_fingerprint(pem_data, domain, log_messages=log_messages, extra_fields=domain_fields)
+    elif CERT_STORAGE == "lean":
+        stored = save_certificate_lean(leaf_der, fingerprint, domain, log_messages=log_messages, extra_fields=domain_fields)
+    else:
+        parsed_json = parse_certificate(pem_data, log_messages=log_messages)
+        stored = parsed_json is not None
+        if stored:
+            parsed_json.update(domain_fields)
+            parsed_json.update(fingerprint_sha256=fingerprint, last_seen=datetime.now(timezone.utc))
+            save_certificate_to_mongodb(parsed_json, domain, log_messages=log_messages)
+    # Only domains recorded as a success get a row, so the result files agree with the log and resume store
+    if stored:
+        emit_result(domain, leaf_der, fingerprint, connection, chain_fields, log_messages)
+    return stored
 
 # ============= Worker Logic =============
 
-def process_domain_worker(domain):
-    """Thread worker routine for one domain. Returns (domain, log_messages, success)."""
-    log_messages = []
+def trace_resolve(domain, trace, addresses, error_class, started):
+    """Fill the DNS stage of an attempt trace and record its metrics. Returns False if resolution failed."""
+    trace["dns_ms"] = elapsed_ms(started)
+    if addresses is not None:
+        metrics.observe("dns", trace["dns_ms"])
+        return True
+    # NXDOMAIN from the negative cache gets its own class: retrying cannot help
+    trace.update(stage="dns", error_class=NXDOMAIN if resolver.is_negative(domain) else error_class)
+    metrics.observe("dns", trace["dns_ms"], trace["error_class"])
+    return False
+
+def trace_connect(trace, connection, error_class, started):
+    """Fill the connect stage of an attempt trace from connect_to_domain's result and record its metrics."""
+    if connection is not None:
+        trace["connect_ms"] = connection["tls"]["connect_ms"]
+        trace["handshake_ms"] = connection["tls"]["handshake_ms"]
+        metrics.observe("connect", trace["connect_ms"])
+        metrics.observe("handshake", trace["handshake_ms"])
+    else:
+        stage = "handshake" if error_class == "ssl" else "connect"
+        trace.update(stage=stage, error_class=error_class)
+        metrics.observe(stage, elapsed_ms(started), error_class)
+
+def retry_class(trace):
+    """Error class a failed attempt may be retried under, or None if the failure is permanent."""
+    error_class = trace.get("error_class")
+    return None if error_class in (NXDOMAIN, "process") else error_class
+
+def fetch_attempt(domain, addresses, log_messages, trace):
+    """Handshake stage: take a connection slot and fetch the certificate. Returns connect_to_domain's result."""
+    connection_gate.acquire(addresses[0])
+    error_class = None
+    try:
+        started = time.monotonic()
+        pem_data, connection, error_class = connect_to_domain(domain, timeout=CONNECT_TIMEOUT, log_messages=log_messages, addresses=addresses)
+    finally:
+        connection_gate.release(addresses[0], congested=error_class in CONGESTION_ERRORS)
+    trace_connect(trace, connection, error_class, started)
+    return pem_data, connection, error_class
+
+def process_attempt(domain, pem_data, connection, log_messages, trace):
+    """Parse stage: parse and store the certificate (writes go to the bulk writer). Returns success."""
+    started = time.monotonic()
+    stored = process_certificate(pem_data, domain, log_messages=log_messages, connection=connection)
+    trace["process_ms"] = elapsed_ms(started)
+    if not stored:
+        # Could not parse or store cert: permanent failure
+        trace.update(stage="process", error_class="process")
+        return False
+    trace.update(stage="stored", error_class=None)
+    if CRAWL_STATS and "mongo" in RESULT_SINKS:
+        trace["certificate"] = stats_facts(pem_data, connection)
+    return True
 
-    if domain_already_processed(domain):
-        log_messages.append("Already present in DB, skipping")
-        return domain, log_messages, True
+def process_domain_attempt(domain, log_messages, trace=None):
+    """Thread worker routine for one attempt at a domain.
 
-    pem_data = None
-    for attempt in range(1 + MAX_RETRIES):
-        pem_data = connect_to_domain(domain, timeout=CONNECT_TIMEOUT, log_messages=log_messages)
-        if pem_data is not None:
-            break
-        if attempt < MAX_RETRIES:
-            backoff = (RETRY_BACKOFF_BASE ** (attempt + 1))
-            # log_messages.append(f"Retrying in {backoff:.1f}s")
-            time.sleep(backoff)
+    Returns (domain, log_messages, success, error_class). A failure with an
+    error class may be retried by the engine's RetryScheduler; a failure
+    without one (NXDOMAIN, parse or store error) is permanent. trace receives
+    the stage reached, the error class and per-stage timings for the log.
+    """
+    trace = {} if trace is None else trace
+    started = time.monotonic()
+    addresses, error_class = resolve_domain(domain, log_messages=log_messages)
+    if not trace_resolve(domain, trace, addresses, error_class, started):
+        return domain, log_messages, False, retry_class(trace)
 
+    pem_data, connection, error_class = fetch_attempt(domain, addresses, log_messages, trace)
     if pem_data is None:
-        # All attempts failed: consider permanent failure for now, mark in file
-        return domain, log_messages, False
+        return domain, log_messages, False, error_class
+
+    stored = process_attempt(domain, pem_data, connection, log_messages, trace)
+    return domain, log_messages, stored, None
 
-    parsed_json = run_zcertificate_on_pem(pem_data, log_messages=log_messages)
-    if parsed_json is None:
-        # Could not parse cert: permanent failure
-        return domain, log_messages, False
+async def process_domain_attempt_async(domain, log_messages, trace=None):
+    """Coroutine counterpart of process_domain_attempt, with the same return value.
 
-    save_certificate_to_mongodb(parsed_json, domain, log_messages=log_messages)
-    return domain, log_messages, True
+    A connection slot is only held while the connection is open; zcertificate
+    and MongoDB calls run on the loop's executor.
+    """
+    loop = asyncio.get_running_loop()
+    trace = {} if trace is None else trace
+
+    # Resolve before taking a connect slot so dead names never occupy one
+    started = time.monotonic()
+    addresses, error_class = await resolve_domain_async(domain, log_messages=log_messages)
+    if not trace_resolve(domain, trace, addresses, error_class, started):
+        return domain, log_messages, False, retry_class(trace)
+
+    await connection_gate.acquire(addresses[0])
+    try:
+        started = time.monotonic()
+        pem_data, connection, error_class = await connect_to_domain_async(
+            domain, timeout=CONNECT_TIMEOUT, log_messages=log_messages, addresses=addresses
+        )
+    finally:
+        connection_gate.release(addresses[0], congested=error_class in CONGESTION_ERRORS)
+    trace_connect(trace, connection, error_class, started)
+    if pem_data is None:
+        return domain, log_messages, False, error_class
+
+    stored = await loop.run_in_executor(None, process_attempt, domain, pem_data, connection, log_messages, trace)
+    return domain, log_messages, stored, None
 
 # ============= Main Execution =============
 
-def main():
-    start_time = time.time()
+def confirm_stored(domains):
+    """Mark domains as done once MongoDB acknowledged all their writes (called by the bulk writer thread)."""
+    if crawl_queue is not None:
+        # The claiming process completes its own leases, also inside a shard
+        try:
+            crawl_queue.complete_many(domains)
+        except Exception as e:
+            print(f"Error completing crawl_queue leases: {e}")   # the leases expire and are crawled again
+    if shard_results is not None:
+        shard_results.put(("stored", domains))
+        return
+    if resume_store is not None:
+        for domain in domains:
+            resume_store.mark(domain, SUCCESS)
+
+def record_result(domain, log_messages, success, trace=None, attempts=1, from_shard=False):
+    """Write the per-domain log entry and remember permanent failures.
 
-    if not check_mongo_connection():
-        print("MongoDB not connected. Exiting.")
+    A success only reaches the resume store through confirm_stored(), after
+    its writes are acknowledged, so a crash cannot leave a domain marked done
+    without its document; in sharded runs the shard that wrote it reports it.
+    """
+    known_fingerprints.pop(domain, None)
+    if success and not from_shard:
+        if bulk_writer is not None:
+            bulk_writer.confirm(domain)
+        else:
+            confirm_stored([domain])   # written directly: already acknowledged
+    if crawl_queue is not None and not success:
+        error = log_messages[-1] if log_messages else None
+        if bulk_writer is not None:
+            # Not the domain's result: a failed write only means the lease expires and is retried
+            bulk_writer.submit(crawl_queue.collection, crawl_queue.complete_operation(domain, False, error), None)
+        else:
+            crawl_queue.complete(domain, False, error)
+    if shard_results is not None:
+        shard_results.put(("result", domain, log_messages, success, trace, attempts))
+        forward_metrics()
         return
+    metrics.finish(success)
+    trace = trace or {}
+    write_log(
+        domain, log_messages,
+        success=success,
+        stage=trace.get("stage"),
+        error_class=trace.get("error_class"),
+        attempts=attempts,
+        timings={k: v for k, v in trace.items() if k.endswith("_ms")},
+    )
+    if resume_store is not None and not success:
+        # Failures keep their class so later runs re-probe them after FAILURE_TTLS
+        resume_store.mark(domain, FAILED, trace.get("error_class") or "other")
+    if crawl_stats is not None:
+        crawl_stats.record(success, trace.get("error_class"), trace.get("certificate"))
+        flush_crawl_stats()
 
-    init_mongo_indexes()
+def report_progress(i, start_time):
+    if shard_results is not None:
+        return  # the parent prints combined progress for all shards
+    if i % 100 == 0:
+        t_now = time.time()
+        print(f"Processed {i} domains... Elapsed: {t_now - start_time:.2f}s, {metrics.progress_line()} "
+              f"(connection limit {connection_gate.limit})")
 
-    file_path = "datasets\cloudflare-radar_top-100-domains_pk_20251023-20251030.csv"
-    all_domains = load_domains_from_csv(file_path)
-    print(f"Total domains loaded: {len(all_domains)}")
+def forward_metrics(force=False):
+    """In a shard process: send this shard's stage metrics to the parent every METRICS_SNAPSHOT_INTERVAL."""
+    global last_metrics_forward
+    if force or time.monotonic() - last_metrics_forward >= METRICS_SNAPSHOT_INTERVAL:
+        last_metrics_forward = time.monotonic()
+        shard_results.put(("metrics", os.getpid(), metrics.state()))
 
-    # Get domains already successful (from DB)
-    print("Fetching already processed domains from MongoDB...")
-    processed_domains = set()
-    try:
-        for doc in collection.find({}, {"domain": 1, "_id": 0}):
-            processed_domains.add(doc["domain"])
-    except Exception as e:
-        print(f"Error fetching processed domains: {e}")
+def watch_engine(in_flight, retries):
+    """Register the running engine's queues and connection gate as metrics gauges."""
+    metrics.set_gauge("in_flight", in_flight)
+    metrics.set_gauge("retry_waiting", lambda: len(retries))
+    metrics.set_gauge("open_connections", lambda: connection_gate.in_flight)
+    metrics.set_gauge("connection_limit", lambda: connection_gate.limit)
 
-    # Get permanently failed domains (from failure.txt file)
-    failed_domains = load_failed_domains(FAILURE_FILE)
-    print(f"Loaded {len(failed_domains)} failed domains from {FAILURE_FILE}")
+def start_metrics(total=None):
+    """Start the metrics endpoint and snapshot file configured by METRICS_PORT / METRICS_SNAPSHOT_FILE."""
+    metrics.total = total
+    if METRICS_PORT is not None:
+        server = MetricsServer(metrics, METRICS_HOST, METRICS_PORT)
+        metrics_reporters.append(server)
+        print(f"Metrics at http://{METRICS_HOST}:{server.address[1]}/metrics (and /metrics.json)")
+    if METRICS_SNAPSHOT_FILE:
+        metrics_reporters.append(SnapshotWriter(metrics, METRICS_SNAPSHOT_FILE, METRICS_SNAPSHOT_INTERVAL))
 
-    # Build list to run
-    remaining_domains = [d for d in all_domains if d not in processed_domains and d not in failed_domains]
-    total_domains = len(remaining_domains)
-    
-    print(f"Domains remaining to process: {total_domains}")
+def count_input(file_path):
+    """Count the unique input hosts in the background; the ETA appears once metrics.total is set."""
+    def count():
+        metrics.total = sum(1 for _ in iter_domains_from_csv(file_path))
+    Thread(target=count, name="input-count", daemon=True).start()
 
-    if total_domains == 0:
-        print("All domains processed or failed. Exiting.")
-        return
+def stop_metrics():
+    while metrics_reporters:
+        metrics_reporters.pop().close()
+    print("Stage latencies:")
+    for stage, numbers in metrics.snapshot()["stages"].items():
+        if numbers["count"]:
+            outcomes = ", ".join(f"{n} {outcome}" for outcome, n in numbers["outcomes"].items())
+            print(f"  {stage:<9} {numbers['count']:>8} x  p50 {numbers['p50_ms']} ms, p99 {numbers['p99_ms']} ms ({outcomes})")
+
+def new_connection_gate(gate_class, initial, max_limit):
+    controller = AimdController(
+        initial,
+        min(ADAPTIVE_MIN_CONCURRENCY, max_limit),
+        max_limit,
+        increase=ADAPTIVE_INCREASE,
+        decrease_factor=ADAPTIVE_DECREASE_FACTOR,
+        window=ADAPTIVE_WINDOW,
+        error_threshold=ADAPTIVE_ERROR_THRESHOLD,
+        adaptive=ADAPTIVE_CONCURRENCY,
+    )
+    return gate_class(
+        controller,
+        per_ip_max=PER_IP_MAX_CONNECTIONS,
+        per_ip_rate=PER_IP_RATE,
+        per_ip_burst=PER_IP_BURST,
+    )
+
+def new_retry_scheduler():
+    return RetryScheduler(RETRY_POLICIES, DEFAULT_RETRY_POLICY, jitter=RETRY_JITTER)
+
+def finish_or_retry(retries, domain, attempt, log_messages, trace, success, error_class, record=None):
+    """Re-queue a retryable failure, otherwise record the final result. Returns True when finished.
 
+    record replaces record_result (the async engine passes one that runs it off the event loop).
+    """
+    if not success and error_class is not None:
+        if retries.schedule((domain, attempt + 1, log_messages, trace), attempt, error_class):
+            return False
+    (record or record_result)(domain, log_messages, success, trace, attempt + 1)
+    return True
+
+def run_thread_engine(domains, start_time):
+    """Run domains through the thread pool with at most MAX_IN_FLIGHT submitted or awaiting retry."""
+    global connection_gate
+    connection_gate = new_connection_gate(ConnectionGate, MAX_WORKERS, MAX_WORKERS)
+    domains = iter(domains)
+    retries = new_retry_scheduler()
+    pending = {}   # future -> (domain, attempt, log_messages, trace)
+    watch_engine(lambda: len(pending), retries)
+
+    def submit(domain, attempt, log_messages, trace):
+        pending[executor.submit(process_domain_attempt, domain, log_messages, trace)] = (domain, attempt, log_messages, trace)
+
+    def submit_more():
+        for item in retries.pop_due():
+            submit(*item)
+        for domain in islice(domains, max(MAX_IN_FLIGHT - len(pending) - len(retries), 0)):
+            # The DNS stage runs ahead of the connect workers on its own pool
+            resolver.prefetch(domain)
+            submit(domain, 0, [], {})
+
+    i = 0
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(process_domain_worker, domain): domain for domain in remaining_domains}
+        submit_more()
+        while pending or retries:
+            if pending:
+                done, _ = wait(pending, timeout=retries.next_due_in(), return_when=FIRST_COMPLETED)
+            else:
+                # Only delayed retries left: nothing to do until the first one is due
+                time.sleep(retries.next_due_in())
+                done = ()
+            for future in done:
+                domain, attempt, log_messages, trace = pending.pop(future)
+                try:
+                    _, _, success, error_class = future.result()
+                except Exception as e:
+                    # Catch Future exceptions to keep the pool running
+                    write_log(domain, [f"Future error: {e}"], success=False, stage="worker")
+                else:
+                    # Always log what happened to this domain once it is finished
+                    if not finish_or_retry(retries, domain, attempt, log_messages, trace, success, error_class):
+                        continue
+                i += 1
+                report_progress(i, start_time)
+            submit_more()
+
+async def run_async_engine(domains, start_time):
+    """Event-loop engine: a sliding window of MAX_IN_FLIGHT tasks, up to ASYNC_CONCURRENCY of them connecting."""
+    global connection_gate
+    connection_gate = new_connection_gate(
+        AsyncConnectionGate, ADAPTIVE_INITIAL_CONCURRENCY if ADAPTIVE_CONCURRENCY else ASYNC_CONCURRENCY, ASYNC_CONCURRENCY
+    )
+    domains = iter(domains)
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=ASYNC_BLOCKING_WORKERS))
+    retries = new_retry_scheduler()
+    pending = {}   # task -> (domain, attempt, log_messages, trace)
+    # record_result can block (bounded writer queues, SQLite, MongoDB without the bulk writer), so
+    # results are recorded in order on one thread; the ones waiting there count towards MAX_IN_FLIGHT
+    recorder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="record")
+    recording = set()
+    watch_engine(lambda: len(pending), retries)
+
+    def record(*args):
+        future = recorder.submit(record_result, *args)
+        recording.add(future)
+        future.add_done_callback(recorded)
+
+    def recorded(future):
+        recording.discard(future)
+        if future.exception() is not None:
+            print(f"Error recording a result: {future.exception()}")
+
+    def submit(domain, attempt, log_messages, trace):
+        task = asyncio.ensure_future(process_domain_attempt_async(domain, log_messages, trace))
+        pending[task] = (domain, attempt, log_messages, trace)
+
+    def submit_more():
+        for item in retries.pop_due():
+            submit(*item)
+        for domain in islice(domains, max(MAX_IN_FLIGHT - len(pending) - len(retries) - len(recording), 0)):
+            submit(domain, 0, [], {})
+
+    i = 0
+    try:
+        submit_more()
+        while pending or retries:
+            if pending:
+                done, _ = await asyncio.wait(pending, timeout=retries.next_due_in(), return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await asyncio.sleep(retries.next_due_in())
+                done = ()
+            for task in done:
+                domain, attempt, log_messages, trace = pending.pop(task)
+                try:
+                    _, _, success, error_class = task.result()
+                except Exception as e:
+                    write_log(domain, [f"Future error: {e}"], success=False, stage="worker")
+                else:
+                    if not finish_or_retry(retries, domain, attempt, log_messages, trace, success, error_class, record):
+                        continue
+                i += 1
+                report_progress(i, start_time)
+            submit_more()
+            while not pending and not retries and recording:
+                # The window is full of results being recorded: wait for room before giving up on the input
+                await asyncio.sleep(0.05)
+                submit_more()
+    finally:
+        await loop.run_in_executor(None, recorder.shutdown)
+
+def run_pipeline_engine(domains, start_time):
+    """Staged engine: resolve -> handshake -> parse thread pools joined by bounded queues.
 
-        for i, future in enumerate(as_completed(futures), start=1):
-            domain = futures[future]
+    Each stage has its own worker count (PIPELINE_*_WORKERS), so a slow
+    parser or MongoDB no longer holds a connection slot. Parsed documents go
+    to the bulk writer, the persist stage, whose bounded queue blocks the
+    parse workers when MongoDB falls behind. Full queues block the stage in
+    front of them up to this loop, which stops reading the input.
+    """
+    global connection_gate
+    connection_gate = new_connection_gate(
+        ConnectionGate,
+        ADAPTIVE_INITIAL_CONCURRENCY if ADAPTIVE_CONCURRENCY else PIPELINE_HANDSHAKE_WORKERS,
+        PIPELINE_HANDSHAKE_WORKERS,
+    )
+    domains = iter(domains)
+    retries = new_retry_scheduler()
+    finished = queue.Queue()   # (item, success, error_class, exception) from any stage
+    in_flight = 0
+
+    # Every job is a tuple whose first element is the engine item (domain, attempt, log_messages, trace)
+    def resolve(job):
+        item, = job
+        domain, _, log_messages, trace = item
+        started = time.monotonic()
+        addresses, error_class = resolve_domain(domain, log_messages=log_messages)
+        if not trace_resolve(domain, trace, addresses, error_class, started):
+            finished.put((item, False, retry_class(trace), None))
+            return None
+        return item, addresses
+
+    def handshake(job):
+        item, addresses = job
+        domain, _, log_messages, trace = item
+        pem_data, connection, error_class = fetch_attempt(domain, addresses, log_messages, trace)
+        if pem_data is None:
+            finished.put((item, False, error_class, None))
+            return None
+        return item, pem_data, connection
+
+    def parse(job):
+        item, pem_data, connection = job
+        domain, _, log_messages, trace = item
+        finished.put((item, process_attempt(domain, pem_data, connection, log_messages, trace), None, None))
+
+    def stage_failed(job, e):
+        finished.put((job[0], False, None, e))
+
+    pipeline = Pipeline([
+        Stage("resolve", resolve, PIPELINE_RESOLVE_WORKERS, PIPELINE_QUEUE_SIZE, stage_failed),
+        Stage("handshake", handshake, PIPELINE_HANDSHAKE_WORKERS, PIPELINE_QUEUE_SIZE, stage_failed),
+        Stage("parse", parse, PIPELINE_PARSE_WORKERS, PIPELINE_QUEUE_SIZE, stage_failed),
+    ])
+    watch_engine(lambda: in_flight, retries)
+    for stage in pipeline.stages:
+        metrics.set_gauge(f"queue_{stage.name}", stage.depth)
+        metrics.set_gauge(f"busy_{stage.name}", stage.busy)
+
+    def submit(item):
+        nonlocal in_flight
+        pipeline.put((item,))   # blocks while the resolve queue is full
+        in_flight += 1
+
+    def submit_more():
+        for item in retries.pop_due():
+            submit(item)
+        for domain in islice(domains, max(MAX_IN_FLIGHT - in_flight - len(retries), 0)):
+            submit((domain, 0, [], {}))
+
+    i = 0
+    pipeline.start()
+    try:
+        submit_more()
+        while in_flight or retries:
             try:
-                dom, log_messages, success = future.result()
-                # Always log what happened to this domain
-                write_log(dom, log_messages)
-                if not success:
-                    mark_domain_failed(dom, log_messages)
-            except Exception as e:
-                # Catch Future exceptions to keep the pool running
-                write_log(domain, [f"Future error: {e}"])
+                # Without pending retries a result is always on its way, so block until it arrives
+                item, success, error_class, error = finished.get(timeout=retries.next_due_in())
+            except queue.Empty:
+                submit_more()
+                continue
+            in_flight -= 1
+            domain, attempt, log_messages, trace = item
+            if error is not None:
+                write_log(domain, [f"Future error: {error}"], success=False, stage="worker")
+            elif not finish_or_retry(retries, domain, attempt, log_messages, trace, success, error_class):
+                submit_more()
+                continue
+            i += 1
+            report_progress(i, start_time)
+            if i % 1000 == 0:
+                print("Pipeline queues: " + ", ".join(f"{name} {n}" for name, n in pipeline.depths().items()))
+            submit_more()
+    finally:
+        pipeline.close()
+
+def new_resume_store(readonly=False):
+    return ResumeStore(
+        RESUME_DB, failure_ttls=FAILURE_TTLS, default_failure_ttl=DEFAULT_FAILURE_TTL,
+        index_path=RESUME_DB + ".index" if RESUME_INDEX else None, readonly=readonly,
+    )
+
+def open_resume_store():
+    """Open RESUME_DB; on its first use, seed it once from the domains already in MongoDB.
+
+    A FAILURE_FILE left by older versions is imported as unclassified
+    failures (dated by the file's mtime) and renamed so it is read only once.
+    """
+    store = new_resume_store()
+    if store.count() == 0 and "mongo" in RESULT_SINKS:
+        print("Resume store is empty, importing already processed domains from MongoDB...")
+        try:
+            for doc in collection.find({}, {"domain": 1, "_id": 0}):
+                store.mark(doc["domain"], SUCCESS)
+        except Exception as e:
+            print(f"Error fetching processed domains: {e}")
+        store.flush()
+    if os.path.exists(FAILURE_FILE):
+        imported = store.import_failures(load_failed_domains(FAILURE_FILE), updated_at=os.path.getmtime(FAILURE_FILE))
+        os.replace(FAILURE_FILE, FAILURE_FILE + ".imported")
+        print(f"Imported {imported} failed domains from {FAILURE_FILE}")
+    if SHARDS > 1:
+        store.save_index()   # shard processes load the saved index
+    print(f"Resume store {RESUME_DB}: {store.count()} domains already finished")
+    failures = store.failure_counts()
+    if failures:
+        print("Failed domains by class: " + ", ".join(f"{n} {error_class or 'unclassified'}" for error_class, n in failures.items()))
+    return store
+
+def iter_remaining_domains(file_path, shard_index=0, shard_count=1):
+    """Stream this shard's domains from the CSV, skipping finished ones and failures still within their TTL."""
+    stats = InputStats()
+    for domain in iter_domains_from_csv(file_path, stats):
+        if not in_shard(domain, shard_index, shard_count):
+            continue
+        if resume_store.should_skip(domain):
+            metrics.skip()
+            continue
+        yield domain
+    if shard_index == 0:
+        print(f"Input: {stats}")
+
+def in_shard(domain, shard_index, shard_count):
+    return shard_count <= 1 or zlib.crc32(domain.encode("utf-8")) % shard_count == shard_index
+
+def iter_pages(query, order, page_size=None):
+    """Documents matching query in (order, _id) order, one bounded query per page.
+
+    Each page resumes after the last key of the previous one instead of
+    keeping a cursor open, since the crawl can take longer between batches
+    than the server keeps an idle cursor (CursorNotFound).
+    """
+    page_size = page_size or RECRAWL_PAGE_SIZE
+    projection = {"domain": 1, "fingerprint_sha256": 1, order: 1}
+    page_query = query
+    while True:
+        page = list(collection.find(page_query, projection).sort([(order, 1), ("_id", 1)]).limit(page_size))
+        yield from page
+        if len(page) < page_size:
+            return
+        key, last_id = page[-1].get(order), page[-1]["_id"]
+        if key is None:   # null sorts first: the rest of the nulls, then every set key
+            after = {"$or": [{order: None, "_id": {"$gt": last_id}}, {order: {"$ne": None}}]}
+        else:
+            after = {"$or": [{order: key, "_id": {"$gt": last_id}}, {order: {"$gt": key}}]}
+        page_query = {"$and": [query, after]}
+
+def iter_due_domains(shard_index=0, shard_count=1):
+    """Incremental mode: stream stored domains whose certificate expires soon or that were not seen for a while.
+
+    Expiring certificates come first, most urgent first; both passes walk an
+    index. The stored fingerprint is remembered so an unchanged certificate
+    skips parsing. Failed domains are left to the re-probe TTLs.
+    """
+    now = datetime.now(timezone.utc)
+    expiring_before = now + timedelta(seconds=RECRAWL_EXPIRY_WINDOW)
+    passes = (
+        # last_seen: a domain this run already refreshed must not come round again on a later page
+        ({"not_after": {"$lt": expiring_before}, "$or": [{"last_seen": {"$lt": now}}, {"last_seen": None}]}, "not_after"),
+        ({"$and": [
+            {"$or": [{"last_seen": {"$lt": now - timedelta(seconds=RECRAWL_MAX_AGE)}}, {"last_seen": None}]},
+            {"$or": [{"not_after": {"$gte": expiring_before}}, {"not_after": None}]},
+        ]}, "last_seen"),
+    )
+    for query, order in passes:
+        for doc in iter_pages(query, order):
+            domain = doc.get("domain")
+            if not domain or not in_shard(domain, shard_index, shard_count):
+                continue
+            if resume_store.status(domain) == FAILED:
+                continue
+            if doc.get("fingerprint_sha256"):
+                known_fingerprints[domain] = doc["fingerprint_sha256"]
+            yield domain
+
+def iter_crawl_domains(file_path, shard_index=0, shard_count=1):
+    """Domains for this run according to CRAWL_MODE."""
+    new_domains = iter_remaining_domains(file_path, shard_index, shard_count)
+    if CRAWL_MODE == "incremental" and "mongo" in RESULT_SINKS:   # due dates live in MongoDB
+        return chain_iters(iter_due_domains(shard_index, shard_count), new_domains)
+    return new_domains
+
+def run_engine(domains, start_time):
+    """Run the configured engine over domains, then flush the writer and print stats."""
+    start_bulk_writer()
+    start_result_sinks()
+    try:
+        if ENGINE == "async":
+            asyncio.run(run_async_engine(domains, start_time))
+        elif ENGINE == "pipeline":
+            run_pipeline_engine(domains, start_time)
+        else:
+            run_thread_engine(domains, start_time)
+    finally:
+        close_zcert_pool()
+        flush_crawl_stats(force=True)
+        stop_bulk_writer()
+        stop_result_sinks()
+
+    gate_stats = connection_gate.stats() if connection_gate is not None else None
+    if gate_stats:
+        print(f"Connection limit: final {gate_stats['limit']}, {gate_stats['increases']} increases, "
+              f"{gate_stats['decreases']} decreases, {gate_stats['politeness_waits']} per-IP politeness waits")
+
+    dns_stats = resolver.stats()
+    print(f"DNS: {dns_stats['queries']} queries, hit rate {dns_stats['hit_rate']:.1%}, "
+          f"{dns_stats['negative_hits']} negative-cache hits, avg {dns_stats['avg_query_ms']:.1f} ms/query")
+    if "mongo" in RESULT_SINKS:
+        if CERT_STORAGE == "by_fingerprint":
+            print(f"Certificate cache: hit rate {fingerprint_cache.hit_rate():.1%} "
+                  f"({fingerprint_cache.hits} hits, {fingerprint_cache.misses} misses)")
+        if CAPTURE_CHAIN:
+            print(f"CA certificate cache: hit rate {ca_fingerprint_cache.hit_rate():.1%} "
+                  f"({ca_fingerprint_cache.hits} hits, {ca_fingerprint_cache.misses} misses)")
+    if CRAWL_MODE == "incremental":
+        print(f"Incremental: {unchanged_certificates} unchanged certificates only had last_seen updated")
+
+def open_crawl_queue():
+    global crawl_queue
+    crawl_queue = CrawlQueue(crawl_queue_collection, NODE_ID, QUEUE_LEASE_SECONDS, QUEUE_MAX_ATTEMPTS)
+    crawl_queue.ensure_indexes()
+
+def run_coordinator(file_path):
+    """Load the CSV into crawl_queue (domains already queued are kept) and report progress."""
+    work_queue = CrawlQueue(crawl_queue_collection, NODE_ID, QUEUE_LEASE_SECONDS, QUEUE_MAX_ATTEMPTS)
+    work_queue.ensure_indexes()
+    added = work_queue.load(iter_domains_from_csv(file_path))
+    reclaimed, exhausted = work_queue.reclaim_expired()
+    print(f"Queued {added} new domains; {reclaimed} expired leases reclaimed, {exhausted} given up")
+    counts = work_queue.counts()
+    print("crawl_queue: " + ", ".join(f"{n} {status}" for status, n in counts.items()))
+
+def run_queue_worker(start_time, stop_event=None):
+    """Crawl leased domains until the shared queue is drained, waiting while other nodes hold leases."""
+    crawl_queue.start_heartbeat(QUEUE_HEARTBEAT_INTERVAL)
+    try:
+        while True:
+            claims = crawl_queue.iter_claims(QUEUE_CLAIM_BATCH)
+            domains = claims
+            if stop_event is not None:
+                domains = takewhile(lambda _: not stop_event.is_set(), claims)
+            try:
+                run_engine(domains, start_time)
+            finally:
+                claims.close()   # stops claiming ahead
+            if stop_event is not None and stop_event.is_set():
+                break
+            # Leases of crashed nodes expire and come back as pending for this node to claim
+            crawl_queue.reclaim_expired()
+            remaining = crawl_queue.unfinished_elsewhere()
+            if remaining == 0:
+                break
+            print(f"{remaining} domains still pending or leased by other nodes, checking again in {QUEUE_POLL_INTERVAL}s")
+            time.sleep(QUEUE_POLL_INTERVAL)
+    finally:
+        crawl_queue.close()
+
+def run_shard(shard_index, shard_count, file_path, results, stop_event):
+    """Entry point of one shard process: its own MongoDB client, DNS cache, pools and counters."""
+    # Ctrl+C is handled by the parent, which asks shards to stop via stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    global shard_results, resume_store
+    shard_results = results
+    resume_store = new_resume_store(readonly=True)   # the parent records results
+    try:
+        if NODE_ROLE == "worker":
+            # Shards of a worker node each claim from the shared queue instead of hashing the CSV
+            open_crawl_queue()
+            run_queue_worker(time.time(), stop_event)
+        else:
+            domains = takewhile(
+                lambda _: not stop_event.is_set(),
+                iter_crawl_domains(file_path, shard_index, shard_count),
+            )
+            run_engine(domains, time.time())
+    finally:
+        resolver.close()
+        resume_store.close()
+        forward_metrics(force=True)
+        results.put(("done", shard_index))
+
+def run_sharded(file_path, start_time):
+    """Start SHARDS processes and be the single writer of the log, failure and resume files."""
+    ctx = multiprocessing.get_context("spawn")   # a fresh MongoClient per shard, never a forked one
+    results = ctx.Queue(maxsize=10000)
+    stop_event = ctx.Event()
+    shards = [
+        ctx.Process(target=run_shard, args=(i, SHARDS, file_path, results, stop_event), name=f"shard-{i}")
+        for i in range(SHARDS)
+    ]
+    for shard in shards:
+        shard.start()
+    print(f"Started {SHARDS} shard processes")
+
+    running = set(range(SHARDS))
+    i = 0
+    while running:
+        try:
+            message = results.get(timeout=1)
+        except KeyboardInterrupt:
+            if stop_event.is_set():
+                print("Second interrupt: terminating shards")
+                for shard in shards:
+                    shard.terminate()
+                break
+            print("Interrupted: shards finish their in-flight domains, press Ctrl+C again to abort")
+            stop_event.set()
+            continue
+        except queue.Empty:
+            for index in list(running):
+                if not shards[index].is_alive():
+                    print(f"Shard {index} exited with code {shards[index].exitcode}")
+                    running.discard(index)
+            continue
+
+        kind = message[0]
+        if kind == "result":
+            _, domain, log_messages, success, trace, attempts = message
+            record_result(domain, log_messages, success, trace, attempts, from_shard=True)
+            i += 1
             if i % 100 == 0:
-                t_now = time.time()
-                print(f"Processed {i}/{total_domains} domains... Elapsed: {t_now - start_time:.2f}s")
+                print(f"Processed {i} domains across {SHARDS} shards... Elapsed: {time.time() - start_time:.2f}s, "
+                      f"{metrics.progress_line()}")
+        elif kind == "metrics":
+            _, source, state = message
+            metrics.absorb(source, state)
+        elif kind == "log":
+            _, domain, log_messages, fields = message
+            write_log(domain, log_messages, **fields)
+        elif kind == "stored":
+            confirm_stored(message[1])
+        elif kind == "write_error":
+            _, domain, error = message
+            report_write_error(domain, error, None)
+        elif kind == "done":
+            running.discard(message[1])
+
+    for shard in shards:
+        shard.join()
+
+def main():
+    start_time = time.time()
+
+    if uses_mongo():
+        if not check_mongo_connection():
+            print("MongoDB not connected. Exiting.")
+            return
+        init_mongo_indexes()
+
+    file_path = "datasets\cloudflare-radar_top-100-domains_pk_20251023-20251030.csv"
+
+    if NODE_ROLE == "coordinator":
+        run_coordinator(file_path)
+        return
+
+    # Finished and failed domains come from the local resume store, not a collection scan
+    global resume_store
+    resume_store = open_resume_store()
+
+    # The log file is written by a background thread from here on
+    open_logs()
+    start_metrics()
+    if METRICS_COUNT_INPUT and NODE_ROLE != "worker":
+        count_input(file_path)
+    start_crawl_stats(file_path)
+    try:
+        if SHARDS > 1:
+            run_sharded(file_path, start_time)
+        elif NODE_ROLE == "worker":
+            open_crawl_queue()
+            run_queue_worker(start_time)
+        else:
+            # Stream the input: domains are read from the CSV only as in-flight slots free up
+            run_engine(iter_crawl_domains(file_path), start_time)
+    finally:
+        resolver.close()
+        flush_crawl_stats(force=True)   # sharded runs record results here, without a bulk writer
+        resume_store.close()
+        close_logs()
+        stop_metrics()
 
     end_time = time.time()
     print(f"\n Total execution time: {end_time - start_time:.2f} seconds")
@@ -0,0 +1,442 @@
+"""Offline crawler benchmark against a local TLS server farm.
+
+Starts a TlsFarm (see tls_farm.py), then runs each selected crawler over the
+farm's synthetic domains in its own child process and prints domains/sec,
+p50/p99 per-domain latency and the child's peak RSS:
+
+    python benchmark.py
+    python benchmark.py --domains 2000 --listeners 400 --targets v2-async,v2-threads
+    python benchmark.py --targets v2-async --set ASYNC_CONCURRENCY=200 --set CAPTURE_CHAIN=False
+
+The children never touch MongoDB or the internet: the stub resolver points
+the synthetic names at the farm, MongoDB collections are replaced by an
+in-memory sink, and log/resume files go to a temporary directory. Latency is
+measured from a domain's first connection attempt, once it holds a
+connection slot (a worker thread for the old crawlers), to its final result,
+so the v2 engines' retry backoff is included but time queued in their
+in-flight window is not, and every engine measures the same hot path. v2
+resolves names in a stage ahead of the connect, so its latency leaves DNS
+out, and domains that never reach a connection have none. Crawler-latest.py and
+Crawler_multi-threading.py shell out to zcertificate.exe; when it is not on
+PATH they use the in-process cert_parser instead, and the report says so.
+"""
+import argparse
+import ast
+import importlib
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import tls_farm
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:  # optional: peak RSS on Windows
+    psutil = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESULT_PREFIX = "BENCHMARK_RESULT "
+
+DEFAULT_TARGETS = "latest,multi-threading,v2-async,v2-threads,v2-pipeline"
+CHILD_TIMEOUT = 1800   # seconds per target before the child is killed
+OLD_THREADS = 50       # Crawler_multi-threading.py's MAX_THREADS (a local in its main())
+
+
+# ---------------- Stand-ins ----------------
+
+class _WriteResult:
+    def __init__(self, count):
+        self.upserted_count = count
+        self.matched_count = 0
+        self.inserted_id = None
+
+
+class SinkCollection:
+    """In-memory stand-in for a MongoDB collection: remembers keys, counts writes."""
+
+    def __init__(self, name):
+        self.full_name = name
+        self.keys = set()
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def _key(self, query):
+        return query.get("_id", query.get("domain"))
+
+    def insert_one(self, document):
+        with self.lock:
+            self.keys.add(document.get("_id", document.get("domain")))
+            self.writes += 1
+        return _WriteResult(1)
+
+    def update_one(self, query, update, upsert=False):
+        with self.lock:
+            self.keys.add(self._key(query))
+            self.writes += 1
+        return _WriteResult(1)
+
+    def bulk_write(self, operations, ordered=True):
+        with self.lock:
+            for operation in operations:
+                self.keys.add(self._key(getattr(operation, "_filter", {})))
+            self.writes += len(operations)
+        return _WriteResult(len(operations))
+
+    def count_documents(self, query, limit=0):
+        with self.lock:
+            return int(self._key(query) in self.keys)
+
+    def find_one(self, query, *args, **kwargs):
+        return None
+
+    def find(self, *args, **kwargs):
+        return iter(())
+
+    def create_index(self, *args, **kwargs):
+        return None
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.started = {}
+        self.latencies = []
+        self.finished = 0
+        self.successes = 0
+        self.lock = threading.Lock()
+
+    def start(self, domain):
+        with self.lock:
+            self.started.setdefault(domain, time.perf_counter())
+
+    def finish(self, domain, success):
+        with self.lock:
+            started = self.started.pop(domain, None)
+            if started is not None:
+                self.latencies.append(time.perf_counter() - started)
+            self.finished += 1
+            if success:
+                self.successes += 1
+
+
+# ---------------- Targets (run in the child) ----------------
+
+def load_script(file_name, module_name):
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(HERE, file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def zcertificate_available():
+    return bool(shutil.which("zcertificate.exe") or shutil.which("zcertificate"))
+
+
+def prepare_old_script(module):
+    """Swap MongoDB (and zcertificate.exe when it is missing) for the old single-file crawlers."""
+    module.collection = SinkCollection("certificates")
+    if zcertificate_available():
+        return {}
+    from cert_parser import parse_certificate_pem
+
+    def run_native_parser_on_pem(pem_data, log_messages=None):
+        try:
+            return parse_certificate_pem(pem_data)
+        except Exception as e:
+            if log_messages is not None:
+                log_messages.append(f"Error parsing certificate: {e}")
+            return None
+
+    module.run_zcertificate_on_pem = run_native_parser_on_pem
+    return {"parser": "cert_parser (zcertificate.exe not found)"}
+
+
+def crawl_one(module, domain, log_messages):
+    """Crawler-latest.py's per-domain loop body; True if a certificate was stored."""
+    pem_data = module.connect_to_domain(domain, log_messages=log_messages)
+    if pem_data is None:
+        return False
+    parsed_json = module.run_zcertificate_on_pem(pem_data, log_messages=log_messages)
+    module.save_certificate_to_mongodb(parsed_json, domain, log_messages=log_messages)
+    return parsed_json is not None
+
+
+def run_latest(domains, workdir, overrides):
+    module = load_script("Crawler-latest.py", "crawler_latest")
+    notes = prepare_old_script(module)
+    apply_overrides(module, overrides)
+    recorder = LatencyRecorder()
+    with open(os.path.join(workdir, "latest.log"), "a") as log_file:
+        for domain in domains:
+            log_messages = []
+            recorder.start(domain)
+            success = crawl_one(module, domain, log_messages)
+            if log_messages:
+                module.write_log(domain, log_messages, log_file)
+            recorder.finish(domain, success)
+    return recorder, notes
+
+
+def run_multi_threading(domains, workdir, overrides):
+    module = load_script("Crawler_multi-threading.py", "crawler_multi_threading")
+    notes = prepare_old_script(module)
+    threads = int(overrides.pop("MAX_THREADS", OLD_THREADS))
+    apply_overrides(module, overrides)
+    log_path = os.path.join(workdir, "multi-threading.log")
+    recorder = LatencyRecorder()
+
+    def process_domain(domain):
+        log_messages = []
+        recorder.start(domain)
+        success = crawl_one(module, domain, log_messages)
+        if log_messages:
+            module.write_log(domain, log_messages, log_path)
+        recorder.finish(domain, success)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for future in as_completed([executor.submit(process_domain, domain) for domain in domains]):
+            future.result()
+    notes["threads"] = threads
+    return recorder, notes
+
+
+def run_v2(engine):
+    def run(domains, workdir, overrides):
+        module = importlib.import_module("Crawler_multi_T_state_saving_v2")
+        from dns_resolver import CachingResolver
+
+        module.ENGINE = engine
+        module.LOG_FILE = os.path.join(workdir, f"v2-{engine}.jsonl")
+        apply_overrides(module, overrides)
+        for name in ("collection", "certificates_by_fp", "ca_certificates", "crawl_queue_collection", "crawl_stats_collection"):
+            setattr(module, name, SinkCollection(name))
+        module.fingerprint_cache.collection = module.certificates_by_fp
+        module.ca_fingerprint_cache.collection = module.ca_certificates
+        # dnspython talks to real nameservers; getaddrinfo goes through the stub resolver
+        module.resolver.close()
+        module.resolver = CachingResolver(
+            concurrency=module.DNS_CONCURRENCY,
+            timeout=module.DNS_TIMEOUT,
+            default_ttl=module.DNS_DEFAULT_TTL,
+            negative_ttl=module.DNS_NEGATIVE_TTL,
+            use_dnspython=False,
+        )
+        module.RESUME_DB = os.path.join(workdir, f"v2-{engine}.sqlite")
+        module.resume_store = module.new_resume_store()
+
+        recorder = LatencyRecorder()
+        connect, connect_async, record_result = (
+            module.connect_to_domain, module.connect_to_domain_async, module.record_result
+        )
+
+        # Every engine calls connect_to_domain(_async) once it holds a connection slot
+        def timed_connect(domain, *args, **kwargs):
+            recorder.start(domain)
+            return connect(domain, *args, **kwargs)
+
+        async def timed_connect_async(domain, *args, **kwargs):
+            recorder.start(domain)
+            return await connect_async(domain, *args, **kwargs)
+
+        def timed_record_result(domain, log_messages, success, trace=None, attempts=1):
+            record_result(domain, log_messages, success, trace, attempts)
+            recorder.finish(domain, success)
+
+        module.connect_to_domain = timed_connect
+        module.connect_to_domain_async = timed_connect_async
+        module.record_result = timed_record_result
+
+        module.open_logs()
+        try:
+            module.run_engine(iter(domains), time.time())
+        finally:
+            module.resolver.close()
+            module.resume_store.close()
+            module.close_logs()
+        return recorder, {"engine": engine}
+    return run
+
+
+TARGETS = {
+    "latest": run_latest,
+    "multi-threading": run_multi_threading,
+    "v2-async": run_v2("async"),
+    "v2-threads": run_v2("threads"),
+    "v2-pipeline": run_v2("pipeline"),
+}
+
+
+def apply_overrides(module, overrides):
+    for name, value in overrides.items():
+        if not hasattr(module, name):
+            raise SystemExit(f"--set {name}: no such setting in {module.__name__}")
+        setattr(module, name, value)
+
+
+def peak_rss_mb():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024   # bytes on macOS, KiB elsewhere
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+    return None
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+def run_child(target, map_path, workdir, overrides):
+    """Child process entry: crawl the farm with one target and print its result line."""
+    with open(map_path) as f:
+        farm_map = json.load(f)
+    tls_farm.install_stub_resolver(farm_map)
+    domains = list(farm_map["kinds"])
+
+    started = time.perf_counter()
+    recorder, notes = TARGETS[target](domains, workdir, overrides)
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(recorder.latencies)
+    result = {
+        "target": target,
+        "domains": len(domains),
+        "finished": recorder.finished,
+        "succeeded": recorder.successes,
+        "seconds": round(elapsed, 3),
+        "domains_per_sec": round(recorder.finished / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1) if peak_rss_mb() is not None else None,
+        "notes": notes,
+    }
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+
+# ---------------- Parent ----------------
+
+def parse_settings(pairs):
+    """--set NAME=VALUE pairs as a dict; values are Python literals, or strings."""
+    settings = {}
+    for pair in pairs:
+        name, _, value = pair.partition("=")
+        try:
+            settings[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            settings[name] = value
+    return settings
+
+
+def parse_mix(text):
+    if not text:
+        return None
+    mix = {}
+    for pair in text.split(","):
+        kind, _, share = pair.partition("=")
+        if kind not in tls_farm.DEFAULT_MIX:
+            raise SystemExit(f"--mix: unknown kind {kind!r} (known: {', '.join(tls_farm.DEFAULT_MIX)})")
+        mix[kind] = float(share)
+    return mix
+
+
+def run_target(target, map_path, farm, args):
+    workdir = tempfile.mkdtemp(prefix=f"bench-{target}-")
+    command = [sys.executable, os.path.abspath(__file__), "--child", target, "--map", map_path, "--workdir", workdir]
+    for pair in args.set:
+        command += ["--set", pair]
+    env = dict(os.environ, SSL_CERT_FILE=farm.ca_file, PYTHONUNBUFFERED="1")
+    try:
+        completed = subprocess.run(command, cwd=HERE, env=env, capture_output=True, text=True, timeout=args.timeout)
+    except subprocess.TimeoutExpired:
+        return {"target": target, "error": f"timed out after {args.timeout} s"}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.verbose:
+        sys.stdout.write(completed.stdout)
+    sys.stderr.write(completed.stderr)
+    for line in reversed(completed.stdout.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    return {"target": target, "error": f"exit code {completed.returncode}"}
+
+
+def print_report(results, farm):
+    kinds = {}
+    for kind in farm.kinds.values():
+        kinds[kind] = kinds.get(kind, 0) + 1
+    print(f"\nFarm: {len(farm.kinds)} domains on {len(farm.ports)} listeners "
+          f"({', '.join(f'{n} {kind}' for kind, n in kinds.items())}), slow delay {farm.slow_delay} s")
+    print(f"{'target':<16}{'ok/done':>11}{'seconds':>10}{'domains/s':>11}{'p50 ms':>10}{'p99 ms':>10}{'peak RSS MB':>13}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['target']:<16}  {result['error']}")
+            continue
+        print(f"{result['target']:<16}{result['succeeded']:>5}/{result['finished']:<5}{result['seconds']:>10.2f}"
+              f"{result['domains_per_sec']:>11.1f}{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+              f"{result['peak_rss_mb'] if result['peak_rss_mb'] is not None else '-':>13}")
+    print("Latency: from a domain's first connection attempt (connection slot held) to its final result")
+    for result in results:
+        if result.get("notes"):
+            print(f"  {result['target']}: " + ", ".join(f"{k}={v}" for k, v in result["notes"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--domains", type=int, default=500, help="synthetic domains to crawl")
+    parser.add_argument("--listeners", type=int, default=200, help="TLS listeners serving them")
+    parser.add_argument("--mix", help="domain shares per kind, e.g. ok=0.9,slow=0.05,drop=0.05")
+    parser.add_argument("--slow-delay", type=float, default=0.5, help="seconds slow listeners wait before the handshake")
+    parser.add_argument("--farm-processes", type=int, default=2, help="processes serving the listeners")
+    parser.add_argument("--targets", default=DEFAULT_TARGETS, help=f"comma-separated subset of {', '.join(TARGETS)}")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="override a module setting of the target, e.g. ASYNC_CONCURRENCY=200")
+    parser.add_argument("--timeout", type=int, default=CHILD_TIMEOUT, help="seconds per target")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the crawlers' own output")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--map", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.map, args.workdir, parse_settings(args.set))
+        return
+
+    targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    unknown = [t for t in targets if t not in TARGETS]
+    if unknown:
+        raise SystemExit(f"unknown targets: {', '.join(unknown)} (known: {', '.join(TARGETS)})")
+
+    farm = tls_farm.TlsFarm(args.domains, args.listeners, parse_mix(args.mix), args.slow_delay, args.farm_processes)
+    print(f"Starting farm: {args.domains} domains, {args.listeners} listeners...")
+    with farm:
+        map_path = os.path.join(farm.workdir, "farm.json")
+        farm.write_map(map_path)
+        results = []
+        for target in targets:
+            print(f"Running {target}...")
+            results.append(run_target(target, map_path, farm, args))
+        print_report(results, farm)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Fixed-size Bloom filter over strings.
+
+Sized from the expected number of items and the false-positive rate wanted:
+m = -n ln(p) / ln(2)^2 bits and k = m/n ln(2) hash functions. The k bit
+positions come from one 16-byte BLAKE2b digest by double hashing
+(h1 + i*h2), so adding or testing an item costs one hash call. 50M items
+at a one-in-a-million error rate take about 170 MB; a set of the same
+strings takes several GB.
+
+A Bloom filter never forgets an item it was given, but may report an item
+it was never given ("probably seen") with probability error_rate once it
+holds `capacity` items, more beyond that.
+"""
+import hashlib
+import math
+
+
+def optimal_size(capacity, error_rate):
+    """(bits, hash functions) for capacity items at error_rate."""
+    bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+    hashes = max(1, round(bits / capacity * math.log(2)))
+    return bits, hashes
+
+
+def item_hashes(item):
+    """The two 64-bit halves of the item's 16-byte BLAKE2b digest."""
+    digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=1e-6):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits, self.hashes = optimal_size(capacity, error_rate)
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        h1, h2 = item_hashes(item)
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, item):
+        """Add item; returns False if it was (probably) already present."""
+        new = False
+        array = self.array
+        for position in self._positions(item):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not array[byte] & mask:
+                array[byte] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __contains__(self, item):
+        array = self.array
+        return all(array[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,91 @@
+"""Fingerprint-keyed certificate cache.
+
+CDN and shared-hosting certificates are served by many domains. The crawler
+parses and stores each distinct certificate once in a `certificates_by_fp`
+collection (keyed by SHA-256 of the DER) and keeps an in-memory LRU of the
+fingerprints it knows are already stored, so repeat sightings cost neither a
+parse nor a database lookup. SummaryCache does the same for the summary
+fields (cert_parser.summarize_certificate_der) that lean records, result
+files and crawl statistics are built from.
+"""
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+
+def der_fingerprint(cert_der):
+    """SHA-256 of the DER bytes, hex encoded (same as zcertificate's fingerprint_sha256)."""
+    return hashlib.sha256(cert_der).hexdigest()
+
+
+class FingerprintCache:
+    """LRU set of fingerprints stored in `collection`, falling back to the collection on a miss."""
+
+    def __init__(self, collection, max_entries=100000):
+        self.collection = collection
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, fingerprint):
+        self.entries[fingerprint] = True
+        self.entries.move_to_end(fingerprint)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def contains(self, fingerprint):
+        """True if the certificate is already stored (checks memory first, then MongoDB)."""
+        with self.lock:
+            if fingerprint in self.entries:
+                self.entries.move_to_end(fingerprint)
+                self.hits += 1
+                return True
+
+        found = self.collection.count_documents({"_id": fingerprint}, limit=1) > 0
+        with self.lock:
+            if found:
+                self.hits += 1
+                self._remember(fingerprint)
+            else:
+                self.misses += 1
+        return found
+
+    def add(self, fingerprint):
+        with self.lock:
+            self._remember(fingerprint)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class SummaryCache:
+    """LRU of certificate summaries by fingerprint; summarize(der) runs once per distinct certificate.
+
+    The returned dicts are shared: copy one before changing it.
+    """
+
+    def __init__(self, summarize, max_entries=20000):
+        self.summarize = summarize
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fingerprint, cert_der):
+        with self.lock:
+            summary = self.entries.get(fingerprint)
+            if summary is not None:
+                self.entries.move_to_end(fingerprint)
+                self.hits += 1
+                return summary
+            self.misses += 1
+        summary = self.summarize(cert_der)   # outside the lock; raises for an unparseable certificate
+        with self.lock:
+            self.entries[fingerprint] = summary
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return summary
@@ -0,0 +1,430 @@
+"""In-process certificate parser producing zcertificate-style JSON documents.
+
+Built on cryptography.x509 so a certificate can be parsed without starting
+zcertificate.exe. The field names follow zcrypto's JSON encoding ("raw" plus a
+"parsed" object) so documents already stored in MongoDB keep the same shape.
+"""
+import base64
+import hashlib
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import dsa, ec, ed448, ed25519, rsa
+from cryptography.x509.oid import ExtensionOID, ExtendedKeyUsageOID, NameOID, SignatureAlgorithmOID
+
+# ---------------- Name mappings ----------------
+
+# zcrypto pkix.Name JSON keys
+NAME_FIELDS = {
+    NameOID.COMMON_NAME: "common_name",
+    NameOID.SERIAL_NUMBER: "serial_number",
+    NameOID.COUNTRY_NAME: "country",
+    NameOID.LOCALITY_NAME: "locality",
+    NameOID.STATE_OR_PROVINCE_NAME: "province",
+    NameOID.STREET_ADDRESS: "street_address",
+    NameOID.ORGANIZATION_NAME: "organization",
+    NameOID.ORGANIZATIONAL_UNIT_NAME: "organizational_unit",
+    NameOID.POSTAL_CODE: "postal_code",
+    NameOID.DOMAIN_COMPONENT: "domain_component",
+    NameOID.EMAIL_ADDRESS: "email_address",
+    NameOID.GIVEN_NAME: "given_name",
+    NameOID.SURNAME: "surname",
+    NameOID.JURISDICTION_COUNTRY_NAME: "jurisdiction_country",
+    NameOID.JURISDICTION_LOCALITY_NAME: "jurisdiction_locality",
+    NameOID.JURISDICTION_STATE_OR_PROVINCE_NAME: "jurisdiction_province",
+}
+
+# Short attribute names used in subject_dn / issuer_dn
+DN_SHORT_NAMES = {
+    NameOID.COMMON_NAME: "CN",
+    NameOID.SERIAL_NUMBER: "serialNumber",
+    NameOID.COUNTRY_NAME: "C",
+    NameOID.LOCALITY_NAME: "L",
+    NameOID.STATE_OR_PROVINCE_NAME: "ST",
+    NameOID.STREET_ADDRESS: "street",
+    NameOID.ORGANIZATION_NAME: "O",
+    NameOID.ORGANIZATIONAL_UNIT_NAME: "OU",
+    NameOID.POSTAL_CODE: "postalCode",
+    NameOID.DOMAIN_COMPONENT: "DC",
+    NameOID.EMAIL_ADDRESS: "emailAddress",
+}
+
+# (zcrypto name, cryptography attribute, bit value)
+KEY_USAGE_BITS = [
+    ("digital_signature", "digital_signature", 1),
+    ("content_commitment", "content_commitment", 2),
+    ("key_encipherment", "key_encipherment", 4),
+    ("data_encipherment", "data_encipherment", 8),
+    ("key_agreement", "key_agreement", 16),
+    ("certificate_sign", "key_cert_sign", 32),
+    ("crl_sign", "crl_sign", 64),
+    ("encipher_only", "encipher_only", 128),
+    ("decipher_only", "decipher_only", 256),
+]
+
+EXTENDED_KEY_USAGES = {
+    ExtendedKeyUsageOID.SERVER_AUTH: "server_auth",
+    ExtendedKeyUsageOID.CLIENT_AUTH: "client_auth",
+    ExtendedKeyUsageOID.CODE_SIGNING: "code_signing",
+    ExtendedKeyUsageOID.EMAIL_PROTECTION: "email_protection",
+    ExtendedKeyUsageOID.TIME_STAMPING: "time_stamping",
+    ExtendedKeyUsageOID.OCSP_SIGNING: "ocsp_signing",
+    ExtendedKeyUsageOID.ANY_EXTENDED_KEY_USAGE: "any",
+}
+
+# zcrypto x509.SignatureAlgorithm names
+SIGNATURE_ALGORITHMS = {
+    SignatureAlgorithmOID.RSA_WITH_MD5: "MD5-RSA",
+    SignatureAlgorithmOID.RSA_WITH_SHA1: "SHA1-RSA",
+    SignatureAlgorithmOID.RSA_WITH_SHA224: "SHA224-RSA",
+    SignatureAlgorithmOID.RSA_WITH_SHA256: "SHA256-RSA",
+    SignatureAlgorithmOID.RSA_WITH_SHA384: "SHA384-RSA",
+    SignatureAlgorithmOID.RSA_WITH_SHA512: "SHA512-RSA",
+    SignatureAlgorithmOID.RSASSA_PSS: "SHA256-RSAPSS",
+    SignatureAlgorithmOID.ECDSA_WITH_SHA1: "ECDSA-SHA1",
+    SignatureAlgorithmOID.ECDSA_WITH_SHA224: "ECDSA-SHA224",
+    SignatureAlgorithmOID.ECDSA_WITH_SHA256: "ECDSA-SHA256",
+    SignatureAlgorithmOID.ECDSA_WITH_SHA384: "ECDSA-SHA384",
+    SignatureAlgorithmOID.ECDSA_WITH_SHA512: "ECDSA-SHA512",
+    SignatureAlgorithmOID.DSA_WITH_SHA1: "DSA-SHA1",
+    SignatureAlgorithmOID.DSA_WITH_SHA256: "DSA-SHA256",
+    SignatureAlgorithmOID.ED25519: "Ed25519",
+    SignatureAlgorithmOID.ED448: "Ed448",
+}
+
+# CA/Browser Forum policy identifiers
+VALIDATION_LEVELS = {
+    "2.23.140.1.1": "EV",
+    "2.23.140.1.2.2": "OV",
+    "2.23.140.1.2.3": "OV",
+    "2.23.140.1.2.1": "DV",
+}
+
+ZCRYPTO_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# ============= Helpers =============
+
+def _b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+def _int_b64(value):
+    length = max(1, (value.bit_length() + 7) // 8)
+    return _b64(value.to_bytes(length, "big"))
+
+def _name_to_dict(name):
+    result = {}
+    for attribute in name:
+        key = NAME_FIELDS.get(attribute.oid)
+        if key is None:
+            continue
+        value = attribute.value
+        if isinstance(value, bytes):
+            value = value.decode("utf-8", errors="replace")
+        result.setdefault(key, []).append(value)
+    return result
+
+def _name_to_dn(name):
+    parts = []
+    for attribute in name:
+        label = DN_SHORT_NAMES.get(attribute.oid, attribute.oid.dotted_string)
+        value = attribute.value
+        if isinstance(value, bytes):
+            value = value.decode("utf-8", errors="replace")
+        parts.append(f"{label}={value}")
+    return ", ".join(parts)
+
+def _signature_algorithm(cert):
+    oid = cert.signature_algorithm_oid
+    return {"name": SIGNATURE_ALGORITHMS.get(oid, oid.dotted_string), "oid": oid.dotted_string}
+
+def _subject_key_info(cert):
+    public_key = cert.public_key()
+    spki_der = public_key.public_bytes(
+        serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    info = {"fingerprint_sha256": hashlib.sha256(spki_der).hexdigest()}
+
+    if isinstance(public_key, rsa.RSAPublicKey):
+        numbers = public_key.public_numbers()
+        info["key_algorithm"] = {"name": "RSA"}
+        info["rsa_public_key"] = {
+            "exponent": numbers.e,
+            "modulus": _int_b64(numbers.n),
+            "length": public_key.key_size,
+        }
+    elif isinstance(public_key, ec.EllipticCurvePublicKey):
+        numbers = public_key.public_numbers()
+        point = public_key.public_bytes(
+            serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+        )
+        info["key_algorithm"] = {"name": "ECDSA"}
+        info["ecdsa_public_key"] = {
+            "curve": _curve_name(public_key.curve),
+            "length": public_key.curve.key_size,
+            "pub": _b64(point),
+            "x": _int_b64(numbers.x),
+            "y": _int_b64(numbers.y),
+        }
+    elif isinstance(public_key, dsa.DSAPublicKey):
+        numbers = public_key.public_numbers()
+        params = numbers.parameter_numbers
+        info["key_algorithm"] = {"name": "DSA"}
+        info["dsa_public_key"] = {
+            "p": _int_b64(params.p),
+            "q": _int_b64(params.q),
+            "g": _int_b64(params.g),
+            "y": _int_b64(numbers.y),
+        }
+    elif isinstance(public_key, (ed25519.Ed25519PublicKey, ed448.Ed448PublicKey)):
+        name = "Ed25519" if isinstance(public_key, ed25519.Ed25519PublicKey) else "Ed448"
+        raw = public_key.public_bytes(serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+        info["key_algorithm"] = {"name": name}
+        info[f"{name.lower()}_public_key"] = {"public_key": _b64(raw)}
+    else:
+        info["key_algorithm"] = {"name": "unknown"}
+    return info
+
+def _curve_name(curve):
+    return {"secp256r1": "P-256", "secp384r1": "P-384", "secp521r1": "P-521"}.get(curve.name, curve.name)
+
+def _general_names(names):
+    result = {}
+    for general_name in names:
+        if isinstance(general_name, x509.DNSName):
+            result.setdefault("dns_names", []).append(general_name.value)
+        elif isinstance(general_name, x509.IPAddress):
+            result.setdefault("ip_addresses", []).append(str(general_name.value))
+        elif isinstance(general_name, x509.RFC822Name):
+            result.setdefault("email_addresses", []).append(general_name.value)
+        elif isinstance(general_name, x509.UniformResourceIdentifier):
+            result.setdefault("uniform_resource_identifiers", []).append(general_name.value)
+        elif isinstance(general_name, x509.DirectoryName):
+            result.setdefault("directory_names", []).append(_name_to_dict(general_name.value))
+        elif isinstance(general_name, x509.RegisteredID):
+            result.setdefault("registered_ids", []).append(general_name.value.dotted_string)
+    return result
+
+def _extensions(cert):
+    """Translate the extensions zcertificate decodes; unknown ones are listed by OID."""
+    result = {}
+    unknown = []
+    for extension in cert.extensions:
+        oid = extension.oid
+        value = extension.value
+        if oid == ExtensionOID.KEY_USAGE:
+            key_usage = {"value": 0}
+            for name, attribute, bit in KEY_USAGE_BITS:
+                try:
+                    enabled = getattr(value, attribute)
+                except ValueError:
+                    # encipher_only/decipher_only are undefined without key_agreement
+                    enabled = False
+                if enabled:
+                    key_usage[name] = True
+                    key_usage["value"] |= bit
+            result["key_usage"] = key_usage
+        elif oid == ExtensionOID.BASIC_CONSTRAINTS:
+            basic = {"is_ca": value.ca}
+            if value.path_length is not None:
+                basic["max_path_len"] = value.path_length
+            result["basic_constraints"] = basic
+        elif oid == ExtensionOID.SUBJECT_ALTERNATIVE_NAME:
+            result["subject_alt_name"] = _general_names(value)
+        elif oid == ExtensionOID.ISSUER_ALTERNATIVE_NAME:
+            result["issuer_alt_name"] = _general_names(value)
+        elif oid == ExtensionOID.AUTHORITY_KEY_IDENTIFIER:
+            if value.key_identifier is not None:
+                result["authority_key_id"] = value.key_identifier.hex()
+        elif oid == ExtensionOID.SUBJECT_KEY_IDENTIFIER:
+            result["subject_key_id"] = value.digest.hex()
+        elif oid == ExtensionOID.EXTENDED_KEY_USAGE:
+            usages = {}
+            for usage in value:
+                name = EXTENDED_KEY_USAGES.get(usage)
+                if name:
+                    usages[name] = True
+                else:
+                    usages.setdefault("unknown", []).append(usage.dotted_string)
+            result["extended_key_usage"] = usages
+        elif oid == ExtensionOID.CERTIFICATE_POLICIES:
+            policies = []
+            for policy in value:
+                entry = {"id": policy.policy_identifier.dotted_string}
+                cps = [q for q in (policy.policy_qualifiers or []) if isinstance(q, str)]
+                if cps:
+                    entry["cps"] = cps
+                policies.append(entry)
+            result["certificate_policies"] = policies
+        elif oid == ExtensionOID.AUTHORITY_INFORMATION_ACCESS:
+            access = {}
+            for description in value:
+                if not isinstance(description.access_location, x509.UniformResourceIdentifier):
+                    continue
+                url = description.access_location.value
+                if description.access_method == x509.AuthorityInformationAccessOID.OCSP:
+                    access.setdefault("ocsp_urls", []).append(url)
+                elif description.access_method == x509.AuthorityInformationAccessOID.CA_ISSUERS:
+                    access.setdefault("issuer_urls", []).append(url)
+            result["authority_info_access"] = access
+        elif oid == ExtensionOID.CRL_DISTRIBUTION_POINTS:
+            urls = []
+            for point in value:
+                for general_name in point.full_name or []:
+                    if isinstance(general_name, x509.UniformResourceIdentifier):
+                        urls.append(general_name.value)
+            result["crl_distribution_points"] = urls
+        elif oid == ExtensionOID.PRECERT_SIGNED_CERTIFICATE_TIMESTAMPS:
+            result["signed_certificate_timestamps"] = [
+                {
+                    "version": sct.version.value,
+                    "log_id": _b64(sct.log_id),
+                    "timestamp": int(sct.timestamp.timestamp()),
+                }
+                for sct in value
+            ]
+        elif oid == ExtensionOID.NAME_CONSTRAINTS:
+            constraints = {"critical": extension.critical}
+            if value.permitted_subtrees:
+                constraints["permitted"] = _general_names(value.permitted_subtrees)
+            if value.excluded_subtrees:
+                constraints["excluded"] = _general_names(value.excluded_subtrees)
+            result["name_constraints"] = constraints
+        else:
+            unknown.append({"id": oid.dotted_string, "critical": extension.critical})
+    return result, unknown
+
+def _validation_level(extensions):
+    for policy in extensions.get("certificate_policies", []):
+        level = VALIDATION_LEVELS.get(policy["id"])
+        if level:
+            return level
+    return "unknown"
+
+def _is_self_signed(cert):
+    if cert.issuer != cert.subject:
+        return False
+    try:
+        cert.verify_directly_issued_by(cert)
+        return True
+    except Exception:
+        return False
+
+def _names(subject, extensions):
+    names = []
+    for name in subject.get("common_name", []) + extensions.get("subject_alt_name", {}).get("dns_names", []):
+        if name not in names:
+            names.append(name)
+    for address in extensions.get("subject_alt_name", {}).get("ip_addresses", []):
+        if address not in names:
+            names.append(address)
+    return names
+
+# ============= Public API =============
+
+def parse_certificate_der(cert_der):
+    """Parse a DER certificate into a zcertificate-compatible {"raw", "parsed"} document."""
+    cert = x509.load_der_x509_certificate(cert_der)
+
+    not_before = cert.not_valid_before_utc
+    not_after = cert.not_valid_after_utc
+    subject = _name_to_dict(cert.subject)
+    issuer = _name_to_dict(cert.issuer)
+    extensions, unknown_extensions = _extensions(cert)
+    signature_algorithm = _signature_algorithm(cert)
+    self_signed = _is_self_signed(cert)
+
+    parsed = {
+        "version": cert.version.value + 1,
+        "serial_number": str(cert.serial_number),
+        "signature_algorithm": signature_algorithm,
+        "issuer": issuer,
+        "issuer_dn": _name_to_dn(cert.issuer),
+        "validity": {
+            "start": not_before.strftime(ZCRYPTO_TIME_FORMAT),
+            "end": not_after.strftime(ZCRYPTO_TIME_FORMAT),
+            "length": int((not_after - not_before).total_seconds()),
+        },
+        "subject": subject,
+        "subject_dn": _name_to_dn(cert.subject),
+        "subject_key_info": _subject_key_info(cert),
+        "extensions": extensions,
+        "signature": {
+            "signature_algorithm": signature_algorithm,
+            "value": _b64(cert.signature),
+            "valid": self_signed,
+            "self_signed": self_signed,
+        },
+        "fingerprint_md5": hashlib.md5(cert_der).hexdigest(),
+        "fingerprint_sha1": hashlib.sha1(cert_der).hexdigest(),
+        "fingerprint_sha256": hashlib.sha256(cert_der).hexdigest(),
+        "tbs_fingerprint": hashlib.sha256(cert.tbs_certificate_bytes).hexdigest(),
+        "validation_level": _validation_level(extensions),
+        "names": _names(subject, extensions),
+        "redacted": False,
+    }
+    if unknown_extensions:
+        parsed["unknown_extensions"] = unknown_extensions
+
+    return {"raw": _b64(cert_der), "parsed": parsed}
+
+def parse_certificate_pem(pem_data):
+    """Convenience wrapper for callers that already hold a PEM string."""
+    cert = x509.load_pem_x509_certificate(pem_data.encode("ascii"))
+    return parse_certificate_der(cert.public_bytes(serialization.Encoding.DER))
+
+def summarize_certificate_der(cert_der):
+    """Flat dict of the core fields analytics group by (issuer, key, validity, names).
+
+    Cheaper than parse_certificate_der: only the SAN, basic constraints and
+    policy extensions are read and the signature is not checked.
+    """
+    cert = x509.load_der_x509_certificate(cert_der)
+    subject = _name_to_dict(cert.subject)
+    issuer = _name_to_dict(cert.issuer)
+    public_key = cert.public_key()
+    if isinstance(public_key, rsa.RSAPublicKey):
+        key_algorithm, key_bits, curve = "RSA", public_key.key_size, None
+    elif isinstance(public_key, ec.EllipticCurvePublicKey):
+        key_algorithm, key_bits, curve = "ECDSA", public_key.curve.key_size, _curve_name(public_key.curve)
+    elif isinstance(public_key, dsa.DSAPublicKey):
+        key_algorithm, key_bits, curve = "DSA", public_key.key_size, None
+    elif isinstance(public_key, ed25519.Ed25519PublicKey):
+        key_algorithm, key_bits, curve = "Ed25519", 256, None
+    elif isinstance(public_key, ed448.Ed448PublicKey):
+        key_algorithm, key_bits, curve = "Ed448", 456, None
+    else:
+        key_algorithm, key_bits, curve = "unknown", None, None
+
+    san_dns = []
+    is_ca = False
+    policies = []
+    for extension in cert.extensions:
+        if extension.oid == ExtensionOID.SUBJECT_ALTERNATIVE_NAME:
+            san_dns = extension.value.get_values_for_type(x509.DNSName)
+        elif extension.oid == ExtensionOID.BASIC_CONSTRAINTS:
+            is_ca = extension.value.ca
+        elif extension.oid == ExtensionOID.CERTIFICATE_POLICIES:
+            policies = [{"id": policy.policy_identifier.dotted_string} for policy in extension.value]
+
+    not_before = cert.not_valid_before_utc
+    not_after = cert.not_valid_after_utc
+    return {
+        "subject_cn": (subject.get("common_name") or [None])[0],
+        "subject_o": (subject.get("organization") or [None])[0],
+        "issuer_cn": (issuer.get("common_name") or [None])[0],
+        "issuer_o": (issuer.get("organization") or [None])[0],
+        "issuer_dn": _name_to_dn(cert.issuer),
+        "serial_number": str(cert.serial_number),
+        "not_before": not_before,
+        "not_after": not_after,
+        "validity_days": (not_after - not_before).days,
+        "key_algorithm": key_algorithm,
+        "key_bits": key_bits,
+        "curve": curve,
+        "signature_algorithm": _signature_algorithm(cert)["name"],
+        "san_dns": san_dns,
+        "san_count": len(san_dns),
+        "self_issued": cert.issuer == cert.subject,
+        "is_ca": is_ca,
+        "validation_level": _validation_level({"certificate_policies": policies}),
+    }
@@ -0,0 +1,226 @@
+"""Adaptive global concurrency plus per-IP politeness for connection attempts.
+
+AimdController adjusts the global connection limit from observed outcomes:
+after every `window` attempts it multiplies the limit by `decrease_factor`
+if the share of congestion errors (timeouts, resets) exceeded
+`error_threshold`, otherwise it adds `increase`. On top of that every
+resolved IP gets a cap on simultaneous connections and a token bucket
+limiting new connections per second, so runs of domains on one shared
+hosting box do not turn into rate-limit failures.
+
+ConnectionGate is the thread version, AsyncConnectionGate the asyncio one;
+both share the bookkeeping in _GateState.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+
+GLOBAL_FULL = "global"
+HOST_FULL = "host"
+
+
+class AimdController:
+    def __init__(self, initial, min_limit, max_limit, increase=10, decrease_factor=0.5,
+                 window=200, error_threshold=0.15, adaptive=True):
+        self.limit = max(min_limit, min(initial, max_limit))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.window = window
+        self.error_threshold = error_threshold
+        self.adaptive = adaptive
+        self.outcomes = 0
+        self.congested = 0
+        self.increases = 0
+        self.decreases = 0
+
+    def record(self, congested):
+        if not self.adaptive:
+            return
+        self.outcomes += 1
+        if congested:
+            self.congested += 1
+        if self.outcomes < self.window:
+            return
+        if self.congested / self.outcomes > self.error_threshold:
+            self.limit = max(self.min_limit, int(self.limit * self.decrease_factor))
+            self.decreases += 1
+        else:
+            self.limit = min(self.max_limit, self.limit + self.increase)
+            self.increases += 1
+        self.outcomes = 0
+        self.congested = 0
+
+
+class _HostState:
+    __slots__ = ("in_flight", "tokens", "updated")
+
+    def __init__(self, burst, now):
+        self.in_flight = 0
+        self.tokens = float(burst)
+        self.updated = now
+
+
+class _GateState:
+    """Shared bookkeeping; callers serialise access (a lock or the event loop)."""
+
+    def __init__(self, controller, per_ip_max=8, per_ip_rate=20.0, per_ip_burst=20):
+        self.controller = controller
+        self.per_ip_max = per_ip_max
+        self.per_ip_rate = per_ip_rate
+        self.per_ip_burst = per_ip_burst
+        self.in_flight = 0
+        self.hosts = {}
+        self.releases = 0
+        self.politeness_waits = 0
+
+    @property
+    def limit(self):
+        return self.controller.limit
+
+    def try_acquire(self, ip, has_token=False):
+        """Take a slot for ip and return None, or say why not.
+
+        Returns GLOBAL_FULL, HOST_FULL (wait for a release) or the number of
+        seconds to sleep for ip's token bucket. In the last case the token is
+        already reserved (the bucket may go negative), so waiters queue up at
+        distinct times and retry with has_token=True.
+        """
+        if self.in_flight >= self.controller.limit:
+            return GLOBAL_FULL
+        now = time.monotonic()
+        host = self.hosts.get(ip)
+        if host is None:
+            host = self.hosts[ip] = _HostState(self.per_ip_burst, now)
+        else:
+            host.tokens = min(self.per_ip_burst, host.tokens + (now - host.updated) * self.per_ip_rate)
+            host.updated = now
+        if host.in_flight >= self.per_ip_max:
+            self.politeness_waits += 1
+            return HOST_FULL
+        if not has_token:
+            host.tokens -= 1
+            if host.tokens < 0:
+                self.politeness_waits += 1
+                return -host.tokens / self.per_ip_rate
+        host.in_flight += 1
+        self.in_flight += 1
+        return None
+
+    def release(self, ip, congested):
+        self.in_flight -= 1
+        host = self.hosts.get(ip)
+        if host is not None:
+            host.in_flight -= 1
+        self.controller.record(congested)
+        self.releases += 1
+        if self.releases % 10000 == 0:
+            self._forget_idle_hosts()
+
+    def _forget_idle_hosts(self):
+        # A host whose bucket has refilled completely carries no state worth keeping
+        refill_time = self.per_ip_burst / self.per_ip_rate
+        now = time.monotonic()
+        for ip in [ip for ip, h in self.hosts.items() if h.in_flight == 0 and h.tokens >= 0 and now - h.updated > refill_time]:
+            del self.hosts[ip]
+
+    def stats(self):
+        return {
+            "limit": self.controller.limit,
+            "in_flight": self.in_flight,
+            "increases": self.controller.increases,
+            "decreases": self.controller.decreases,
+            "politeness_waits": self.politeness_waits,
+            "tracked_ips": len(self.hosts),
+        }
+
+
+class ConnectionGate(_GateState):
+    """Blocking gate for the thread engine (few threads, so waking them all is cheap)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.condition = threading.Condition()
+
+    def acquire(self, ip):
+        has_token = False
+        with self.condition:
+            while True:
+                reason = self.try_acquire(ip, has_token)
+                if reason is None:
+                    return
+                if isinstance(reason, float):
+                    has_token = True
+                    # Sleep out the whole reservation even if a release wakes us early
+                    deadline = time.monotonic() + reason
+                    while (remaining := deadline - time.monotonic()) > 0:
+                        self.condition.wait(timeout=remaining)
+                else:
+                    self.condition.wait()
+
+    def release(self, ip, congested=False):
+        with self.condition:
+            super().release(ip, congested)
+            self.condition.notify_all()
+
+
+class AsyncConnectionGate(_GateState):
+    """Gate for the asyncio engine; all calls happen on the event loop thread.
+
+    Thousands of tasks may be waiting, so a release wakes one task waiting on
+    that IP and only as many global waiters as there are free slots.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.global_waiters = deque()
+        self.host_waiters = {}   # ip -> deque of futures
+
+    async def acquire(self, ip):
+        loop = asyncio.get_running_loop()
+        has_token = False
+        while True:
+            reason = self.try_acquire(ip, has_token)
+            if reason is None:
+                return
+            if reason != GLOBAL_FULL:
+                # This task cannot use a free global slot, so hand the wakeup on
+                self._wake(self.global_waiters)
+            if isinstance(reason, float):
+                has_token = True
+                await asyncio.sleep(reason)
+                continue
+            if reason == HOST_FULL:
+                waiters = self.host_waiters.setdefault(ip, deque())
+            else:
+                waiters = self.global_waiters
+            future = loop.create_future()
+            waiters.append(future)
+            try:
+                await future
+            finally:
+                if not future.done():
+                    future.cancel()
+
+    def release(self, ip, congested=False):
+        super().release(ip, congested)
+        host_waiters = self.host_waiters.get(ip)
+        if host_waiters is not None:
+            self._wake(host_waiters)
+            if not host_waiters:
+                del self.host_waiters[ip]
+        # After an additive increase more than one slot may be free
+        for _ in range(max(self.controller.limit - self.in_flight, 1)):
+            if not self._wake(self.global_waiters):
+                break
+
+    @staticmethod
+    def _wake(waiters):
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return True
+        return False
@@ -0,0 +1,318 @@
+"""Per-stage latency histograms, outcome counters and live crawl progress.
+
+Every stage of an attempt (dns, connect, handshake, parse, store) records its
+latency in a fixed-bucket histogram and its outcome ("ok" or an error class)
+in a counter, so a slow run shows whether it is waiting on DNS, the network,
+the certificate parser or MongoDB. Finished and skipped domains drive a
+rate over the last rate_window seconds and an ETA when the input size is
+known; gauges (domains in flight, open connections, queue depths) are
+callables read at snapshot time.
+
+MetricsServer serves the numbers over HTTP in the Prometheus text format
+(/metrics) and as JSON (/metrics.json); SnapshotWriter rewrites a JSON file
+every few seconds. Shard processes send state() to the parent, which merges
+them with absorb() so one endpoint covers the whole run.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STAGES = ("dns", "connect", "handshake", "parse", "store")
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram in milliseconds."""
+
+    def __init__(self, buckets_ms=DEFAULT_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        self.counts = [0] * (len(self.buckets_ms) + 1)   # last slot: above the largest bucket
+        self.count = 0
+        self.sum_ms = 0.0
+
+    def observe(self, ms):
+        for index, bound in enumerate(self.buckets_ms):
+            if ms <= bound:
+                break
+        else:
+            index = len(self.buckets_ms)
+        self.counts[index] += 1
+        self.count += 1
+        self.sum_ms += ms
+
+    def add(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other["counts"])]
+        self.count += other["count"]
+        self.sum_ms += other["sum_ms"]
+
+    def quantile(self, q):
+        """Estimate by linear interpolation inside the bucket that holds the q-th observation."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for index, n in enumerate(self.counts):
+            upper = self.buckets_ms[index] if index < len(self.buckets_ms) else self.buckets_ms[-1]
+            if n and seen + n >= rank:
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+            lower = upper
+        return lower
+
+    def state(self):
+        return {"counts": list(self.counts), "count": self.count, "sum_ms": self.sum_ms}
+
+
+class CrawlMetrics:
+    def __init__(self, buckets_ms=DEFAULT_BUCKETS_MS, rate_window=60):
+        self.buckets_ms = tuple(buckets_ms)
+        self.rate_window = rate_window
+        self.lock = threading.Lock()
+        self.histograms = {stage: Histogram(self.buckets_ms) for stage in STAGES}
+        self.outcomes = {}       # (stage, outcome) -> count
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.total = None        # input size, for the ETA
+        self.started = time.time()
+        self.recent = deque()    # [second, domains finished in it], newest last
+        self.gauges = {}         # name -> callable
+        self.sources = {}        # shard id -> its last state()
+
+    # ---------------- Recording ----------------
+
+    def observe(self, stage, ms, outcome="ok"):
+        with self.lock:
+            self.histograms[stage].observe(ms)
+            key = (stage, outcome or "other")
+            self.outcomes[key] = self.outcomes.get(key, 0) + 1
+
+    def finish(self, success):
+        second = int(time.monotonic())
+        with self.lock:
+            if success:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+            if self.recent and self.recent[-1][0] == second:
+                self.recent[-1][1] += 1
+            else:
+                self.recent.append([second, 1])
+            while self.recent and self.recent[0][0] <= second - self.rate_window:
+                self.recent.popleft()
+
+    def skip(self, count=1):
+        with self.lock:
+            self.skipped += count
+
+    def set_gauge(self, name, read):
+        """Register a callable returning the current value of a gauge."""
+        self.gauges[name] = read
+
+    def absorb(self, source, state):
+        """Keep the latest state() of a shard process; snapshots add it to this process's numbers."""
+        with self.lock:
+            self.sources[source] = state
+
+    # ---------------- Reading ----------------
+
+    def rate(self):
+        """Domains finished per second over the last rate_window seconds."""
+        now = time.monotonic()
+        with self.lock:
+            finished = sum(n for second, n in self.recent if second > now - self.rate_window)
+        window = min(self.rate_window, max(now - self._first_second(), 1.0))
+        return finished / window
+
+    def state(self):
+        """Stage numbers and gauges of this process, for a parent to absorb()."""
+        with self.lock:
+            return {
+                "histograms": {stage: h.state() for stage, h in self.histograms.items()},
+                "outcomes": [[stage, outcome, n] for (stage, outcome), n in self.outcomes.items()],
+                "skipped": self.skipped,
+                "gauges": self._read_gauges(),
+            }
+
+    def snapshot(self):
+        """Everything as one JSON-serialisable dict (shard states merged in)."""
+        histograms, outcomes, skipped, gauges = self._merged()
+        finished = self.succeeded + self.failed
+        rate = self.rate()
+        remaining = self.total - skipped - finished if self.total is not None else None
+        return {
+            "ts": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "elapsed_s": round(time.time() - self.started, 1),
+            "finished": finished,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "skipped": skipped,
+            "total": self.total,
+            "rate_per_s": round(rate, 2),
+            "eta_s": round(max(remaining, 0) / rate) if remaining is not None and rate > 0 else None,
+            "gauges": gauges,
+            "stages": {
+                stage: {
+                    "count": h.count,
+                    "avg_ms": round(h.sum_ms / h.count, 1) if h.count else None,
+                    "p50_ms": _round(h.quantile(0.50)),
+                    "p90_ms": _round(h.quantile(0.90)),
+                    "p99_ms": _round(h.quantile(0.99)),
+                    "outcomes": {outcome: n for (s, outcome), n in sorted(outcomes.items()) if s == stage},
+                }
+                for stage, h in histograms.items()
+            },
+        }
+
+    def prometheus_text(self):
+        """The metrics in the Prometheus text exposition format (latencies in seconds)."""
+        histograms, outcomes, skipped, gauges = self._merged()
+        snapshot_rate = self.rate()
+        lines = [
+            "# HELP crawler_stage_latency_seconds Latency of each attempt stage.",
+            "# TYPE crawler_stage_latency_seconds histogram",
+        ]
+        for stage, h in histograms.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets_ms, h.counts):
+                cumulative += n
+                lines.append(f'crawler_stage_latency_seconds_bucket{{stage="{stage}",le="{bound / 1000:g}"}} {cumulative}')
+            lines.append(f'crawler_stage_latency_seconds_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+            lines.append(f'crawler_stage_latency_seconds_sum{{stage="{stage}"}} {h.sum_ms / 1000:.6f}')
+            lines.append(f'crawler_stage_latency_seconds_count{{stage="{stage}"}} {h.count}')
+        lines += ["# HELP crawler_stage_outcomes_total Attempt stages by outcome (ok or error class).",
+                  "# TYPE crawler_stage_outcomes_total counter"]
+        for (stage, outcome), n in sorted(outcomes.items()):
+            lines.append(f'crawler_stage_outcomes_total{{stage="{stage}",outcome="{outcome}"}} {n}')
+        lines += ["# TYPE crawler_domains_finished_total counter",
+                  f'crawler_domains_finished_total{{result="success"}} {self.succeeded}',
+                  f'crawler_domains_finished_total{{result="failure"}} {self.failed}',
+                  "# TYPE crawler_domains_skipped_total counter",
+                  f"crawler_domains_skipped_total {skipped}",
+                  "# TYPE crawler_rate_domains_per_second gauge",
+                  f"crawler_rate_domains_per_second {snapshot_rate:.3f}"]
+        if self.total is not None:
+            lines += ["# TYPE crawler_input_domains gauge", f"crawler_input_domains {self.total}"]
+        for name, value in gauges.items():
+            lines += [f"# TYPE crawler_{name} gauge", f"crawler_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def progress_line(self):
+        snapshot = self.snapshot()
+        eta = snapshot["eta_s"]
+        in_flight = snapshot["gauges"].get("in_flight")
+        return (f"{snapshot['rate_per_s']:.1f} domains/s"
+                + (f", ETA {_format_duration(eta)}" if eta is not None else "")
+                + (f", {in_flight} in flight" if in_flight is not None else ""))
+
+    # ---------------- Internals ----------------
+
+    def _first_second(self):
+        with self.lock:
+            return self.recent[0][0] if self.recent else time.monotonic()
+
+    def _read_gauges(self):
+        values = {}
+        for name, read in list(self.gauges.items()):
+            try:
+                values[name] = read()
+            except Exception:
+                pass   # the object behind it is gone (engine finished)
+        return values
+
+    def _merged(self):
+        state = self.state()
+        with self.lock:
+            sources = list(self.sources.values())
+        histograms = {stage: Histogram(self.buckets_ms) for stage in STAGES}
+        outcomes = {}
+        skipped = 0
+        gauges = {}
+        for source in [state] + sources:
+            for stage, h in source["histograms"].items():
+                histograms[stage].add(h)
+            for stage, outcome, n in source["outcomes"]:
+                outcomes[(stage, outcome)] = outcomes.get((stage, outcome), 0) + n
+            skipped += source["skipped"]
+            for name, value in source["gauges"].items():
+                gauges[name] = gauges.get(name, 0) + value
+        return histograms, outcomes, skipped, gauges
+
+
+def _round(value):
+    return round(value, 1) if value is not None else None
+
+
+def _format_duration(seconds):
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}h{rest // 60:02d}m" if hours else f"{rest // 60}m{rest % 60:02d}s"
+
+
+class MetricsServer:
+    """HTTP endpoint: /metrics (Prometheus text) and /metrics.json, on a daemon thread."""
+
+    def __init__(self, metrics, host="127.0.0.1", port=9108):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    body, content_type = json.dumps(metrics.snapshot()).encode(), "application/json"
+                elif self.path.startswith("/metrics"):
+                    body, content_type = metrics.prometheus_text().encode(), "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True)
+        self.thread.start()
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class SnapshotWriter:
+    """Rewrite a JSON snapshot file every interval seconds (atomically) and once more on close()."""
+
+    def __init__(self, metrics, path, interval=10.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="metrics-snapshot", daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
+        self.write()
+
+    def write(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.metrics.snapshot(), f, indent=1)
+        os.replace(temp_path, self.path)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                pass
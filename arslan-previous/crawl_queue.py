@@ -0,0 +1,251 @@
+"""MongoDB-backed work queue that lets several crawler nodes share one run.
+
+A coordinator loads the input list into the crawl_queue collection once
+(one document per domain, _id = domain). Worker nodes claim pending domains
+with atomic find_one_and_update calls that set an owner and a lease expiry,
+renew their leases from a heartbeat thread while the domains are being
+crawled, and mark each one done or failed. A lease that is not renewed in
+time (the node crashed or lost its network) expires and the domain becomes
+claimable again; a domain that has been leased max_attempts times without
+finishing is given up as failed instead of being handed out forever.
+
+None of this has to block an event loop: iter_claims() claims the next
+batch on a background thread while the current one is crawled, and results
+can be completed in bulk (complete_many) or handed to a BulkWriter as
+complete_operation() updates.
+"""
+import queue
+import threading
+from datetime import datetime, timedelta, timezone
+
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+class CrawlQueue:
+    def __init__(self, collection, node_id, lease_seconds=300, max_attempts=5):
+        self.collection = collection
+        self.node_id = node_id
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.held = set()   # domains this node holds a lease on
+        self.lock = threading.Lock()
+        self.heartbeat_stop = threading.Event()
+        self.heartbeat_thread = None
+        self.heartbeat_errors = 0
+
+    def ensure_indexes(self):
+        self.collection.create_index([("status", ASCENDING), ("lease_expires", ASCENDING)])
+
+    # ---------------- Coordinator ----------------
+
+    def load(self, domains, batch_size=1000):
+        """Insert domains as pending; ones already queued are left untouched. Returns the number added."""
+        added = 0
+        batch = []
+        for domain in domains:
+            batch.append({"_id": domain, "status": PENDING, "attempts": 0, "queued_at": self._now()})
+            if len(batch) >= batch_size:
+                added += self._insert(batch)
+                batch = []
+        if batch:
+            added += self._insert(batch)
+        return added
+
+    def reclaim_expired(self):
+        """Return expired leases to pending and give up on domains out of attempts.
+
+        Claiming already takes expired leases, so this only makes the counts
+        accurate and retires domains that keep killing the nodes leasing them
+        (or that were put back pending after their last lease).
+        """
+        now = self._now()
+        expired = {"status": LEASED, "lease_expires": {"$lt": now}}
+        exhausted = self.collection.update_many(
+            {"$or": [expired, {"status": PENDING}], "attempts": {"$gte": self.max_attempts}},
+            {"$set": {"status": FAILED, "finished_at": now, "error": "lease expired too often"},
+             "$unset": {"owner": "", "lease_expires": ""}},
+        )
+        reclaimed = self.collection.update_many(
+            expired,
+            {"$set": {"status": PENDING}, "$unset": {"owner": "", "lease_expires": ""}},
+        )
+        return reclaimed.modified_count, exhausted.modified_count
+
+    def counts(self):
+        """Number of queue documents per status."""
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        for row in self.collection.aggregate([{"$group": {"_id": "$status", "n": {"$sum": 1}}}]):
+            counts[row["_id"]] = row["n"]
+        return counts
+
+    # ---------------- Worker ----------------
+
+    def claim(self, count):
+        """Lease up to count domains to this node and return them."""
+        claimed = []
+        for _ in range(count):
+            now = self._now()
+            doc = self.collection.find_one_and_update(
+                {"$or": [{"status": PENDING},
+                         {"status": LEASED, "lease_expires": {"$lt": now}}],
+                 "attempts": {"$lt": self.max_attempts}},
+                {"$set": {"status": LEASED, "owner": self.node_id,
+                          "lease_expires": now + timedelta(seconds=self.lease_seconds)},
+                 "$inc": {"attempts": 1}},
+                projection={"_id": 1},
+                return_document=ReturnDocument.AFTER,
+            )
+            if doc is None:
+                break
+            claimed.append(doc["_id"])
+        with self.lock:
+            self.held.update(claimed)
+        return claimed
+
+    def iter_claims(self, batch_size=100):
+        """Yield leased domains batch by batch until nothing is claimable.
+
+        The next batch is claimed on a background thread while the current
+        one is being consumed, so the consumer only waits when crawling
+        outpaces claiming. Close the generator to stop that thread.
+        """
+        batches = queue.Queue(maxsize=1)
+        stop = threading.Event()
+
+        def hand_over(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def claim_ahead():
+            try:
+                while True:
+                    batch = self.claim(batch_size)
+                    if not hand_over(batch) or not batch:
+                        return
+            except Exception as e:
+                hand_over(e)
+
+        thread = threading.Thread(target=claim_ahead, name="crawl-queue-claims", daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batches.get()
+                if isinstance(batch, Exception):
+                    raise batch
+                if not batch:
+                    return
+                yield from batch
+        finally:
+            stop.set()
+            thread.join()   # a claim in progress lands in held, so close() can hand it back
+
+    def complete(self, domain, success, error=None):
+        """Mark a leased domain done or failed and stop renewing its lease."""
+        self.collection.update_one(*self._completion(domain, success, error))
+
+    def complete_operation(self, domain, success, error=None):
+        """Like complete(), as an UpdateOne for a bulk write."""
+        return UpdateOne(*self._completion(domain, success, error))
+
+    def complete_many(self, domains):
+        """Mark several leased domains done in one update."""
+        self.collection.update_many(
+            {"_id": {"$in": list(domains)}, "owner": self.node_id},
+            {"$set": {"status": DONE, "finished_at": self._now()}, "$unset": {"lease_expires": ""}},
+        )
+        with self.lock:
+            self.held.difference_update(domains)
+
+    def requeue(self, domain):
+        """Put a domain back to pending, e.g. when its result could not be stored.
+
+        A domain that already used its last lease is given up as failed, since claim() would never take it again.
+        """
+        exhausted = self.collection.update_one(
+            {"_id": domain, "attempts": {"$gte": self.max_attempts}},
+            {"$set": {"status": FAILED, "finished_at": self._now(), "error": "result could not be stored"},
+             "$unset": {"owner": "", "lease_expires": ""}},
+        )
+        if not exhausted.matched_count:
+            self.collection.update_one(
+                {"_id": domain},
+                {"$set": {"status": PENDING}, "$unset": {"owner": "", "lease_expires": ""}},
+            )
+        with self.lock:
+            self.held.discard(domain)
+
+    def unfinished_elsewhere(self):
+        """Domains that other nodes still hold (or may drop back into the queue)."""
+        return self.collection.count_documents({"status": {"$in": [PENDING, LEASED]},
+                                                "owner": {"$ne": self.node_id}})
+
+    def start_heartbeat(self, interval):
+        """Renew this node's leases every interval seconds on a background thread."""
+        self.heartbeat_stop.clear()
+        self.heartbeat_thread = threading.Thread(
+            target=self._heartbeat, args=(interval,), name="crawl-queue-heartbeat", daemon=True
+        )
+        self.heartbeat_thread.start()
+
+    def close(self):
+        """Stop the heartbeat and hand back any leases still held (interrupted run)."""
+        self.heartbeat_stop.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+        with self.lock:
+            held = list(self.held)
+            self.held.clear()
+        if held:
+            self.collection.update_many(
+                {"_id": {"$in": held}, "owner": self.node_id, "status": LEASED},
+                {"$set": {"status": PENDING}, "$unset": {"owner": "", "lease_expires": ""},
+                 "$inc": {"attempts": -1}},
+            )
+
+    # ---------------- Internals ----------------
+
+    @staticmethod
+    def _now():
+        return datetime.now(timezone.utc)
+
+    def _completion(self, domain, success, error):
+        """(filter, update) finishing domain's lease; the heartbeat stops renewing it from here on."""
+        update = {"status": DONE if success else FAILED, "finished_at": self._now()}
+        if error:
+            update["error"] = error
+        with self.lock:
+            self.held.discard(domain)
+        return {"_id": domain, "owner": self.node_id}, {"$set": update, "$unset": {"lease_expires": ""}}
+
+    def _insert(self, batch):
+        try:
+            return len(self.collection.insert_many(batch, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+            return e.details.get("nInserted", 0)
+
+    def _heartbeat(self, interval):
+        while not self.heartbeat_stop.wait(interval):
+            with self.lock:
+                held = list(self.held)
+            if not held:
+                continue
+            try:
+                self.collection.update_many(
+                    {"_id": {"$in": held}, "owner": self.node_id, "status": LEASED},
+                    {"$set": {"lease_expires": self._now() + timedelta(seconds=self.lease_seconds)}},
+                )
+            except Exception:
+                self.heartbeat_errors += 1   # leases run out if this keeps failing; others reclaim them
@@ -0,0 +1,198 @@
+"""Aggregate crawl statistics kept up to date while the crawl runs.
+
+Reports on a crawl (issuer distribution, validity periods, key algorithms,
+failure classes) used to be aggregations over the whole certificates
+collection. Instead, CrawlStats counts them as results are recorded and
+hands out one $inc update per flush for a single crawl_stats document per
+run and dataset:
+
+    {"_id": "<run>/<dataset>", "run": ..., "dataset": ..., "started_at": ...,
+     "updated_at": ..., "finished": n, "succeeded": n, "failed": n,
+     "failures": {class: n}, "issuers": {org: n}, "key_algorithms": {"RSA-2048": n},
+     "validity_days": {"91-398": n}, "expires_in_days": {"8-30": n},
+     "tls_versions": {"TLSv1.3": n}}
+
+so a dashboard reads one small document however far the crawl has got.
+MongoDB field names cannot contain "." or start with "$"; such characters
+in counter keys are stored as their full-width forms and decoded on read.
+
+Run as a script to print the stored statistics:
+
+    python crawl_stats.py                      # latest run of every dataset
+    python crawl_stats.py --dataset pk_urls --all-runs --top 20
+    python crawl_stats.py --list
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import datetime, timezone
+
+COUNTERS = ("failures", "issuers", "key_algorithms", "validity_days", "expires_in_days", "tls_versions")
+# (upper bound in days, label); the last bucket is open-ended
+VALIDITY_BUCKETS = ((90, "0-90"), (398, "91-398"), (825, "399-825"), (None, "826+"))
+EXPIRY_BUCKETS = ((-1, "expired"), (7, "0-7"), (30, "8-30"), (90, "31-90"), (None, "91+"))
+
+_ESCAPES = {".": "．", "$": "＄"}
+
+
+def escape_key(key):
+    key = str(key).replace(".", _ESCAPES["."])
+    return _ESCAPES["$"] + key[1:] if key.startswith("$") else key
+
+
+def unescape_key(key):
+    return key.replace(_ESCAPES["."], ".").replace(_ESCAPES["$"], "$")
+
+
+def bucket(value, buckets):
+    for upper, label in buckets:
+        if upper is None or value <= upper:
+            return label
+
+
+def certificate_facts(summary, tls=None, now=None):
+    """The few fields of a certificate summary (cert_parser.summarize_certificate_der) the counters use."""
+    now = now or datetime.now(timezone.utc)
+    facts = {
+        "issuer": summary.get("issuer_o") or summary.get("issuer_cn") or "unknown",
+        "key": f"{summary.get('key_algorithm')}-{summary.get('key_bits')}",
+        "validity_days": summary.get("validity_days"),
+        "expires_in_days": (summary["not_after"] - now).days if summary.get("not_after") else None,
+    }
+    if tls and tls.get("version"):
+        facts["tls_version"] = tls["version"]
+    return facts
+
+
+class CrawlStats:
+    def __init__(self, run, dataset, flush_interval=5.0):
+        self.id = f"{run}/{dataset}"
+        self.run = run
+        self.dataset = dataset
+        self.flush_interval = flush_interval
+        self.started_at = datetime.now(timezone.utc)
+        self.lock = threading.Lock()
+        self.pending = {}        # dotted counter path -> increment
+        self.last_flush = time.monotonic()
+
+    def record(self, success, error_class=None, facts=None):
+        """Count one finished domain; facts from certificate_facts() for a stored certificate."""
+        with self.lock:
+            self._inc("finished")
+            self._inc("succeeded" if success else "failed")
+            if not success:
+                self._inc("failures." + escape_key(error_class or "other"))
+            if facts:
+                self._inc("issuers." + escape_key(facts["issuer"]))
+                self._inc("key_algorithms." + escape_key(facts["key"]))
+                if facts.get("validity_days") is not None:
+                    self._inc("validity_days." + bucket(facts["validity_days"], VALIDITY_BUCKETS))
+                if facts.get("expires_in_days") is not None:
+                    self._inc("expires_in_days." + bucket(facts["expires_in_days"], EXPIRY_BUCKETS))
+                if facts.get("tls_version"):
+                    self._inc("tls_versions." + escape_key(facts["tls_version"]))
+
+    def due(self):
+        return bool(self.pending) and time.monotonic() - self.last_flush >= self.flush_interval
+
+    def take_update(self):
+        """(filter, update) adding everything counted since the last call, or None if nothing was."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = time.monotonic()
+        if not pending:
+            return None
+        update = {
+            "$inc": pending,
+            "$set": {"updated_at": datetime.now(timezone.utc)},
+            "$setOnInsert": {"run": self.run, "dataset": self.dataset, "started_at": self.started_at},
+        }
+        return {"_id": self.id}, update
+
+    def _inc(self, path, n=1):
+        self.pending[path] = self.pending.get(path, 0) + n
+
+
+# ---------------- Reading ----------------
+
+def merge_documents(docs):
+    """Sum the counters of several crawl_stats documents (e.g. every run of a dataset)."""
+    merged = {"finished": 0, "succeeded": 0, "failed": 0, **{name: {} for name in COUNTERS}}
+    for doc in docs:
+        for name in ("finished", "succeeded", "failed"):
+            merged[name] += doc.get(name, 0)
+        for name in COUNTERS:
+            for key, n in (doc.get(name) or {}).items():
+                key = unescape_key(key)
+                merged[name][key] = merged[name].get(key, 0) + n
+    return merged
+
+
+def latest_runs(collection, dataset=None):
+    """The most recently updated crawl_stats document of each dataset."""
+    query = {"dataset": dataset} if dataset else {}
+    latest = {}
+    for doc in collection.find(query).sort("updated_at", -1):
+        latest.setdefault(doc.get("dataset"), doc)
+    return list(latest.values())
+
+
+def format_stats(title, stats, top=10):
+    lines = [title, f"  {stats['finished']} finished: {stats['succeeded']} succeeded, {stats['failed']} failed"]
+    for name in COUNTERS:
+        counts = stats[name]
+        if not counts:
+            continue
+        total = sum(counts.values())
+        lines.append(f"  {name}:")
+        for key, n in sorted(counts.items(), key=lambda item: -item[1])[:top]:
+            lines.append(f"    {key:<40} {n:>10}  {n / total:6.1%}")
+        if len(counts) > top:
+            lines.append(f"    ... {len(counts) - top} more")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the crawl_stats kept by the crawler.")
+    parser.add_argument("--url", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="Cloudflare_top-100")
+    parser.add_argument("--dataset", help="only this dataset")
+    parser.add_argument("--run", help="only this run id")
+    parser.add_argument("--all-runs", action="store_true", help="sum every run of each dataset instead of the latest")
+    parser.add_argument("--list", action="store_true", help="list the stored runs and exit")
+    parser.add_argument("--top", type=int, default=10, help="entries shown per counter")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    from pymongo import MongoClient
+    collection = MongoClient(args.url, serverSelectionTimeoutMS=5000)[args.db]["crawl_stats"]
+
+    if args.list:
+        query = {"dataset": args.dataset} if args.dataset else {}
+        for doc in collection.find(query, {"run": 1, "dataset": 1, "finished": 1, "updated_at": 1}).sort("updated_at", -1):
+            print(f"{doc.get('dataset')}  {doc.get('run')}  {doc.get('finished', 0)} finished, updated {doc.get('updated_at')}")
+        return
+
+    if args.run:
+        query = {"run": args.run, **({"dataset": args.dataset} if args.dataset else {})}
+        groups = {f"{doc['dataset']} (run {doc['run']})": [doc] for doc in collection.find(query)}
+    elif args.all_runs:
+        groups = {}
+        for doc in collection.find({"dataset": args.dataset} if args.dataset else {}):
+            groups.setdefault(f"{doc['dataset']} (all runs)", []).append(doc)
+    else:
+        groups = {f"{doc['dataset']} (run {doc['run']})": [doc] for doc in latest_runs(collection, args.dataset)}
+
+    if not groups:
+        print("No crawl_stats found")
+        return
+    results = {title: merge_documents(docs) for title, docs in groups.items()}
+    if args.json:
+        print(json.dumps(results, indent=1))
+    else:
+        print("\n\n".join(format_stats(title, stats, args.top) for title, stats in results.items()))
+
+
+if __name__ == "__main__":
+    main()
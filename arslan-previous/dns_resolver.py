@@ -0,0 +1,210 @@
+"""Caching DNS resolution stage that runs ahead of the TLS connect.
+
+Lookups run on their own thread pool (its size is the DNS concurrency limit),
+concurrent lookups of the same name share one query, and answers are cached:
+positive answers for their record TTL when dnspython is installed (otherwise
+for a fixed TTL, since getaddrinfo does not expose one), and NXDOMAIN-style
+answers for a negative TTL so dead names fail without touching the network.
+Transient failures (SERVFAIL, timeouts) are not cached. Note that dnspython
+queries the nameservers directly and does not read the hosts file. IP
+literals resolve to themselves without a query and are never cached.
+
+The cache is an LRU of at most max_entries names, and expired entries are
+swept every sweep_interval seconds, so a crawl over tens of millions of
+names (each looked up about once) keeps memory bounded.
+"""
+import asyncio
+import ipaddress
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import dns.exception
+    import dns.resolver
+except ImportError:  # dnspython is optional
+    dns = None
+
+
+def _literal(name):
+    """True if name is an IPv4 or IPv6 address rather than a DNS name."""
+    try:
+        ipaddress.ip_address(name)
+    except ValueError:
+        return False
+    return True
+
+
+class CachingResolver:
+    def __init__(self, concurrency=64, timeout=3, default_ttl=300, negative_ttl=3600,
+                 min_ttl=30, max_ttl=86400, use_dnspython=True, max_entries=100000, sweep_interval=60):
+        self.timeout = timeout
+        self.default_ttl = default_ttl
+        self.negative_ttl = negative_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self.next_sweep = time.monotonic() + sweep_interval
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="dns")
+        self.cache = OrderedDict()   # name -> (expires_at, addresses or None, error or None), least recent first
+        self.in_flight = {}  # name -> concurrent.futures.Future
+        self.lock = threading.Lock()
+        self.dns_resolver = None
+        if use_dnspython and dns is not None:
+            try:
+                self.dns_resolver = dns.resolver.Resolver()
+                self.dns_resolver.lifetime = timeout
+            except dns.exception.DNSException:
+                pass  # no usable resolver configuration: fall back to getaddrinfo
+
+        # counters
+        self.lookups = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.queries = 0
+        self.failures = 0
+        self.query_time = 0.0
+
+    # ---------------- Public API ----------------
+
+    def prefetch(self, name):
+        """Start resolving name in the background so the answer is cached by connect time."""
+        if _literal(name):
+            return
+        with self.lock:
+            entry = self.cache.get(name)
+            if entry is not None and entry[0] >= time.monotonic():
+                return
+        self._future(name)
+
+    def resolve(self, name):
+        """Return the list of addresses for name, raising socket.gaierror on failure."""
+        if _literal(name):
+            return [name]
+        cached = self._cached(name)
+        if cached is not None:
+            return self._unpack(cached)
+        return self._future(name).result()
+
+    async def resolve_async(self, name):
+        if _literal(name):
+            return [name]
+        cached = self._cached(name)
+        if cached is not None:
+            return self._unpack(cached)
+        return await asyncio.wrap_future(self._future(name))
+
+    def is_negative(self, name):
+        """True if name is currently in the negative cache (NXDOMAIN / no address)."""
+        with self.lock:
+            entry = self.cache.get(name)
+            return entry is not None and entry[2] is not None and entry[0] >= time.monotonic()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "lookups": self.lookups,
+                "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+                "negative_hits": self.negative_hits,
+                "queries": self.queries,
+                "failures": self.failures,
+                "avg_query_ms": 1000 * self.query_time / self.queries if self.queries else 0.0,
+                "cached_names": len(self.cache),
+            }
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    # ---------------- Internals ----------------
+
+    @staticmethod
+    def _unpack(entry):
+        _, addresses, error = entry
+        if error is not None:
+            raise socket.gaierror(*error)
+        return addresses
+
+    def _cached(self, name):
+        with self.lock:
+            self.lookups += 1
+            entry = self.cache.get(name)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.cache[name]
+                return None
+            self.cache.move_to_end(name)
+            self.hits += 1
+            if entry[2] is not None:
+                self.negative_hits += 1
+            return entry
+
+    def _future(self, name):
+        with self.lock:
+            future = self.in_flight.get(name)
+            if future is None:
+                future = self.executor.submit(self._query, name)
+                self.in_flight[name] = future
+        return future
+
+    def _query(self, name):
+        start = time.monotonic()
+        try:
+            addresses, ttl = self._lookup(name)
+        except socket.gaierror as e:
+            with self.lock:
+                self.failures += 1
+                if e.errno in (socket.EAI_NONAME, getattr(socket, "EAI_NODATA", socket.EAI_NONAME)):
+                    self._store(name, (time.monotonic() + self.negative_ttl, None, e.args))
+            raise
+        else:
+            ttl = min(max(ttl, self.min_ttl), self.max_ttl)
+            with self.lock:
+                self._store(name, (time.monotonic() + ttl, addresses, None))
+            return addresses
+        finally:
+            with self.lock:
+                self.queries += 1
+                self.query_time += time.monotonic() - start
+                self.in_flight.pop(name, None)
+
+    def _store(self, name, entry):
+        """Cache entry for name, evicting expired and then least recently used names (caller holds self.lock)."""
+        self.cache[name] = entry
+        self.cache.move_to_end(name)
+        now = time.monotonic()
+        if now >= self.next_sweep:
+            self.next_sweep = now + self.sweep_interval
+            for expired in [key for key, (expires_at, _, _) in self.cache.items() if expires_at < now]:
+                del self.cache[expired]
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+
+    def _lookup(self, name):
+        """Resolve name to (addresses, ttl)."""
+        if _literal(name):
+            return [name], 0
+        if self.dns_resolver is None:
+            infos = socket.getaddrinfo(name, 443, type=socket.SOCK_STREAM)
+            addresses = []
+            for *_, sockaddr in infos:
+                if sockaddr[0] not in addresses:
+                    addresses.append(sockaddr[0])
+            return addresses, self.default_ttl
+
+        for record_type in ("A", "AAAA"):
+            try:
+                answer = self.dns_resolver.resolve(name, record_type)
+            except dns.resolver.NXDOMAIN:
+                raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+            except dns.resolver.NoAnswer:
+                continue
+            except (dns.resolver.NoNameservers, dns.exception.Timeout) as e:
+                raise socket.gaierror(socket.EAI_AGAIN, f"Temporary failure in name resolution: {e}")
+            except dns.exception.DNSException as e:
+                raise socket.gaierror(socket.EAI_FAIL, f"Non-recoverable failure in name resolution: {e}")
+            return [record.to_text() for record in answer], answer.rrset.ttl
+        raise socket.gaierror(getattr(socket, "EAI_NODATA", socket.EAI_NONAME), "No address associated with hostname")
@@ -0,0 +1,122 @@
+"""Compact membership index of domain names: sorted 64-bit hashes.
+
+Each domain is reduced to the first 8 bytes of its BLAKE2b digest and kept
+in a sorted array, so membership is one hash and a binary search (bisect)
+and each domain costs 8 bytes instead of a Python str in a set (60-100
+bytes plus the set slot). Two different domains share a hash with
+probability about n / 2^64, so a hit is "probably present" and callers that
+need certainty verify it; a miss is certain.
+
+save() writes the array to a file (a HEADER_SIZE-byte header, then the
+hashes in native byte order) by writing a temporary file and renaming it
+over the old one; load() maps that file with mmap, so opening an index of
+tens of millions of domains takes no time and memory is paged in on demand.
+Domains added after loading go to a small set that is merged into the
+sorted array once it holds merge_threshold hashes, and on save().
+
+The header carries a generation number chosen by the caller, which
+ResumeStore uses to tell whether the file still matches its table.
+"""
+import bisect
+import hashlib
+import heapq
+import mmap
+import os
+import struct
+from array import array
+
+MAGIC = b"DHX1"
+HEADER = struct.Struct("<4s4xQQ")   # magic, generation, count
+HEADER_SIZE = HEADER.size           # 24: keeps the hashes 8-byte aligned
+
+
+def domain_hash(domain):
+    return int.from_bytes(hashlib.blake2b(domain.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class DomainIndex:
+    def __init__(self, hashes=None, generation=0, merge_threshold=1_000_000):
+        self.base = hashes if hashes is not None else array("Q")   # sorted; an array or a view of a mapped file
+        self.added = set()
+        self.generation = generation
+        self.merge_threshold = merge_threshold
+        self._map = None
+
+    @classmethod
+    def build(cls, domains, generation=0, merge_threshold=1_000_000):
+        """Index every domain of an iterable (e.g. a table scan)."""
+        return cls(array("Q", sorted({domain_hash(domain) for domain in domains})), generation, merge_threshold)
+
+    @classmethod
+    def load(cls, path, merge_threshold=1_000_000):
+        """Map an index file written by save(); None if it is missing or damaged."""
+        try:
+            with open(path, "rb") as f:
+                magic, generation, count = HEADER.unpack(f.read(HEADER_SIZE))
+                if magic != MAGIC or os.path.getsize(path) != HEADER_SIZE + 8 * count:
+                    return None
+                if count == 0:
+                    return cls(generation=generation, merge_threshold=merge_threshold)
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, struct.error):
+            return None
+        index = cls(memoryview(mapped)[HEADER_SIZE:].cast("Q"), generation, merge_threshold)
+        index._map = mapped
+        return index
+
+    def add(self, domain):
+        key = domain_hash(domain)
+        if key in self.added or self._in_base(key):
+            return
+        self.added.add(key)
+        if len(self.added) >= self.merge_threshold:
+            self._merge()
+
+    def __contains__(self, domain):
+        key = domain_hash(domain)
+        return key in self.added or self._in_base(key)
+
+    def __len__(self):
+        return len(self.base) + len(self.added)
+
+    def save(self, path, generation):
+        """Write every hash to path (atomically) under generation."""
+        self._merge()
+        if self._map is not None:
+            # Nothing was merged, so base is still a view of the mapped file, which may be the file
+            # being replaced; Windows refuses to replace a file that is mapped
+            hashes = array("Q")
+            with self.base.cast("B") as raw:
+                hashes.frombytes(raw)
+            self._unmap()
+            self.base = hashes
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, generation, len(self.base)))
+            f.write(self.base)
+        os.replace(temp_path, path)
+        self.generation = generation
+
+    def close(self):
+        self._unmap()
+
+    def _in_base(self, key):
+        base = self.base
+        i = bisect.bisect_left(base, key)
+        return i < len(base) and base[i] == key
+
+    def _merge(self):
+        """Fold the added hashes into a new in-memory sorted array (and let go of the mapped file)."""
+        if not self.added:
+            return
+        merged = array("Q", heapq.merge(self.base, sorted(self.added)))
+        self._unmap()
+        self.base = merged
+        self.added = set()
+
+    def _unmap(self):
+        if self._map is not None:
+            self.base.release()
+            self._map.close()
+            self._map = None
+            self.base = array("Q")
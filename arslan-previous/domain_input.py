@@ -0,0 +1,220 @@
+"""Domain list ingestion: compressed inputs, list formats, normalisation and dedup.
+
+read_domains() streams hostnames out of one or more input files:
+
+* Compression is recognised from the file's magic bytes: gzip, zstd
+  (needs the optional zstandard package) and zip (the first .csv/.txt member,
+  as in Tranco's top-1m.csv.zip). Anything else is read as text.
+* Format: a CSV with a header uses the domain column named in column, or the
+  first header in DOMAIN_COLUMNS ("Websites URL", "domain", ...); with no
+  recognised header the column whose sample values are mostly hostnames
+  wins. Headerless "rank,domain" rows (Tranco, Radar ranking dumps) and
+  plain one-domain-per-line lists are detected from the first row.
+* Each value goes through normalize_domain(): scheme, path, port, user info
+  and trailing dot are cut, case is folded, internationalised names become
+  their IDNA (punycode) form, "www." is optionally dropped, and anything that
+  is not a valid hostname or IP literal is rejected.
+* Dedup across all files: exact on 64-bit hashes up to exact_limit distinct
+  hosts, then a Bloom filter sized for capacity hosts (bloom_filter.py), so
+  memory stays bounded for 10M+ row inputs. A Bloom false positive drops a
+  host that was not a duplicate with probability error_rate.
+
+The counts land in an InputStats passed in by the caller.
+"""
+import csv
+import gzip
+import hashlib
+import io
+import ipaddress
+import os
+import re
+import zipfile
+from itertools import chain, islice
+
+from bloom_filter import BloomFilter
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional; only .zst inputs need it
+    zstandard = None
+
+try:
+    import idna
+except ImportError:  # fall back to the stdlib IDNA 2003 codec
+    idna = None
+
+# Header names recognised as the domain column, most specific first (compared case-insensitively)
+DOMAIN_COLUMNS = ("websites url", "domain", "domains", "hostname", "host", "website", "url", "site", "origin")
+SNIFF_ROWS = 20           # rows sampled to detect the delimiter, header and domain column
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+ZIP_MAGIC = b"PK\x03\x04"
+
+# Two or more LDH labels (underscores tolerated), the last one not all digits
+_HOST = re.compile(r"(?:(?!-)[a-z0-9_-]{1,63}(?<!-)\.)+(?![0-9]+\Z)(?!-)[a-z0-9_-]{1,63}(?<!-)\Z")
+_SCHEME = re.compile(r"^[a-z][a-z0-9+.-]*://", re.IGNORECASE)
+
+
+class InputStats:
+    def __init__(self):
+        self.rows = 0
+        self.invalid = 0
+        self.duplicates = 0
+        self.domains = 0
+
+    def __str__(self):
+        return (f"{self.rows} rows: {self.domains} unique hosts, "
+                f"{self.duplicates} duplicates, {self.invalid} invalid")
+
+
+def normalize_domain(value, strip_www=True):
+    """Canonical hostname for value (an URL, host or host:port), or None if it is not a valid host."""
+    host = value.strip().lstrip("\ufeff")
+    if _HOST.match(host) and len(host) <= 253 and not (strip_www and host.startswith("www.")):
+        return host   # already canonical: the common case for ranked lists
+    host = _SCHEME.sub("", host)
+    for separator in "/?#":
+        host = host.split(separator, 1)[0]
+    host = host.rsplit("@", 1)[-1]
+    if host.startswith("["):   # [IPv6] or [IPv6]:port
+        host = host[1:].split("]", 1)[0]
+        try:
+            return str(ipaddress.IPv6Address(host))
+        except ValueError:
+            return None
+    if host.count(":") == 1:
+        host, port = host.split(":")
+        if not port.isdigit():
+            return None
+    host = host.rstrip(".").lower()
+    if host.startswith("*."):
+        host = host[2:]
+    if not host:
+        return None
+    if host[-1].isdigit():   # an IP literal; no TLD is numeric
+        try:
+            return str(ipaddress.ip_address(host))
+        except ValueError:
+            return None
+    if not host.isascii():
+        try:
+            host = idna.encode(host, uts46=True).decode("ascii") if idna else host.encode("idna").decode("ascii")
+        except (UnicodeError, ValueError):   # idna.IDNAError is a UnicodeError
+            return None
+    if strip_www and host.startswith("www.") and host.count(".") >= 2:
+        host = host[4:]
+    if len(host) > 253 or not _HOST.match(host):
+        return None
+    return host
+
+
+def open_text(path):
+    """Open path for reading as text, decompressing gzip/zstd/zip by their magic bytes."""
+    with open(path, "rb") as f:
+        magic = f.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace", newline="")
+    if magic.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError(f"{path} is zstd-compressed but zstandard is not installed (pip install zstandard)")
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8", errors="replace", newline="")
+    if magic.startswith(ZIP_MAGIC):
+        archive = zipfile.ZipFile(path)
+        names = [name for name in archive.namelist() if not name.endswith("/")]
+        member = next((name for name in names if name.lower().endswith((".csv", ".txt"))), names[0] if names else None)
+        if member is None:
+            raise RuntimeError(f"{path} is an empty zip archive")
+        return io.TextIOWrapper(archive.open(member), encoding="utf-8", errors="replace", newline="")
+    return open(path, encoding="utf-8", errors="replace", newline="")
+
+
+def _looks_like_host(value):
+    return normalize_domain(value, strip_www=False) is not None
+
+
+def _domain_column(rows, column=None):
+    """(index of the domain column, whether rows[0] is a header) for the sampled rows."""
+    first = rows[0]
+    names = [cell.strip().lstrip("\ufeff").lower() for cell in first]
+    wanted = (column.lower(),) if column else DOMAIN_COLUMNS
+    for name in wanted:
+        if name in names:
+            return names.index(name), True
+    if column:
+        raise ValueError(f"no column {column!r} in header {first}")
+    # No known header: if the first row already holds a host it is data (Tranco "1,google.com" or a plain list)
+    has_header = not any(_looks_like_host(cell) for cell in first if not cell.strip().isdigit())
+    sample = rows[1:] if has_header else rows
+    width = max(len(row) for row in rows)
+    scores = [sum(1 for row in sample if index < len(row) and _looks_like_host(row[index])) for index in range(width)]
+    return max(range(width), key=lambda index: scores[index]), has_header
+
+
+def iter_file_values(path, column=None):
+    """Yield the raw domain-column value of every data row in one file."""
+    with open_text(path) as f:
+        head = list(islice(f, SNIFF_ROWS))
+        try:
+            dialect = csv.Sniffer().sniff("".join(head), delimiters=",;\t")
+        except csv.Error:   # a single column has no delimiter to find
+            dialect = csv.excel
+        sample = [row for row in csv.reader(head, dialect) if row]
+        if not sample:
+            return
+        index, has_header = _domain_column(sample, column)
+        for row in chain(sample[1:] if has_header else sample, csv.reader(f, dialect)):
+            if row:
+                yield row[index] if index < len(row) else ""
+
+
+class Deduper:
+    """Streaming membership: exact 64-bit hashes up to exact_limit hosts, then a Bloom filter."""
+
+    def __init__(self, exact_limit=2_000_000, capacity=50_000_000, error_rate=1e-6):
+        self.exact_limit = exact_limit
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.exact = set()
+        self.bloom = None
+
+    def add(self, host):
+        """Record host; returns False if it was (probably, once on the Bloom filter) seen before."""
+        key = int.from_bytes(hashlib.blake2b(host.encode("utf-8"), digest_size=8).digest(), "little")
+        if self.bloom is not None:
+            return self.bloom.add(format(key, "016x"))
+        if key in self.exact:
+            return False
+        self.exact.add(key)
+        if len(self.exact) > self.exact_limit:
+            # Too many hosts for the exact set: move the hashes to a Bloom filter and keep only that
+            self.bloom = BloomFilter(self.capacity, self.error_rate)
+            for seen in self.exact:
+                self.bloom.add(format(seen, "016x"))
+            self.exact = None
+        return True
+
+
+def read_domains(paths, column=None, strip_www=True, dedup=None, stats=None):
+    """Yield every unique, valid host of paths (one path or a list) in input order.
+
+    dedup is a Deduper shared across the files (None: a default one; False: no
+    dedup); stats, if given, is an InputStats updated as rows are read.
+    """
+    if isinstance(paths, (str, bytes, os.PathLike)):
+        paths = [paths]
+    if dedup is None:
+        dedup = Deduper()
+    stats = stats if stats is not None else InputStats()
+    for path in paths:
+        for value in iter_file_values(path, column):
+            stats.rows += 1
+            host = normalize_domain(value, strip_www)
+            if host is None:
+                stats.invalid += 1
+            elif dedup and not dedup.add(host):
+                stats.duplicates += 1
+            else:
+                stats.domains += 1
+                yield host
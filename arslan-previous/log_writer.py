@@ -0,0 +1,96 @@
+"""Background writer for the crawl log and failure list.
+
+Workers used to take a lock, open the file, write and flush once per domain,
+which serialised every worker on the log at high concurrency. Here callers
+only put a record on a bounded queue; one thread writes the records out in
+batches (one write call per batch_size records or flush_interval seconds),
+fsyncs every fsync_interval seconds, and drains the queue on close().
+
+log() takes a dict and writes it as one JSON line (JSONL: grep for a domain
+or load the file with pandas.read_json(path, lines=True)); write_line()
+writes a plain text line.
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+_STOP = object()
+
+
+class LogWriter:
+    def __init__(self, path, batch_size=1000, flush_interval=0.5, fsync_interval=5.0, queue_size=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.file = open(path, "a", encoding="utf-8")
+        self.records = 0
+        self.batches = 0
+        self.fsyncs = 0
+        self.thread = threading.Thread(target=self._run, name=f"log-writer-{os.path.basename(path)}", daemon=True)
+        self.thread.start()
+
+    def log(self, record):
+        """Queue a dict to be written as one JSON line."""
+        self.queue.put(record)
+
+    def write_line(self, line):
+        self.queue.put(str(line))
+
+    def close(self):
+        """Write everything still queued, fsync and close the file."""
+        self.queue.put(_STOP)
+        self.thread.join()
+
+    # ---------------- Writer thread ----------------
+
+    def _run(self):
+        lines = []
+        deadline = time.monotonic() + self.flush_interval
+        last_fsync = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._write(lines)
+                self._fsync()
+                self.file.close()
+                return
+
+            if item is not None:
+                lines.append(self._format(item))
+
+            if len(lines) >= self.batch_size or time.monotonic() >= deadline:
+                self._write(lines)
+                lines = []
+                deadline = time.monotonic() + self.flush_interval
+                if time.monotonic() - last_fsync >= self.fsync_interval:
+                    self._fsync()
+                    last_fsync = time.monotonic()
+
+    @staticmethod
+    def _format(item):
+        if isinstance(item, str):
+            return item + "\n"
+        return json.dumps(item, ensure_ascii=False, default=str) + "\n"
+
+    def _write(self, lines):
+        if not lines:
+            return
+        self.file.write("".join(lines))
+        self.file.flush()
+        self.records += len(lines)
+        self.batches += 1
+
+    def _fsync(self):
+        try:
+            os.fsync(self.file.fileno())
+            self.fsyncs += 1
+        except OSError:
+            pass
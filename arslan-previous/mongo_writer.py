@@ -0,0 +1,165 @@
+"""Background MongoDB writer that batches upserts into unordered bulk_write calls.
+
+Crawl workers hand over (collection, operation, domain) and return
+immediately; a single thread groups the operations per collection and flushes
+when a batch reaches max_docs, max_bytes or max_interval seconds. The
+submission queue is bounded, so a database that falls behind slows producers
+down instead of growing memory without limit. Per-document failures are
+reported through on_error(domain, message, code), and every bulk_write call
+through on_flush(operations, seconds, errors) for latency metrics.
+
+A write is only durable once its batch is acknowledged, so callers that need
+to know (the resume store, the certificate caches) get told afterwards: an
+operation's on_stored() runs once the batch holding it is acknowledged, and
+confirm(domain), queued after a domain's last write, leads to
+on_confirmed([domains]) once every write queued before it is stored, unless
+one of that domain's writes failed. A duplicate-key error (11000) counts as
+stored: another upsert got the document in first.
+"""
+import queue
+import threading
+import time
+
+import bson
+from pymongo.errors import BulkWriteError
+
+_STOP = object()
+_CONFIRM = object()
+DUPLICATE_KEY = 11000
+
+
+class BulkWriter:
+    def __init__(self, max_docs=500, max_bytes=8 * 1024 * 1024, max_interval=1.0,
+                 queue_size=10000, on_error=None, on_flush=None, on_confirmed=None):
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_interval = max_interval
+        self.on_error = on_error
+        self.on_flush = on_flush
+        self.on_confirmed = on_confirmed
+        self.failed = set()   # domains with a failed write that were not confirmed yet (writer thread only)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.written = 0
+        self.errors = 0
+        self.flushes = 0
+        self.thread = threading.Thread(target=self._run, name="mongo-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, collection, operation, domain, on_stored=None):
+        """Queue one write; blocks only when queue_size writes are already pending.
+
+        on_stored() is called from the writer thread once MongoDB acknowledged the write.
+        """
+        self.queue.put((collection, operation, domain, on_stored))
+
+    def confirm(self, domain):
+        """Report domain through on_confirmed once all its writes queued so far are stored."""
+        self.queue.put((_CONFIRM, domain))
+
+    def close(self):
+        """Flush everything still queued and stop the writer thread."""
+        self.queue.put(_STOP)
+        self.thread.join()
+
+    # ---------------- Writer thread ----------------
+
+    def _run(self):
+        batches = {}   # collection full_name -> (collection, [operations], [domains], [on_stored])
+        confirmations = []
+        pending_docs = 0
+        pending_bytes = 0
+        deadline = time.monotonic() + self.max_interval
+        while True:
+            try:
+                item = self.queue.get(timeout=max(deadline - time.monotonic(), 0.001))
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._flush(batches, confirmations)
+                return
+
+            if item is not None and item[0] is _CONFIRM:
+                confirmations.append(item[1])
+            elif item is not None:
+                collection, operation, domain, on_stored = item
+                entry = batches.setdefault(collection.full_name, (collection, [], [], []))
+                entry[1].append(operation)
+                entry[2].append(domain)
+                entry[3].append(on_stored)
+                pending_docs += 1
+                pending_bytes += self._operation_size(operation)
+
+            if (pending_docs >= self.max_docs or pending_bytes >= self.max_bytes
+                    or time.monotonic() >= deadline):
+                self._flush(batches, confirmations)
+                batches = {}
+                confirmations = []
+                pending_docs = 0
+                pending_bytes = 0
+                deadline = time.monotonic() + self.max_interval
+
+    @staticmethod
+    def _operation_size(operation):
+        # UpdateOne keeps its filter and update document in private slots
+        try:
+            return len(bson.encode(operation._doc)) + len(bson.encode(operation._filter))
+        except Exception:
+            return 0
+
+    def _flush(self, batches, confirmations=()):
+        for collection, operations, domains, callbacks in batches.values():
+            if not operations:
+                continue
+            self.flushes += 1
+            errors_before = self.errors
+            failed = set()   # indexes of the operations that were not stored
+            started = time.monotonic()
+            try:
+                result = collection.bulk_write(operations, ordered=False)
+                self.written += result.upserted_count + result.matched_count
+            except BulkWriteError as e:
+                details = e.details
+                self.written += details.get("nUpserted", 0) + details.get("nMatched", 0)
+                for error in details.get("writeErrors", []):
+                    self.errors += 1
+                    index = error.get("index", -1)
+                    domain = domains[index] if 0 <= index < len(domains) else None
+                    if error.get("code") != DUPLICATE_KEY:
+                        failed.add(index)
+                        self.failed.add(domain)
+                    self._report(domain, error.get("errmsg", "write error"), error.get("code"))
+            except Exception as e:
+                failed = set(range(len(operations)))
+                for domain in domains:
+                    self.errors += 1
+                    self.failed.add(domain)
+                    self._report(domain, f"Bulk write failed: {e}", None)
+            if self.on_flush is not None:
+                try:
+                    self.on_flush(len(operations), time.monotonic() - started, self.errors - errors_before)
+                except Exception:
+                    pass
+            for index, on_stored in enumerate(callbacks):
+                if on_stored is not None and index not in failed:
+                    try:
+                        on_stored()
+                    except Exception:
+                        pass
+
+        if confirmations:
+            stored = [domain for domain in confirmations if domain not in self.failed]
+            self.failed.difference_update(confirmations)
+            if stored and self.on_confirmed is not None:
+                try:
+                    self.on_confirmed(stored)
+                except Exception:
+                    pass
+
+    def _report(self, domain, message, code):
+        if self.on_error is None:
+            return
+        try:
+            self.on_error(domain, message, code)
+        except Exception:
+            pass
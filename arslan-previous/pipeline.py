@@ -0,0 +1,102 @@
+"""Thread stages joined by bounded queues.
+
+A Stage runs `workers` threads that take items from its bounded input queue,
+call handler(item) and put whatever the handler returns on the next stage's
+queue; a handler returns None once it is done with an item (it reports the
+outcome itself). Each stage is sized on its own, so slow certificate parsing
+no longer holds a network slot and stalled handshakes do not idle the parser.
+
+Every queue is bounded: when a stage falls behind its input queue fills, the
+stage before it blocks on put, and so on up to whoever feeds the first stage.
+That is the only backpressure mechanism. depths() and busy() show where work
+is piling up.
+"""
+import queue
+import threading
+
+_STOP = object()
+
+
+class Stage:
+    def __init__(self, name, handler, workers, queue_size=1000, on_error=None):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.on_error = on_error      # on_error(item, exception) when the handler raises
+        self.next_stage = None
+        self.threads = []
+        self.lock = threading.Lock()
+        self.active = 0
+        self.processed = 0
+
+    def put(self, item, timeout=None):
+        """Queue an item; blocks while the queue is full (raises queue.Full after timeout)."""
+        self.queue.put(item, timeout=timeout)
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def busy(self):
+        return self.active
+
+    def start(self, next_stage=None):
+        self.next_stage = next_stage
+        self.threads = [
+            threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def close(self):
+        """Let the workers finish everything queued, then stop them."""
+        for _ in self.threads:
+            self.queue.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            with self.lock:
+                self.active += 1
+            try:
+                result = self.handler(item)
+            except Exception as e:
+                result = None
+                if self.on_error is not None:
+                    self.on_error(item, e)
+            finally:
+                with self.lock:
+                    self.active -= 1
+                    self.processed += 1
+            if result is not None and self.next_stage is not None:
+                self.next_stage.put(result)
+
+
+class Pipeline:
+    def __init__(self, stages):
+        self.stages = list(stages)
+
+    def start(self):
+        for stage, next_stage in zip(self.stages, self.stages[1:] + [None]):
+            stage.start(next_stage)
+
+    def put(self, item, timeout=None):
+        """Feed the first stage; blocks while it is full, which is how backpressure reaches the caller."""
+        self.stages[0].put(item, timeout=timeout)
+
+    def close(self):
+        """Drain and stop the stages front to back."""
+        for stage in self.stages:
+            stage.close()
+
+    def depths(self):
+        return {stage.name: stage.depth() for stage in self.stages}
+
+    def busy(self):
+        return {stage.name: stage.busy() for stage in self.stages}
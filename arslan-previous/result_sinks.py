@@ -0,0 +1,238 @@
+"""File result sinks: columnar Parquet/Arrow and zstd-compressed JSONL.
+
+For research crawls that only need files to analyse, results can go to disk
+instead of (or as well as) MongoDB. The crawler builds one record per domain:
+the flat certificate summary from cert_parser.summarize_certificate_der plus
+domain, crawled_at, fingerprint_sha256, the handshake facts under "tls", the
+chain fingerprints and the raw DER.
+
+ColumnarSink keeps rows in column lists and writes row_group_size rows at a
+time, as one Parquet row group (zstd column compression) or one Arrow IPC
+record batch. Its schema is flat (COLUMNS), so issuer share, key sizes or the
+expiry distribution are a column scan in pyarrow/pandas/DuckDB. The raw DER
+is left out of the columnar files. JsonlZstdSink writes every record in full
+as a JSON line, buffering chunk_bytes of them before each write into a zstd
+stream.
+
+SinkWriter feeds the sinks from one background thread through a bounded
+queue, like the bulk and log writers, so workers never wait on compression
+or disk. pyarrow and zstandard are optional; new_sink raises SinkUnavailable
+for a sink whose library is missing.
+"""
+import base64
+import json
+import os
+import queue
+import threading
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional
+    pa = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional
+    zstandard = None
+
+_STOP = object()
+
+# Columnar schema: (column, type), with tls_* taken from record["tls"]
+COLUMNS = (
+    ("domain", "string"),
+    ("crawled_at", "timestamp"),
+    ("fingerprint_sha256", "string"),
+    ("subject_cn", "string"),
+    ("subject_o", "string"),
+    ("issuer_cn", "string"),
+    ("issuer_o", "string"),
+    ("issuer_dn", "string"),
+    ("serial_number", "string"),
+    ("not_before", "timestamp"),
+    ("not_after", "timestamp"),
+    ("validity_days", "int32"),
+    ("key_algorithm", "string"),
+    ("key_bits", "int32"),
+    ("curve", "string"),
+    ("signature_algorithm", "string"),
+    ("san_dns", "list<string>"),
+    ("san_count", "int32"),
+    ("self_issued", "bool"),
+    ("is_ca", "bool"),
+    ("validation_level", "string"),
+    ("tls_version", "string"),
+    ("tls_cipher", "string"),
+    ("tls_alpn", "string"),
+    ("tls_profile", "string"),
+    ("tls_verified", "bool"),
+    ("tls_verify_error", "string"),
+    ("chain", "list<string>"),
+    ("chain_length", "int32"),
+)
+
+EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow", "jsonl_zst": ".jsonl.zst"}
+
+
+class SinkUnavailable(Exception):
+    pass
+
+
+class SinkError(Exception):
+    """A buffered batch could not be written; its records are dropped."""
+
+
+def _arrow_type(name):
+    if name == "timestamp":
+        return pa.timestamp("ms", tz="UTC")
+    if name == "list<string>":
+        return pa.list_(pa.string())
+    return {"string": pa.string(), "int32": pa.int32(), "bool": pa.bool_()}[name]
+
+
+def _column_value(record, column):
+    if column.startswith("tls_"):
+        return (record.get("tls") or {}).get(column[4:])
+    if column == "chain_length":
+        return len(record["chain"]) if record.get("chain") else None
+    return record.get(column)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    return str(value)
+
+
+class ColumnarSink:
+    def __init__(self, path, format="parquet", row_group_size=50000, compression="zstd"):
+        if pa is None:
+            raise SinkUnavailable("pyarrow is not installed (pip install pyarrow)")
+        self.path = path
+        self.format = format
+        self.row_group_size = row_group_size
+        self.schema = pa.schema([(name, _arrow_type(kind)) for name, kind in COLUMNS])
+        self.columns = {name: [] for name, _ in COLUMNS}
+        self.rows = 0
+        self.file = None
+        if format == "parquet":
+            self.writer = pq.ParquetWriter(path, self.schema, compression=compression)
+        else:
+            self.file = pa.OSFile(path, "wb")
+            self.writer = pa.ipc.new_file(self.file, self.schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+
+    def write(self, record):
+        for name, values in self.columns.items():
+            values.append(_column_value(record, name))
+        self.rows += 1
+        if self.rows >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        # Take the buffered rows first: a batch that cannot be written is dropped (and reported once)
+        # rather than retried, ever larger, on every later write
+        columns, rows = self.columns, self.rows
+        self.columns = {name: [] for name, _ in COLUMNS}
+        self.rows = 0
+        try:
+            batch = pa.record_batch(
+                [pa.array(columns[field.name], type=field.type) for field in self.schema], schema=self.schema
+            )
+            if self.format == "parquet":
+                self.writer.write_batch(batch, row_group_size=rows)
+            else:
+                self.writer.write_batch(batch)
+        except Exception as e:
+            raise SinkError(f"dropped {rows} rows: {e}") from e
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        if self.file is not None:
+            self.file.close()
+
+
+class JsonlZstdSink:
+    def __init__(self, path, level=3, chunk_bytes=8 * 1024 * 1024):
+        if zstandard is None:
+            raise SinkUnavailable("zstandard is not installed (pip install zstandard)")
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.file = open(path, "wb")
+        self.stream = zstandard.ZstdCompressor(level=level).stream_writer(self.file)
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, record):
+        line = (json.dumps(record, ensure_ascii=False, default=_json_default) + "\n").encode("utf-8")
+        self.buffer.append(line)
+        self.buffered += len(line)
+        if self.buffered >= self.chunk_bytes:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        lines = self.buffer
+        self.buffer = []
+        self.buffered = 0
+        try:
+            self.stream.write(b"".join(lines))
+        except Exception as e:
+            raise SinkError(f"dropped {len(lines)} records: {e}") from e
+
+    def close(self):
+        self.flush()
+        self.stream.close()   # writes the zstd frame end and closes the file
+
+
+def new_sink(kind, path_prefix, row_group_size=50000, zstd_level=3, chunk_bytes=8 * 1024 * 1024):
+    """Open the sink for kind ("parquet", "arrow" or "jsonl_zst") at path_prefix + its extension."""
+    path = path_prefix + EXTENSIONS[kind]
+    if kind == "jsonl_zst":
+        return JsonlZstdSink(path, level=zstd_level, chunk_bytes=chunk_bytes)
+    return ColumnarSink(path, format=kind, row_group_size=row_group_size)
+
+
+class SinkWriter:
+    def __init__(self, sinks, queue_size=10000):
+        self.sinks = sinks
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.records = 0
+        self.errors = 0
+        self.last_error = None
+        self.thread = threading.Thread(target=self._run, name="result-sinks", daemon=True)
+        self.thread.start()
+
+    def submit(self, record):
+        """Queue one record; blocks only when queue_size records are already pending."""
+        self.queue.put(record)
+
+    def close(self):
+        """Write everything still queued, then flush and close every sink."""
+        self.queue.put(_STOP)
+        self.thread.join()
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                self.errors += 1
+                self.last_error = f"{os.path.basename(sink.path)}: {e}"
+
+    def _run(self):
+        while True:
+            record = self.queue.get()
+            if record is _STOP:
+                return
+            for sink in self.sinks:
+                try:
+                    sink.write(record)
+                except Exception as e:
+                    self.errors += 1
+                    self.last_error = f"{os.path.basename(sink.path)}: {e}"
+            self.records += 1
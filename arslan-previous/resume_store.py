@@ -0,0 +1,215 @@
+"""Local SQLite checkpoint of which domains a crawl has finished.
+
+Restarts look domains up here instead of scanning the MongoDB collection, and
+workers no longer ask MongoDB whether a domain exists before probing it.
+Status updates are buffered and committed in batches (every commit_every
+records or commit_interval seconds) so the store adds no per-domain fsync.
+
+Failed domains also keep their error class, how many runs in a row they
+failed and when they were last tried. With failure_ttls set, should_skip()
+lets a failure expire after the TTL of its class, so NXDOMAIN can stay
+skipped for weeks while a timeout is probed again a few hours later.
+
+With index_path set, a DomainIndex of every domain in the table (sorted
+64-bit hashes in a memory-mapped file, 8 bytes per domain) sits in front of
+it: a domain the index does not hold, which is every new domain of a fresh
+list, is answered without a SQLite query, and a hit is verified against the
+table. The index is saved on close() under a generation number that is also
+kept in the database and bumped when a writer opens it, so an index left
+behind by a crashed run no longer matches and is rebuilt from the table.
+"""
+import sqlite3
+import time
+from threading import Lock
+
+from domain_index import DomainIndex
+
+SUCCESS = "success"
+FAILED = "failed"
+
+_COLUMNS = {"error_class": "TEXT", "failures": "INTEGER NOT NULL DEFAULT 0"}
+
+
+class ResumeStore:
+    def __init__(self, path, commit_every=1000, commit_interval=2.0, failure_ttls=None, default_failure_ttl=None,
+                 index_path=None, readonly=False):
+        self.path = path
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.failure_ttls = failure_ttls              # error class -> seconds; None: failures never expire
+        self.default_failure_ttl = default_failure_ttl
+        self.lock = Lock()
+        self.pending = {}   # domain -> (status, updated_at, error_class), or None to delete
+        self.last_commit = time.monotonic()
+        # timeout: shard processes read while the parent writes
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS domains ("
+            " domain TEXT PRIMARY KEY,"
+            " status TEXT NOT NULL,"
+            " updated_at REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        # Stores created before failures were classified lack these columns
+        existing = {row[1] for row in self.conn.execute("PRAGMA table_info(domains)")}
+        for column, definition in _COLUMNS.items():
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE domains ADD COLUMN {column} {definition}")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.conn.commit()
+        self.index_path = index_path
+        self.readonly = readonly      # shard processes: read the store, never write the index
+        self.index = self._open_index() if index_path else None
+        self.index_misses = 0         # lookups answered by the index alone
+
+    def _open_index(self):
+        """Load the saved index if it matches the table's generation, else rebuild and save it."""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'index_generation'").fetchone()
+        generation = row[0] if row else 0
+        index = DomainIndex.load(self.index_path)
+        if self.readonly:
+            return index   # the writer (parent) opened the store first and brought the file up to date
+        if index is None or index.generation != generation:
+            if index is not None:
+                index.close()
+            started = time.time()
+            index = DomainIndex.build(
+                (domain for (domain,) in self.conn.execute("SELECT domain FROM domains")), generation
+            )
+            index.save(self.index_path, generation)   # for shard processes, which load the file
+            if len(index):
+                print(f"Rebuilt resume index {self.index_path}: {len(index)} domains in {time.time() - started:.1f}s")
+        self._advance_generation(index)
+        return index
+
+    def save_index(self):
+        """Save the index now (e.g. for shard processes about to load it)."""
+        with self.lock:
+            self._commit()
+            if self.index is not None and not self.readonly:
+                self.index.save(self.index_path, self.index.generation)
+                self._advance_generation(self.index)
+
+    def _advance_generation(self, index):
+        """Move the database on to the next generation: the saved file is stale until close() saves it again."""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('index_generation', ?)", (index.generation + 1,)
+            )
+        index.generation += 1
+
+    def status(self, domain):
+        """Return "success", "failed" or None if the domain has not been finished."""
+        entry = self._entry(domain)
+        return entry[0] if entry else None
+
+    def should_skip(self, domain, now=None):
+        """True if domain succeeded, or failed recently enough that its failure TTL has not run out."""
+        entry = self._entry(domain)
+        if entry is None:
+            return False
+        status, updated_at, error_class = entry
+        if status != FAILED or self.failure_ttls is None:
+            return True
+        ttl = self.failure_ttls.get(error_class, self.default_failure_ttl)
+        if ttl is None:
+            return True
+        return (now or time.time()) - updated_at < ttl
+
+    def mark(self, domain, status, error_class=None):
+        with self.lock:
+            if self.index is not None:
+                self.index.add(domain)
+            self.pending[domain] = (status, time.time(), error_class if status == FAILED else None)
+            self._maybe_commit()
+
+    def forget(self, domain):
+        """Drop a domain so the next run probes it again (e.g. its MongoDB write failed)."""
+        with self.lock:
+            self.pending[domain] = None
+            self._maybe_commit()
+
+    def import_failures(self, domains, error_class=None, updated_at=None):
+        """Add failures from an older source without overwriting what the store already knows."""
+        updated_at = updated_at or time.time()
+        with self.lock:
+            self._commit()
+            if self.index is not None:
+                domains = list(domains)
+                for domain in domains:
+                    self.index.add(domain)
+            with self.conn:
+                cursor = self.conn.executemany(
+                    "INSERT OR IGNORE INTO domains (domain, status, updated_at, error_class, failures)"
+                    " VALUES (?, ?, ?, ?, 1)",
+                    ((domain, FAILED, updated_at, error_class) for domain in domains),
+                )
+            return cursor.rowcount
+
+    def count(self):
+        self.flush()
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM domains").fetchone()[0]
+
+    def failure_counts(self):
+        """Number of failed domains per error class."""
+        self.flush()
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT error_class, COUNT(*) FROM domains WHERE status = ? GROUP BY error_class", (FAILED,)
+            ).fetchall()
+        return {error_class: n for error_class, n in rows}
+
+    def flush(self):
+        with self.lock:
+            self._commit()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            self.conn.close()
+            if self.index is not None:
+                if not self.readonly:
+                    self.index.save(self.index_path, self.index.generation)
+                self.index.close()
+
+    def _entry(self, domain):
+        """(status, updated_at, error_class) or None; pending updates win over the database."""
+        with self.lock:
+            if domain in self.pending:
+                return self.pending[domain]
+            if self.index is not None and domain not in self.index:
+                self.index_misses += 1
+                return None
+            return self.conn.execute(
+                "SELECT status, updated_at, error_class FROM domains WHERE domain = ?", (domain,)
+            ).fetchone()
+
+    # ---------------- Internals (caller holds self.lock) ----------------
+
+    def _maybe_commit(self):
+        if (len(self.pending) >= self.commit_every
+                or time.monotonic() - self.last_commit >= self.commit_interval):
+            self._commit()
+
+    def _commit(self):
+        if self.pending:
+            upserts = [
+                (d, e[0], e[1], e[2], 1 if e[0] == FAILED else 0)
+                for d, e in self.pending.items() if e is not None
+            ]
+            deletes = [(d,) for d, e in self.pending.items() if e is None]
+            with self.conn:
+                # failures counts consecutive failed runs and resets on success
+                self.conn.executemany(
+                    "INSERT INTO domains (domain, status, updated_at, error_class, failures) VALUES (?, ?, ?, ?, ?)"
+                    " ON CONFLICT(domain) DO UPDATE SET status = excluded.status,"
+                    " updated_at = excluded.updated_at, error_class = excluded.error_class,"
+                    " failures = CASE WHEN excluded.status = 'failed' THEN domains.failures + 1 ELSE 0 END",
+                    upserts,
+                )
+                self.conn.executemany("DELETE FROM domains WHERE domain = ?", deletes)
+            self.pending = {}
+        self.last_commit = time.monotonic()
@@ -0,0 +1,82 @@
+"""Time-ordered retry queue for failed connection attempts.
+
+Instead of sleeping inside a worker, a failed attempt is pushed onto a heap
+with the time it becomes eligible again and the worker moves on to the next
+domain. The backoff depends on the error class, e.g. timeouts can be retried
+with backoff while deterministic TLS failures are not retried at all.
+"""
+import asyncio
+import heapq
+import itertools
+import random
+import socket
+import ssl
+import time
+
+# Error classes produced by classify_error
+TIMEOUT = "timeout"
+REFUSED = "refused"
+SSL_ERROR = "ssl"
+DNS = "dns"
+OTHER = "other"
+NXDOMAIN = "nxdomain"   # set from the resolver's negative cache; never retried
+
+
+def classify_error(e):
+    """Map a connect/handshake exception to the error class used for retry policy."""
+    if isinstance(e, socket.gaierror):
+        return DNS
+    if isinstance(e, (socket.timeout, asyncio.TimeoutError)):
+        return TIMEOUT
+    if isinstance(e, ConnectionRefusedError):
+        return REFUSED
+    if isinstance(e, ssl.SSLError):
+        return SSL_ERROR
+    return OTHER
+
+
+class RetryPolicy:
+    def __init__(self, max_retries, backoff_base, max_delay=60.0):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.max_delay = max_delay
+
+    def delay(self, attempt, jitter):
+        """Seconds to wait before retry number attempt + 1."""
+        delay = min(self.backoff_base ** (attempt + 1), self.max_delay)
+        return delay * random.uniform(1 - jitter, 1 + jitter)
+
+
+class RetryScheduler:
+    def __init__(self, policies, default_policy, jitter=0.2):
+        self.policies = policies
+        self.default_policy = default_policy
+        self.jitter = jitter
+        self.heap = []
+        self.counter = itertools.count()  # tie-breaker so items never get compared
+
+    def __len__(self):
+        return len(self.heap)
+
+    def schedule(self, item, attempt, error_class):
+        """Queue item for another attempt; False if its error class has no retries left."""
+        policy = self.policies.get(error_class, self.default_policy)
+        if attempt >= policy.max_retries:
+            return False
+        due = time.monotonic() + policy.delay(attempt, self.jitter)
+        heapq.heappush(self.heap, (due, next(self.counter), item))
+        return True
+
+    def pop_due(self):
+        """Remove and return every item whose retry time has come."""
+        now = time.monotonic()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due.append(heapq.heappop(self.heap)[2])
+        return due
+
+    def next_due_in(self):
+        """Seconds until the earliest retry is eligible, or None when the queue is empty."""
+        if not self.heap:
+            return None
+        return max(self.heap[0][0] - time.monotonic(), 0.0)
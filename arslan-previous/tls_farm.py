@@ -0,0 +1,337 @@
+"""Local TLS server farm and stub resolver for offline benchmarks.
+
+TlsFarm generates a root CA, an intermediate and one leaf certificate per
+synthetic domain, then serves them from a few hundred loopback listeners in
+one or more farm processes. Several domains share a listener (virtual
+hosting via SNI), the way CDN edges do. Every listener has a kind:
+
+    ok        valid chain, answers at once
+    slow      valid chain, waits slow_delay seconds before the handshake
+    drop      accepts the connection and closes it straight away
+    invalid   self-signed, expired certificate (verification fails)
+    plain     speaks HTTP instead of TLS
+    nxdomain  no listener; the name does not resolve
+
+The crawlers connect to port 443 by name, so each listener gets an address
+from 198.18.0.0/15 (reserved for benchmarking, never routed). In the crawler
+process install_stub_resolver() answers getaddrinfo for the synthetic
+domains with those addresses and redirects connects to (address, 443) to the
+listener's real loopback port. No root privileges, hosts file or network are
+needed. Clients trust the farm through SSL_CERT_FILE=farm.ca_file.
+"""
+import asyncio
+import ipaddress
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import ssl
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+OK = "ok"
+SLOW = "slow"
+DROP = "drop"
+INVALID = "invalid"
+PLAIN = "plain"
+NXDOMAIN = "nxdomain"
+
+DEFAULT_MIX = {OK: 0.80, SLOW: 0.05, DROP: 0.04, INVALID: 0.05, PLAIN: 0.03, NXDOMAIN: 0.03}
+DOMAIN_SUFFIX = ".bench.test"
+FARM_NETWORK = ipaddress.ip_network("198.18.0.0/15")   # RFC 2544 benchmarking range
+
+_HTTP_RESPONSE = b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+
+class TlsFarm:
+    def __init__(self, domains=500, listeners=200, mix=None, slow_delay=0.5, processes=2, seed=1, workdir=None):
+        self.domain_count = domains
+        self.listener_count = listeners
+        self.mix = mix or DEFAULT_MIX
+        self.slow_delay = slow_delay
+        self.processes = processes
+        self.seed = seed
+        self.workdir = workdir
+        self.own_workdir = workdir is None
+        self.ca_file = None
+        self.kinds = {}      # domain -> kind
+        self.addresses = {}  # domain -> farm address (absent for nxdomain)
+        self.ports = {}      # farm address -> loopback port
+        self.workers = []    # (process, pipe)
+
+    def start(self):
+        """Generate the certificates, start the farm processes and wait until every listener is bound."""
+        if self.workdir is None:
+            self.workdir = tempfile.mkdtemp(prefix="tls-farm-")
+        listeners = self._plan()
+        groups = [listeners[i::self.processes] for i in range(self.processes)]
+        for group in groups:
+            if not group:
+                continue
+            parent_end, child_end = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_serve, args=(group, self.slow_delay, child_end), name="tls-farm", daemon=True
+            )
+            process.start()
+            self.workers.append((process, parent_end))
+        for _, pipe in self.workers:
+            self.ports.update(pipe.recv())
+        return self
+
+    def stop(self):
+        for process, pipe in self.workers:
+            try:
+                pipe.send(None)
+            except OSError:
+                pass
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.workers = []
+        if self.own_workdir and self.workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def domains(self):
+        return list(self.kinds)
+
+    def farm_map(self):
+        """Everything install_stub_resolver() needs, as a JSON-serialisable dict."""
+        return {"ca_file": self.ca_file, "kinds": self.kinds, "addresses": self.addresses, "ports": self.ports}
+
+    def write_map(self, path):
+        with open(path, "w") as f:
+            json.dump(self.farm_map(), f)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ---------------- Internals ----------------
+
+    def _plan(self):
+        """Assign kinds to domains and listeners, write the certificates, return listener specs."""
+        rng = random.Random(self.seed)
+        total = sum(self.mix.values())
+        counts = {kind: int(self.domain_count * share / total) for kind, share in self.mix.items()}
+        counts[OK] = counts.get(OK, 0) + self.domain_count - sum(counts.values())
+        kinds = [kind for kind, n in counts.items() for _ in range(n)]
+        rng.shuffle(kinds)
+        numbers = {}
+        for kind in kinds:
+            numbers[kind] = numbers.get(kind, 0) + 1
+            self.kinds[f"{kind}-{numbers[kind]:05d}{DOMAIN_SUFFIX}"] = kind
+
+        # Listeners per kind in proportion to its domains, at least one each
+        served = {kind: n for kind, n in counts.items() if n and kind != NXDOMAIN}
+        served_total = sum(served.values())
+        listener_kinds = []
+        for kind, n in served.items():
+            listener_kinds += [kind] * min(n, max(1, round(self.listener_count * n / served_total)))
+
+        root_key, root = _issue("Benchmark Farm Root CA", ca=True)
+        intermediate_key, intermediate = _issue("Benchmark Farm Intermediate CA", root_key, root, ca=True)
+        leaf_key = ec.generate_private_key(ec.SECP256R1())   # shared: only the certificates differ
+        self.ca_file = os.path.join(self.workdir, "root.pem")
+        _write_pem(self.ca_file, root)
+        key_file = os.path.join(self.workdir, "leaf.key")
+        with open(key_file, "wb") as f:
+            f.write(leaf_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                           serialization.NoEncryption()))
+
+        listeners = []
+        by_kind = {}
+        for index, kind in enumerate(listener_kinds):
+            address = str(FARM_NETWORK[index + 1])
+            spec = {"address": address, "kind": kind, "key_file": key_file, "certs": {}}
+            listeners.append(spec)
+            by_kind.setdefault(kind, []).append(spec)
+        turn = {}
+        for domain, kind in self.kinds.items():
+            if kind == NXDOMAIN:
+                continue
+            specs = by_kind[kind]
+            spec = specs[turn.get(kind, 0) % len(specs)]
+            turn[kind] = turn.get(kind, 0) + 1
+            self.addresses[domain] = spec["address"]
+            if kind in (OK, SLOW):
+                cert_file = os.path.join(self.workdir, domain + ".pem")
+                _write_pem(cert_file, _issue(domain, intermediate_key, intermediate, key=leaf_key)[1], intermediate)
+                spec["certs"][domain] = cert_file
+            elif kind == INVALID:
+                cert_file = os.path.join(self.workdir, domain + ".pem")
+                _write_pem(cert_file, _issue(domain, key=leaf_key, expired=True)[1])
+                spec["certs"][domain] = cert_file
+        return listeners
+
+
+def _issue(common_name, issuer_key=None, issuer=None, ca=False, key=None, expired=False):
+    """(key, certificate) for common_name, self-signed unless issuer_key/issuer are given."""
+    key = key or ec.generate_private_key(ec.SECP256R1())
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name),
+                         x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Benchmark Farm")])
+    now = datetime.now(timezone.utc)
+    not_before, not_after = (now - timedelta(days=60), now - timedelta(days=30)) if expired else (now - timedelta(days=1), now + timedelta(days=90))
+    builder = (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(issuer.subject if issuer else subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(not_before)
+        .not_valid_after(not_after)
+        .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+    )
+    if ca:
+        builder = builder.add_extension(
+            x509.KeyUsage(digital_signature=True, content_commitment=False, key_encipherment=False,
+                          data_encipherment=False, key_agreement=False, key_cert_sign=True, crl_sign=True,
+                          encipher_only=False, decipher_only=False), critical=True)
+    else:
+        builder = builder.add_extension(x509.SubjectAlternativeName([x509.DNSName(common_name)]), critical=False)
+    return key, builder.sign(issuer_key or key, hashes.SHA256())
+
+
+def _write_pem(path, *certificates):
+    with open(path, "wb") as f:
+        for certificate in certificates:
+            f.write(certificate.public_bytes(serialization.Encoding.PEM))
+
+
+# ---------------- Farm process ----------------
+
+def _serve(listeners, slow_delay, pipe):
+    asyncio.run(_serve_async(listeners, slow_delay, pipe))
+
+
+async def _serve_async(listeners, slow_delay, pipe):
+    loop = asyncio.get_running_loop()
+    ports = {}
+    servers = []
+    for spec in listeners:
+        kind = spec["kind"]
+        context = _server_context(spec) if spec["certs"] else None
+        if kind in (OK, INVALID):
+            server = await loop.create_server(_Close, "127.0.0.1", 0, ssl=context, backlog=1024)
+        elif kind == SLOW:
+            server = await loop.create_server(lambda c=context: _SlowHandshake(c, slow_delay), "127.0.0.1", 0, backlog=1024)
+        elif kind == DROP:
+            server = await loop.create_server(_Drop, "127.0.0.1", 0, backlog=1024)
+        else:
+            server = await loop.create_server(_Plain, "127.0.0.1", 0, backlog=1024)
+        servers.append(server)
+        ports[spec["address"]] = server.sockets[0].getsockname()[1]
+    pipe.send(ports)
+    await loop.run_in_executor(None, pipe.recv)   # parent sends None to stop
+    for server in servers:
+        server.close()
+
+
+def _server_context(spec):
+    """Listener context that switches to the requested domain's certificate by SNI."""
+    contexts = {}
+    for domain, cert_file in spec["certs"].items():
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_file, spec["key_file"])
+        contexts[domain] = context
+    default = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    default.load_cert_chain(next(iter(spec["certs"].values())), spec["key_file"])
+
+    def select(ssl_object, server_name, _):
+        context = contexts.get(server_name)
+        if context is not None:
+            ssl_object.context = context
+
+    default.sni_callback = select
+    return default
+
+
+class _Close(asyncio.Protocol):
+    """Handshake done (the server context did it): close."""
+
+    def connection_made(self, transport):
+        transport.close()
+
+
+class _Drop(asyncio.Protocol):
+    def connection_made(self, transport):
+        transport.abort()
+
+
+class _Plain(asyncio.Protocol):
+    def connection_made(self, transport):
+        transport.write(_HTTP_RESPONSE)
+        transport.close()
+
+
+class _SlowHandshake(asyncio.Protocol):
+    def __init__(self, context, delay):
+        self.context = context
+        self.delay = delay
+
+    def connection_made(self, transport):
+        transport.pause_reading()   # leave the ClientHello for the TLS layer
+        asyncio.get_running_loop().create_task(self._handshake(transport))
+
+    async def _handshake(self, transport):
+        await asyncio.sleep(self.delay)
+        try:
+            tls_transport = await asyncio.get_running_loop().start_tls(
+                transport, asyncio.Protocol(), self.context, server_side=True
+            )
+            tls_transport.close()
+        except (OSError, ssl.SSLError, ConnectionError, RuntimeError):
+            transport.abort()
+
+
+# ---------------- Client side ----------------
+
+def install_stub_resolver(farm_map):
+    """Point the synthetic domains of farm_map at the farm, for this process only.
+
+    Patches socket.getaddrinfo (farm domains resolve to their farm address,
+    other names under DOMAIN_SUFFIX fail with NXDOMAIN, everything else is
+    resolved normally) and socket.socket.connect/connect_ex (a connect to a
+    farm address on port 443 goes to its loopback listener). Blocking
+    sockets, socket.create_connection and asyncio's sock_connect all pass
+    through these.
+    """
+    addresses = farm_map["addresses"]
+    ports = {address: int(port) for address, port in farm_map["ports"].items()}
+    real_getaddrinfo = socket.getaddrinfo
+    real_connect = socket.socket.connect
+    real_connect_ex = socket.socket.connect_ex
+
+    def getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+        name = host.decode() if isinstance(host, bytes) else host
+        if isinstance(name, str):
+            name = name.lower().rstrip(".")
+            if name in addresses:
+                return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "",
+                         (addresses[name], int(port or 0)))]
+            if name.endswith(DOMAIN_SUFFIX):
+                raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return real_getaddrinfo(host, port, family, type, proto, flags)
+
+    def redirect(address):
+        if isinstance(address, tuple) and len(address) >= 2 and address[1] == 443 and address[0] in ports:
+            return ("127.0.0.1", ports[address[0]])
+        return address
+
+    def connect(self, address):
+        return real_connect(self, redirect(address))
+
+    def connect_ex(self, address):
+        return real_connect_ex(self, redirect(address))
+
+    socket.getaddrinfo = getaddrinfo
+    socket.socket.connect = connect
+    socket.socket.connect_ex = connect_ex
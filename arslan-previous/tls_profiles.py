@@ -0,0 +1,72 @@
+"""SSL contexts built once per probe profile and shared by every connection.
+
+ssl.create_default_context() loads the whole system CA store, which costs
+milliseconds of CPU; doing it per domain showed up in profiles. A context is
+safe to use from many threads and event-loop tasks at once, so ContextPool
+builds one per profile on first use and hands the same object out after that.
+
+Profiles:
+    verify      default verification (chain and hostname)
+    no_verify   no verification, so invalid chains are still captured
+    tls1_2      TLS 1.2 only, no verification
+    tls1_3      TLS 1.3 only, no verification
+"""
+import ssl
+import threading
+
+VERIFY = "verify"
+NO_VERIFY = "no_verify"
+
+PROFILES = {
+    VERIFY: {"verify": True},
+    NO_VERIFY: {"verify": False},
+    "tls1_2": {"verify": False, "version": ssl.TLSVersion.TLSv1_2},
+    "tls1_3": {"verify": False, "version": ssl.TLSVersion.TLSv1_3},
+}
+
+
+def verifies(profile):
+    return PROFILES[profile]["verify"]
+
+
+def build_context(profile, alpn_protocols=None):
+    """Create the SSLContext for one profile."""
+    spec = PROFILES[profile]
+    context = ssl.create_default_context()
+    if not spec["verify"]:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    version = spec.get("version")
+    if version is not None:
+        context.minimum_version = version
+        context.maximum_version = version
+    if alpn_protocols:
+        context.set_alpn_protocols(list(alpn_protocols))
+    return context
+
+
+class ContextPool:
+    def __init__(self, alpn_protocols=None):
+        self.alpn_protocols = alpn_protocols
+        self.contexts = {}
+        self.lock = threading.Lock()
+
+    def get(self, profile):
+        context = self.contexts.get(profile)
+        if context is None:
+            with self.lock:
+                context = self.contexts.get(profile)
+                if context is None:
+                    context = self.contexts[profile] = build_context(profile, self.alpn_protocols)
+        return context
+
+
+def describe_handshake(ssl_object):
+    """Negotiated protocol version, cipher and ALPN of an open SSLSocket/SSLObject."""
+    cipher = ssl_object.cipher()
+    return {
+        "version": ssl_object.version(),
+        "cipher": cipher[0] if cipher else None,
+        "cipher_bits": cipher[2] if cipher else None,
+        "alpn": ssl_object.selected_alpn_protocol(),
+    }
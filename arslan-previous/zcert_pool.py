@@ -0,0 +1,210 @@
+"""Pool of long-lived zcertificate processes fed with batches of PEMs.
+
+Each process reads concatenated PEM blocks on stdin and writes one JSON
+document per certificate on stdout. Results are matched back to their
+request by the "raw" (base64 DER) field zcertificate includes in every
+document, so output order does not matter. A process that exits or does not
+answer within the batch timeout is killed and restarted; the certificates in
+that batch fail with a ZCertificateError.
+"""
+import base64
+import json
+import queue
+import ssl
+import subprocess
+import threading
+import time
+from concurrent.futures import Future
+
+ZCERT_COMMAND = ["zcertificate.exe", "-format", "pem"]
+
+
+class ZCertificateError(Exception):
+    pass
+
+
+class _ZCertificateProcess:
+    """One zcertificate child plus a thread draining its stdout into a line queue."""
+
+    def __init__(self, command):
+        self.proc = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        self.lines = queue.Queue()
+        self.reader = threading.Thread(target=self._read_stdout, daemon=True)
+        self.reader.start()
+
+    def _read_stdout(self):
+        for line in self.proc.stdout:
+            self.lines.put(line)
+        self.lines.put(None)  # EOF: process exited
+
+    def send(self, pem_blocks):
+        self.proc.stdin.write("".join(pem_blocks).encode("utf-8"))
+        self.proc.stdin.flush()
+
+    def exit_code(self):
+        try:
+            return self.proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            return None
+
+    def kill(self):
+        try:
+            self.proc.kill()
+            self.proc.wait(timeout=5)
+        except Exception:
+            pass
+
+
+class ZCertificatePool:
+    def __init__(self, size=4, batch_size=64, flush_interval=0.05, batch_timeout=10,
+                 command=ZCERT_COMMAND):
+        self.size = size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.batch_timeout = batch_timeout
+        self.command = command
+        self.pending = queue.Queue()
+        self.restarts = 0
+        self.closed = False
+        self.threads = [
+            threading.Thread(target=self._worker, name=f"zcert-{i}", daemon=True)
+            for i in range(size)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, pem_data):
+        """Queue one PEM; returns a Future resolving to the parsed zcertificate JSON."""
+        future = Future()
+        if self.closed:
+            future.set_exception(ZCertificateError("zcertificate pool is closed"))
+        else:
+            self.pending.put((pem_data, future))
+        return future
+
+    def parse(self, pem_data):
+        """Blocking helper: submit and wait for this certificate's batch to finish."""
+        # The worker always resolves the future within batch_timeout once the
+        # batch is sent; the extra slack covers the time spent queued.
+        return self.submit(pem_data).result(timeout=self.batch_timeout + self.flush_interval + 60)
+
+    def close(self):
+        self.closed = True
+        for _ in self.threads:
+            self.pending.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    # ---------------- Worker ----------------
+
+    def _next_batch(self):
+        """Block for the first item, then gather more until batch_size or flush_interval."""
+        item = self.pending.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Put the shutdown marker back so this worker exits after the batch
+                self.pending.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _worker(self):
+        process = None
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            if process is not None and process.proc.poll() is not None:
+                process = None
+                self.restarts += 1
+            if process is None:
+                try:
+                    process = _ZCertificateProcess(self.command)
+                except Exception as e:
+                    for _, future in batch:
+                        future.set_exception(ZCertificateError(f"Error starting zcertificate: {e}"))
+                    continue
+            if not self._run_batch(process, batch):
+                process.kill()
+                process = None
+                self.restarts += 1
+        if process is not None:
+            try:
+                process.proc.stdin.close()
+            except Exception:
+                pass
+            process.kill()
+
+    def _run_batch(self, process, batch):
+        """Send one batch and demultiplex its output. Returns False if the process must be restarted."""
+        waiting = {}
+        pem_blocks = []
+        for pem_data, future in batch:
+            try:
+                raw = base64.b64encode(ssl.PEM_cert_to_DER_cert(pem_data)).decode("ascii")
+            except Exception as e:
+                future.set_exception(ZCertificateError(f"Invalid PEM: {e}"))
+                continue
+            if raw not in waiting:
+                # Identical certificates in one batch are parsed once
+                waiting[raw] = []
+                pem_blocks.append(pem_data)
+            waiting[raw].append(future)
+        if not waiting:
+            return True
+
+        try:
+            process.send(pem_blocks)
+        except Exception as e:
+            self._fail_all(waiting, f"zcertificate crashed: {e}")
+            return False
+
+        deadline = time.monotonic() + self.batch_timeout
+        while waiting:
+            remaining = deadline - time.monotonic()
+            try:
+                line = process.lines.get(timeout=max(remaining, 0))
+            except queue.Empty:
+                self._fail_all(waiting, f"zcertificate timed out after {self.batch_timeout}s")
+                return False
+            if line is None:
+                self._fail_all(waiting, f"zcertificate exited with code {process.exit_code()}")
+                return False
+            if not line.strip():
+                continue
+            try:
+                parsed_json = json.loads(line)
+            except json.JSONDecodeError:
+                # Without "raw" a malformed line cannot be attributed; the
+                # certificate it belonged to fails when the batch times out.
+                continue
+            futures = waiting.pop(parsed_json.get("raw"), None)
+            if futures:
+                futures[0].set_result(parsed_json)
+                for future in futures[1:]:
+                    # Callers mutate the document (domain is added), so each gets its own copy
+                    future.set_result(json.loads(line))
+        return True
+
+    @staticmethod
+    def _fail_all(waiting, message):
+        for futures in waiting.values():
+            for future in futures:
+                future.set_exception(ZCertificateError(message))
+        waiting.clear()